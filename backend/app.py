@@ -1,26 +1,186 @@
 import time
+from datetime import datetime, timezone
 
 from bson import ObjectId
-from flask import Flask, jsonify, send_from_directory, request, redirect, session
-import os, requests
+from flask import Flask, Response, jsonify, send_file, request, redirect, session, g
+from flask.json.provider import DefaultJSONProvider
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from werkzeug.http import parse_accept_header
+import os, re, requests, threading, random, json, secrets, queue, hashlib, mimetypes, sys, traceback
+import cProfile, pstats
+import contextlib, fcntl, struct
+import click
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 from flask_cors import CORS
-from pymongo import MongoClient, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT, CursorType, ReturnDocument, UpdateOne, UpdateMany
+from pymongo.errors import BulkWriteError, CollectionInvalid, ConnectionFailure, OperationFailure
+from pymongo import monitoring
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
 from authlib.common.security import generate_token
 from authlib.integrations.flask_client import OAuth
 from functools import wraps
+import gzip, zlib
+
+# optional codecs: brotli writes .br static siblings and both add API response encodings,
+# gzip (stdlib) always works
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# optional: faster JSON encoding for jsonify (see FastJSONProvider)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # CONSTANTS
 # directory from which the assets created by the frontend build process are located.
 BUILD_DIR = os.path.join(os.path.dirname(__file__), "build")
+# svelte emits content-hashed bundles under _app/immutable/, those never change under the same url
+STATIC_IMMUTABLE_MAX_AGE = int(os.getenv("STATIC_IMMUTABLE_MAX_AGE", 31536000)) # one year
+# precompressed siblings written by `flask precompress-assets`, in order of preference
+STATIC_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# text-like assets worth precompressing, images and woff/woff2 fonts are already compressed
+STATIC_COMPRESSIBLE_TYPES = (".html", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".xml", ".map", ".otf", ".ttf", ".webmanifest")
+STATIC_COMPRESS_MIN_BYTES = 1024
+# API response compression (compress_response), trade CPU per response against bytes on the wire
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024)) # smaller bodies aren't worth the framing
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6)) # gzip 1-9
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4)) # 0-11, above ~5 gets expensive for dynamic bodies
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", 3)) # 1-22
+# streamed bodies are flushed to the client once this much input is buffered, or this long after the last flush
+COMPRESS_STREAM_FLUSH_BYTES = int(os.getenv("COMPRESS_STREAM_FLUSH_BYTES", 32 * 1024))
+COMPRESS_STREAM_FLUSH_SECONDS = float(os.getenv("COMPRESS_STREAM_FLUSH_SECONDS", 1))
 # removed previous constants as not in use
 BASE_NYT_URL = "https://api.nytimes.com/svc/search/v2/articlesearch.json"
-
-# flask app init, serves all static files from the build directory to the frontend
-app = Flask(__name__, static_folder=os.path.join(BUILD_DIR), static_url_path='/')
+# NYT upstream client: pooled connections, client-side quota and retries
+NYT_CONNECT_TIMEOUT = float(os.getenv("NYT_CONNECT_TIMEOUT", 3.05)) # seconds
+NYT_READ_TIMEOUT = float(os.getenv("NYT_READ_TIMEOUT", 10))
+NYT_POOL_SIZE = int(os.getenv("NYT_POOL_SIZE", 10)) # keep-alive connections per worker
+NYT_RATE_PER_MINUTE = float(os.getenv("NYT_RATE_PER_MINUTE", 5)) # NYT asks for 12s between calls
+NYT_RATE_BURST = int(os.getenv("NYT_RATE_BURST", 5))
+# when set, every worker process on the host shares one token bucket kept in this file (gunicorn.conf.py
+# sets it), otherwise each process enforces NYT_RATE_PER_MINUTE on its own
+NYT_RATE_STATE_FILE = os.getenv("NYT_RATE_STATE_FILE")
+NYT_MAX_QUEUE_WAIT = float(os.getenv("NYT_MAX_QUEUE_WAIT", 2)) # seconds a request may wait for a token before failing fast
+NYT_MAX_RETRIES = int(os.getenv("NYT_MAX_RETRIES", 2)) # per request
+NYT_RETRY_BUDGET_RATIO = float(os.getenv("NYT_RETRY_BUDGET_RATIO", 0.2)) # retries allowed per request across the worker
+# /api/search response cache, sized and timed via env
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 512)) # max cached searches
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 300)) # seconds an entry is fresh
+SEARCH_CACHE_STALE_TTL = float(os.getenv("SEARCH_CACHE_STALE_TTL", 900)) # extra seconds it may be served stale
+# speculative fetch of page n+1 after serving page n
+SEARCH_PREFETCH_ENABLED = os.getenv("SEARCH_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_PREFETCH_WORKERS = int(os.getenv("SEARCH_PREFETCH_WORKERS", 2))
+SEARCH_PREFETCH_MAX_PENDING = int(os.getenv("SEARCH_PREFETCH_MAX_PENDING", 8))
+# rate limiter tokens that must stay available for user searches, below this prefetches are dropped
+SEARCH_PREFETCH_MIN_TOKENS = float(os.getenv("SEARCH_PREFETCH_MIN_TOKENS", 2))
+NYT_MAX_PAGE = 100 # the Article Search API rejects pages past 100
+NYT_PAGE_SIZE = 10 # results per Article Search page, a shorter page is the last one
+# seconds a request waits on an identical in-flight search before giving up
+SEARCH_FLIGHT_TIMEOUT = float(os.getenv("SEARCH_FLIGHT_TIMEOUT", 15))
+# seconds an article stays in the articles collection after it was last seen in a search
+ARTICLE_STORE_TTL = int(os.getenv("ARTICLE_STORE_TTL", 30 * 24 * 3600))
+MAX_ARTICLE_BATCH_SIZE = 100 # ids per /api/articles/batch request
+# connections per process, pre-forked deployments get one pool per worker
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+# request profiling (see RequestProfiler), reports are kept per worker
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", 0)) # profile 1 in N requests, 0 = only on X-Profile
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", 50)) # reports kept, oldest dropped first
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 2.0)) # stack-sample requests running longer, 0 = off
+PROFILE_TOP_FUNCTIONS = 25
+PROFILE_TREE_DEPTH = 8
+PROFILE_TREE_CHILDREN = 8
+# page size bounds for the paginated comment endpoints
+DEFAULT_COMMENT_PAGE_SIZE = 20
+MAX_COMMENT_PAGE_SIZE = 100
+# max comments returned by one delta ("since") sync, clients call again while hasMore is set
+MAX_COMMENT_DELTA_SIZE = 500
+# max article ids per /api/comments/counts request (about one page of search results)
+MAX_COUNT_BATCH_SIZE = 100
+# max operations per /api/comments/moderate/bulk request
+MAX_BULK_MODERATION_OPS = 500
+# documents per cursor batch for /api/comments/export, bounds server memory during exports
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# bulk ingest (/api/comments/ingest and flask ingest-comments)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000)) # records per insert_many
+MAX_INGEST_BATCH_SIZE = 10000
+MAX_INGEST_ERRORS = 1000 # per-record errors kept in the report, the rest are only counted
+INGEST_PARENT_CACHE_SIZE = 100000 # recently ingested comments kept in memory to resolve replies
+# /api/comments/search: relevance ordered, so it pages by offset, capped to keep skips cheap
+MAX_COMMENT_SEARCH_RESULTS = 1000
+MAX_COMMENT_SEARCH_QUERY_LENGTH = 200
+COMMENT_SNIPPET_LENGTH = 160 # characters of content around the first match
+# live comment events (/api/articles/<id>/comments/stream)
+# cross-worker fan-out: "capped" (tail the comment_events capped collection, works on a standalone
+# server), "changestream" (same collection through a change stream, needs a replica set) or "local"
+SSE_FANOUT = os.getenv("SSE_FANOUT", "capped").lower()
+SSE_EVENT_LOG_BYTES = int(os.getenv("SSE_EVENT_LOG_BYTES", 16 * 1024 * 1024)) # size of the capped event log
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", 100)) # undelivered events per connection before it is reset
+SSE_REPLAY_SIZE = 100 # max events replayed on Last-Event-ID resume, and kept per article in local mode
+SSE_REPLAY_ARTICLES = 1000 # articles with recent events kept in local mode
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15)) # seconds, keeps proxies from closing idle streams
+SSE_MAX_STREAM_SECONDS = float(os.getenv("SSE_MAX_STREAM_SECONDS", 300)) # clients reconnect (and resume) after this
+SSE_RETRY_MS = 3000 # reconnect delay suggested to EventSource
+# event sequence numbers are taken before the insert, so workers publishing at the same time can
+# land in the log slightly out of order. The follower re-reads this many numbers behind its position.
+SSE_SEQ_REORDER_WINDOW = 100
+# open streams per Flask worker, each holds a gunicorn thread for up to SSE_MAX_STREAM_SECONDS,
+# keep it below GUNICORN_THREADS so regular requests still get served (asgi.py has no such cap)
+SSE_MAX_FLASK_STREAMS = int(os.getenv("SSE_MAX_FLASK_STREAMS", 2))
+CHANGE_STREAM_HISTORY_LOST = 286 # server error code when a resume token has left the oplog
+# reply thread assembly limits
+DEFAULT_THREAD_DEPTH = 3
+MAX_THREAD_DEPTH = 10
+MAX_THREAD_DOCS = 5000 # hard cap on documents read to assemble one thread
+# server-side sessions, the cookie only carries an opaque session id
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "mongo").lower() # "mongo" (shared by all workers) or "memory"
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 24 * 3600)) # seconds a session lives after it was last written
+SESSION_MEMORY_SIZE = int(os.getenv("SESSION_MEMORY_SIZE", 10000)) # sessions kept by the in-process store
+# seconds a worker may reuse a session it read from Mongo, bounds how long a logout takes to reach other workers
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 10))
+SESSION_MISS_TTL = float(os.getenv("SESSION_MISS_TTL", 5)) # seconds a worker remembers an unknown or expired session id
+# dex signing keys are reused for JWKS_CACHE_TTL seconds, unknown key ids refresh at most once per interval
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", 3600))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", 30))
+
+# flask app init, the build directory is served by serve_frontend from a startup manifest
+# instead of flask's static route (which would stat every request and shadow the spa fallback)
+app = Flask(__name__, static_folder=None)
 CORS(app)  # this is the function to allow for different front and backend IP's when developing
 
-app.secret_key = os.urandom(24)
+
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE) if orjson else 0
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify through orjson when it's installed, several times faster than the stdlib encoder on
+    long comment lists. Debug pretty-printing and anything orjson refuses (e.g. ints over 64 bits)
+    go through the default provider, datetimes keep Flask's HTTP date format.
+    """
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+        except TypeError: # orjson.JSONEncodeError
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+# set SECRET_KEY so every worker (and restart) signs the OAuth state the same way
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(24)
 
 
 oauth = OAuth(app)
@@ -40,7 +200,7 @@ elif not REGISTERED_OIDC_CLIENT_NAME.isidentifier():
 nonce = generate_token()
 
 # ---------- DEX SET UP  ----------
-oauth.register(
+oidc_client = oauth.register(
     name=REGISTERED_OIDC_CLIENT_NAME,
     client_id=os.getenv('OIDC_CLIENT_ID'),
     client_secret=os.getenv('OIDC_CLIENT_SECRET'),
@@ -53,25 +213,1002 @@ oauth.register(
     client_kwargs={'scope': 'openid email profile'}
 )
 
+# ---------- METRICS ----------
+# Prometheus metrics served by /metrics. Under gunicorn every worker writes its samples to
+# PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) and /metrics merges them, so a scrape sees
+# the whole server whichever worker answers it. Observing a sample is a dict lookup and a locked add.
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to produce a response (headers, for streamed bodies)",
+    ["method", "route", "status"]
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trip as reported by the driver",
+    ["command", "outcome"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+MONGO_CHECKOUT_SECONDS = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection",
+    ["outcome"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+NYT_REQUEST_SECONDS = Histogram(
+    "nyt_request_duration_seconds", "NYT Article Search API calls, one sample per attempt",
+    ["status"]
+)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # the driver already measured the round trip, succeeded/failed events carry it
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.labels(event.command_name, "ok").observe(event.duration_micros / 1e6)
+        record_request_mongo(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.labels(event.command_name, "error").observe(event.duration_micros / 1e6)
+        record_request_mongo(event)
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    # checkout started/finished fire on the requesting thread, so the start time lives in a thread local
+    def __init__(self):
+        self._checkout = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._checkout.started = time.perf_counter()
+
+    def _observe(self, outcome):
+        started = getattr(self._checkout, "started", None)
+        if started is not None:
+            MONGO_CHECKOUT_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+            self._checkout.started = None
+
+    def connection_checked_out(self, event):
+        self._observe("ok")
+
+    def connection_check_out_failed(self, event):
+        self._observe(event.reason)
+
+    # the rest of the pool lifecycle isn't measured
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
+
+# passed to every MongoClient (and Motor client in asgi.py)
+MONGO_EVENT_LISTENERS = [MongoCommandMetrics(), MongoPoolMetrics()]
+
+def observe_request(method, route, status, seconds):
+    HTTP_REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+def observe_nyt_request(status, seconds):
+    # status is the HTTP status code, or "error" when no response came back
+    NYT_REQUEST_SECONDS.labels(str(status)).observe(seconds)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is not None:
+        # the rule template, not the path, keeps label values bounded
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+    return response
+
+def metrics_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+# ---------- PROFILING ----------
+
+# the RequestTrace of the request running on this thread, if it is being traced
+request_trace = threading.local()
+
+def record_request_mongo(event):
+    # command listeners fire on the thread that ran the command, i.e. the request's thread
+    trace = getattr(request_trace, "current", None)
+    if trace is not None:
+        trace.record_mongo(event.command_name, event.duration_micros / 1e6)
+
+class RequestTrace:
+    # one in-flight request watched by the profiler
+    def __init__(self, method, path, trigger, profile):
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.profile = profile
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.mongo = {} # command name -> [count, seconds]
+        self.report = None # set once the request shows up in the ring buffer
+
+    def record_mongo(self, command_name, seconds):
+        totals = self.mongo.setdefault(command_name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    def mongo_summary(self):
+        return {
+            "operations": sum(count for count, _ in self.mongo.values()),
+            "seconds": round(sum(seconds for _, seconds in self.mongo.values()), 6),
+            "byCommand": {name: {"count": count, "seconds": round(seconds, 6)} for name, (count, seconds) in self.mongo.items()}
+        }
+
+def profile_function_name(func):
+    file_name, line, name = func
+    # builtins are ('~', 0, '<built-in method ...>')
+    return name if file_name == "~" else f"{os.path.basename(file_name)}:{line}({name})"
+
+def profile_summary(profile, top_n=PROFILE_TOP_FUNCTIONS):
+    """Top functions by cumulative time and a pruned call tree from a finished cProfile run."""
+    entries = pstats.Stats(profile).stats # func -> (primitive calls, calls, own time, cumulative time, callers)
+    top_functions = [
+        {"function": profile_function_name(func), "calls": calls, "ownSeconds": round(own, 6), "cumulativeSeconds": round(cumulative, 6)}
+        for func, (_, calls, own, cumulative, _) in sorted(entries.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+    ]
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, (_, calls, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, calls, cumulative))
+    roots = [(func, stats[1], stats[3]) for func, stats in entries.items() if not stats[4]]
+    total = sum(cumulative for _, _, cumulative in roots) or 1e-9
+
+    def node(func, calls, cumulative, depth, ancestors):
+        children = []
+        if depth < PROFILE_TREE_DEPTH:
+            # only branches worth at least 1% of the request, recursion is cut at the first repeat
+            ranked = sorted(callees.get(func, ()), key=lambda child: child[2], reverse=True)[:PROFILE_TREE_CHILDREN]
+            children = [
+                node(child, child_calls, child_cumulative, depth + 1, ancestors | {func})
+                for child, child_calls, child_cumulative in ranked
+                if child_cumulative >= total * 0.01 and child not in ancestors
+            ]
+        return {"function": profile_function_name(func), "calls": calls, "cumulativeSeconds": round(cumulative, 6), "children": children}
+
+    call_tree = [node(func, calls, cumulative, 0, frozenset()) for func, calls, cumulative in sorted(roots, key=lambda root: root[2], reverse=True)]
+    return {"topFunctions": top_functions, "callTree": call_tree}
+
+class RequestProfiler:
+    """
+    Opt-in request profiling and slow request capture, per worker.
+
+    A request runs under cProfile when an admin sends X-Profile: 1 or when it is the sampled 1 in
+    sample_rate. Its report (top functions, call tree, MongoDB commands) goes into a ring buffer
+    read by /api/admin/profiles. A watchdog thread samples the stack of any request still running
+    after slow_seconds, so the report shows where a slow request was stuck, not only that it was slow.
+    """
+    def __init__(self, buffer_size=PROFILE_BUFFER_SIZE, sample_rate=PROFILE_SAMPLE_RATE, slow_seconds=SLOW_REQUEST_SECONDS):
+        self.reports = deque(maxlen=buffer_size)
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self._in_flight = {} # thread id -> RequestTrace
+        self._requests_seen = 0
+        self._report_count = 0
+        self._watchdog_pid = None
+        self.profiled = 0
+        self.slow = 0
+
+    def should_profile(self, admin_requested):
+        if admin_requested:
+            return "header"
+        if self.sample_rate > 0:
+            with self._lock:
+                self._requests_seen += 1
+                if self._requests_seen % self.sample_rate == 0:
+                    return "sampled"
+        return None
+
+    def start(self, method, path, trigger):
+        # returns the request's trace, None when the request is neither profiled nor watched
+        if trigger is None and self.slow_seconds <= 0:
+            return None
+        profile = cProfile.Profile() if trigger else None
+        trace = RequestTrace(method, path, trigger, profile)
+        if self.slow_seconds > 0:
+            self._ensure_watchdog()
+            with self._lock:
+                self._in_flight[trace.thread_id] = trace
+        request_trace.current = trace
+        if profile is not None:
+            profile.enable()
+        return trace
+
+    def finish(self, trace, status):
+        if trace.profile is not None:
+            trace.profile.disable()
+        request_trace.current = None
+        duration = time.perf_counter() - trace.started
+        is_slow = self.slow_seconds > 0 and duration >= self.slow_seconds
+        # the watchdog only reports requests past slow_seconds, so a fast request has no report
+        if trace.profile is None and not is_slow:
+            with self._lock:
+                self._in_flight.pop(trace.thread_id, None)
+            return None
+        # built before taking the lock, summarizing a profile takes a few milliseconds
+        fields = {"status": status, "running": False, "durationSeconds": round(duration, 6), "mongo": trace.mongo_summary()}
+        if trace.profile is not None:
+            fields.update(profile_summary(trace.profile))
+        with self._lock:
+            # from here on the watchdog no longer sees this request
+            self._in_flight.pop(trace.thread_id, None)
+            report = trace.report or self._new_report(trace)
+            report.update(fields)
+            self.profiled += trace.profile is not None
+            self.slow += is_slow
+        return report
+
+    def _new_report(self, trace, **fields):
+        # callers hold self._lock
+        self._report_count += 1
+        report = {
+            # the pid keeps ids unique across gunicorn workers
+            "id": f"{os.getpid()}-{self._report_count}",
+            "kind": "profile" if trace.profile is not None else "slow",
+            "trigger": trace.trigger or "slow",
+            "method": trace.method,
+            "path": trace.path,
+            "startedAt": trace.started_at,
+            "running": True,
+            "stack": None,
+            **fields
+        }
+        trace.report = report
+        self.reports.append(report)
+        return report
+
+    def _ensure_watchdog(self):
+        # one watchdog per process, threads don't survive gunicorn's fork
+        with self._lock:
+            if self._watchdog_pid == os.getpid():
+                return
+            self._watchdog_pid = os.getpid()
+        threading.Thread(target=self._watch, name="slow-request-watchdog", daemon=True).start()
+
+    def _watch(self):
+        interval = max(0.05, min(1.0, self.slow_seconds / 4))
+        while True:
+            time.sleep(interval)
+            self.sample_slow_requests()
+
+    def sample_slow_requests(self):
+        now = time.perf_counter()
+        with self._lock:
+            overdue = [trace for trace in self._in_flight.values() if trace.report is None and now - trace.started >= self.slow_seconds]
+        if not overdue:
+            return
+        frames = sys._current_frames()
+        for trace in overdue:
+            frame = frames.get(trace.thread_id)
+            # innermost frames last, where the request was when it crossed the threshold
+            stack = traceback.format_stack(frame)[-40:] if frame is not None else []
+            with self._lock:
+                if trace.thread_id not in self._in_flight or trace.report is not None:
+                    continue # finished while we were sampling, the thread is doing something else now
+                report = self._new_report(trace, stack=stack, stackSampledAfterSeconds=round(now - trace.started, 6))
+            app.logger.warning(f"Slow request {trace.method} {trace.path} still running after {self.slow_seconds}s, stack sampled (report {report['id']})")
+
+    def list_reports(self):
+        # newest first, without the bulky parts
+        with self._lock:
+            return [
+                {key: value for key, value in report.items() if key not in ("topFunctions", "callTree", "stack")}
+                for report in reversed(self.reports)
+            ]
+
+    def get_report(self, report_id):
+        with self._lock:
+            report = next((report for report in self.reports if report["id"] == report_id), None)
+            return dict(report) if report is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self.reports),
+                "inFlight": len(self._in_flight),
+                "profiled": self.profiled,
+                "slow": self.slow,
+                "sampleRate": self.sample_rate,
+                "slowSeconds": self.slow_seconds
+            }
+
+request_profiler = RequestProfiler()
+
+def admin_profile_requested():
+    # X-Profile only counts for admins, for everyone else it is ignored
+    if request.headers.get("X-Profile", "").lower() not in ("1", "true", "yes"):
+        return False
+    user_session_data = session.get('user')
+    return bool(user_session_data) and session_role(user_session_data) == "admin"
+
+@app.before_request
+def start_request_profile():
+    trigger = request_profiler.should_profile(admin_profile_requested())
+    g.request_trace = request_profiler.start(request.method, request.path, trigger)
+
+@app.after_request
+def finish_request_profile(response):
+    trace = g.pop("request_trace", None)
+    if trace is not None:
+        report = request_profiler.finish(trace, response.status_code)
+        if report is not None and trace.profile is not None:
+            response.headers["X-Profile-Id"] = report["id"]
+    return response
+
+@app.teardown_request
+def discard_request_profile(error=None):
+    # after_request didn't run (the request failed before a response existed), don't leak the trace
+    trace = g.pop("request_trace", None)
+    if trace is not None:
+        request_profiler.finish(trace, 500)
+
 # mongo connection
+client = None
+db = None
 comments_collection = None # init to none due to mongo type oddities
-try:
-    mongo_uri = os.getenv("MONGO_URI")
-    client = MongoClient(mongo_uri)
-    db_name = "CommentDB"
-    db = client[db_name]
-    comments_collection = db["comments"]
-    app.logger.info(f"Connected to MongoDB! Database: {db.name}. Comments collection ready.")
-    # adding users collection to keep track of users in database
-    users_collection = db["users"]
-    app.logger.info(f"Database {db.name} successfully created collection: users!")
-except Exception as e:
-    app.logger.error(f"Error connecting to MongoDB or comments collection: {e}")
+users_collection = None
+comment_counts_collection = None
+articles_collection = None
+sessions_collection = None
+events_collection = None
+sequences_collection = None
+
+def init_mongo():
+    # (re)creates the client and collection handles for the current process. MongoClient isn't
+    # fork-safe, so pre-forked workers call this again after forking (see gunicorn.conf.py)
+    global client, db, comments_collection, users_collection, comment_counts_collection, articles_collection, sessions_collection
+    global events_collection, sequences_collection
+    try:
+        mongo_uri = os.getenv("MONGO_URI")
+        # connect=False: no sockets or monitor threads until the first operation
+        client = MongoClient(mongo_uri, connect=False, maxPoolSize=MONGO_MAX_POOL_SIZE, event_listeners=MONGO_EVENT_LISTENERS)
+        db_name = "CommentDB"
+        db = client[db_name]
+        comments_collection = db["comments"]
+        app.logger.info(f"Connected to MongoDB! Database: {db.name}. Comments collection ready.")
+        # adding users collection to keep track of users in database
+        users_collection = db["users"]
+        app.logger.info(f"Database {db.name} successfully created collection: users!")
+        # one counter document per article ({_id: articleId, total, removed}), kept up to date with $inc
+        comment_counts_collection = db["comment_counts"]
+        # parsed NYT articles, shared by every worker and kept across restarts (expired by TTL index)
+        articles_collection = db["articles"]
+        # server-side session data ({_id: session id, data, expiresAt}), expired by TTL index
+        sessions_collection = db["sessions"]
+        # capped log of live comment events, how workers fan events out to each other's SSE watchers
+        events_collection = db["comment_events"]
+        # named counters ({_id: name, seq}) bumped with $inc, numbers the comment events
+        sequences_collection = db["sequences"]
+    except Exception as e:
+        app.logger.error(f"Error connecting to MongoDB or comments collection: {e}")
+
+init_mongo()
+
+# (collection name, index keys, index options) -- created once at startup by ensure_indexes()
+INDEX_SPECS = [
+    # per-article comment pages, newest first, with _id as the tie breaker for the cursor
+    ("comments", [("articleId", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+     {"name": "articleId_timestamp_id"}),
+    # delta sync ("since" keyset on lastModified, _id) and the collection version used for ETags
+    ("comments", [("lastModified", ASCENDING), ("_id", ASCENDING)], {"name": "lastModified_id"}),
+    # reply threads: a subtree is one range scan on the materialized path
+    ("comments", [("articleId", ASCENDING), ("path", ASCENDING), ("depth", ASCENDING)],
+     {"name": "articleId_path_depth"}),
+    # thread pages: one level of a thread, newest first, keyset on (timestamp, _id)
+    ("comments", [("articleId", ASCENDING), ("depth", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+     {"name": "articleId_depth_timestamp_id"}),
+    # article store: lookups by NYT id, newest articles, and expiry of articles no search has returned lately
+    ("articles", [("id", ASCENDING)], {"name": "id", "unique": True}),
+    ("articles", [("publishedAt", DESCENDING)], {"name": "publishedAt"}),
+    ("articles", [("storedAt", ASCENDING)], {"name": "storedAt_ttl", "expireAfterSeconds": ARTICLE_STORE_TTL}),
+    # moderation queues, partial so they only hold the (small) moderated / unreviewed sets
+    ("comments", [("moderationTimestamp", DESCENDING), ("_id", DESCENDING)],
+     {"name": "removed_moderationTimestamp_id", "partialFilterExpression": {"removed": True}}),
+    ("comments", [("removedBy", ASCENDING), ("moderationTimestamp", DESCENDING), ("_id", DESCENDING)],
+     {"name": "removedBy_moderationTimestamp_id", "partialFilterExpression": {"removed": True}}),
+    ("comments", [("timestamp", DESCENDING), ("_id", DESCENDING)],
+     {"name": "needsReview_timestamp_id", "partialFilterExpression": {"needsReview": True}}),
+    # full-text comment search (a collection can only have one text index)
+    ("comments", [("content", TEXT), ("author", TEXT)],
+     {"name": "content_author_text", "weights": {"content": 1, "author": 2}, "default_language": "english"}),
+    # bulk ingest: the source system's id, makes re-running an import skip what is already in
+    ("comments", [("importId", ASCENDING)],
+     {"name": "importId", "unique": True, "partialFilterExpression": {"importId": {"$exists": True}}}),
+    # Last-Event-ID resume reads an article's events after a given sequence number
+    ("comment_events", [("articleId", ASCENDING), ("seq", ASCENDING)], {"name": "articleId_seq"}),
+    # the follower (re)starts a little behind its last sequence number
+    ("comment_events", [("seq", ASCENDING)], {"name": "seq"}),
+    # sessions are removed once expiresAt has passed
+    ("sessions", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+]
+
+def ensure_indexes():
+    # create_index is a no-op when the index already exists, so this is safe to run on every start
+    if db is None:
+        app.logger.warning("Database not initialized, skipping index creation.")
+        return
+    try:
+        # capped collections have to be created explicitly, before the first insert
+        db.create_collection("comment_events", capped=True, size=SSE_EVENT_LOG_BYTES)
+    except CollectionInvalid:
+        pass # already exists
+    except ConnectionFailure as error:
+        app.logger.error(f"MongoDB unreachable, skipping index creation: {error}")
+        return
+    except Exception as error:
+        app.logger.error(f"Failed to create capped collection comment_events: {error}")
+    for collection_name, keys, options in INDEX_SPECS:
+        try:
+            db[collection_name].create_index(keys, **options)
+        except ConnectionFailure as error:
+            # server unreachable, don't wait out the selection timeout once per index
+            app.logger.error(f"MongoDB unreachable, skipping index creation: {error}")
+            return
+        except Exception as error:
+            app.logger.error(f"Failed to create index {options.get('name')} on {collection_name}: {error}")
 
 # removed serializer as Mongo has internal function for this
 
 # ---------- HELPER FUNCTIONS ----------
 
+class SearchCache:
+    """
+    Thread-safe TTL + LRU cache for parsed search results.
+
+    get() reports "fresh", "stale" (past ttl but within stale_ttl, caller should refresh)
+    or None on a miss. begin_refresh()/end_refresh() make sure only one refresh runs per key.
+    """
+    def __init__(self, max_entries, ttl, stale_ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict() # key -> (value, stored_at, prefetched), oldest use first
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.prefetch_hits = 0 # first hit on an entry that was filled by the prefetcher
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            value, stored_at, prefetched = entry
+            age = now - stored_at
+            if age > self.ttl + self.stale_ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            if prefetched:
+                self.prefetch_hits += 1
+                self._entries[key] = (value, stored_at, False)
+            if age > self.ttl:
+                self.stale_hits += 1
+                return value, "stale"
+            self.hits += 1
+            return value, "fresh"
+
+    def contains(self, key):
+        # fresh-entry check that doesn't touch LRU order or hit/miss counters
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[1] <= self.ttl
+
+    def set(self, key, value, prefetched=False):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic(), prefetched)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def begin_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "hits": self.hits,
+                "staleHits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "refreshing": len(self._refreshing),
+                "prefetchHits": self.prefetch_hits,
+                "hitRate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+            }
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL)
+
+class TokenBucket:
+    """
+    Client-side rate limiter. reserve() takes a token (possibly from the future) and returns
+    how long the caller has to wait for it, or None if that would be longer than max_wait.
+    """
+    def __init__(self, rate_per_minute, burst):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0 # set from upstream Retry-After
+        self._lock = threading.Lock()
+
+    def _state(self):
+        # held around every read-modify-write of the bucket
+        return self._lock
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def reserve(self, max_wait):
+        with self._state():
+            now = time.monotonic()
+            self._refill(now)
+            token_wait = (1 - self._tokens) / self.rate_per_second if self._tokens < 1 else 0.0
+            wait = max(token_wait, self._blocked_until - now)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1 # may go negative, later callers queue behind this reservation
+            return wait
+
+    def acquire(self, max_wait):
+        wait = self.reserve(max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def block_for(self, seconds):
+        with self._state():
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def retry_after(self):
+        # seconds until a token is available, for the Retry-After header on fail-fast responses
+        with self._state():
+            now = time.monotonic()
+            self._refill(now)
+            token_wait = (1 - self._tokens) / self.rate_per_second if self._tokens < 1 else 0.0
+            return max(token_wait, self._blocked_until - now)
+
+    def available(self):
+        with self._state():
+            self._refill(time.monotonic())
+            return self._tokens
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket shared by every worker process on the host. The bucket lives in a small file,
+    each operation loads and stores it under an exclusive flock, so WEB_CONCURRENCY workers
+    together stay within one NYT quota. time.monotonic() is system-wide on Linux, so the
+    timestamps mean the same in every process.
+    """
+    STATE_FORMAT = "ddd" # tokens, updated, blocked until
+
+    def __init__(self, rate_per_minute, burst, path):
+        super().__init__(rate_per_minute, burst)
+        self.path = path
+
+    @contextlib.contextmanager
+    def _state(self):
+        with self._lock, open(self.path, "a+b") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX) # released when the file is closed
+            state_file.seek(0)
+            raw = state_file.read()
+            if len(raw) == struct.calcsize(self.STATE_FORMAT):
+                self._tokens, self._updated, self._blocked_until = struct.unpack(self.STATE_FORMAT, raw)
+            yield
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(struct.pack(self.STATE_FORMAT, self._tokens, self._updated, self._blocked_until))
+
+class RetryBudget:
+    # every request deposits `ratio` tokens and every retry spends one, so retries stay a bounded fraction of traffic
+    def __init__(self, ratio, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+class NYTRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"NYT rate limit, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+def parse_retry_after(header_value):
+    # Retry-After is either delta-seconds or an HTTP date
+    if not header_value:
+        return None
+    try:
+        return max(0.0, float(header_value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(header_value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class NYTClient:
+    """
+    Keep-alive client for the NYT Article Search API.
+
+    Requests go through a token bucket (queue up to max_queue_wait, else NYTRateLimited) and
+    transient 429/5xx/connection failures are retried with jittered backoff while the shared
+    retry budget allows it. Non-retryable responses are returned as-is to the caller.
+    """
+    RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, connect_timeout=NYT_CONNECT_TIMEOUT, read_timeout=NYT_READ_TIMEOUT,
+                 pool_size=NYT_POOL_SIZE, rate_per_minute=NYT_RATE_PER_MINUTE, burst=NYT_RATE_BURST,
+                 max_queue_wait=NYT_MAX_QUEUE_WAIT, max_retries=NYT_MAX_RETRIES,
+                 retry_budget_ratio=NYT_RETRY_BUDGET_RATIO, backoff_base=0.5, backoff_max=4.0):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_queue_wait = max_queue_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        if NYT_RATE_STATE_FILE:
+            self.limiter = SharedTokenBucket(rate_per_minute, burst, NYT_RATE_STATE_FILE)
+        else:
+            self.limiter = TokenBucket(rate_per_minute, burst)
+        self.retry_budget = RetryBudget(retry_budget_ratio)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.requests_sent = 0
+        self.retries = 0
+        self.retries_denied = 0
+        self.rate_limited = 0
+
+    def backoff(self, attempt):
+        # "full jitter" exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def can_retry(self, attempt):
+        if attempt >= self.max_retries:
+            return False
+        if not self.retry_budget.try_spend():
+            self.retries_denied += 1
+            return False
+        self.retries += 1
+        return True
+
+    def retry_delay(self, status_code, retry_after_header, attempt):
+        # seconds to wait before retrying a response, None when it should be returned as-is.
+        # kept separate from get() so the async client in asgi.py applies the same policy
+        if status_code not in self.RETRYABLE_STATUSES:
+            return None
+        retry_after = parse_retry_after(retry_after_header)
+        if status_code == 429 and retry_after:
+            # whole worker backs off, not just this request
+            self.limiter.block_for(retry_after)
+        if (retry_after is not None and retry_after > self.max_queue_wait) or not self.can_retry(attempt):
+            return None
+        if retry_after is None:
+            return self.backoff(attempt)
+        # a blocked limiter already makes the next acquire() wait out a 429
+        return 0.0 if status_code == 429 else retry_after
+
+    def get(self, params):
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            if not self.limiter.acquire(self.max_queue_wait):
+                self.rate_limited += 1
+                raise NYTRateLimited(self.limiter.retry_after())
+            self.requests_sent += 1
+            started = time.perf_counter()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                observe_nyt_request("error", time.perf_counter() - started)
+                if not self.can_retry(attempt):
+                    raise
+                app.logger.warning(f"NYT request failed ({error}), retrying (attempt {attempt + 1}).")
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+
+            observe_nyt_request(response.status_code, time.perf_counter() - started)
+            delay = self.retry_delay(response.status_code, response.headers.get("Retry-After"), attempt)
+            if delay is None:
+                return response
+            app.logger.warning(f"NYT responded {response.status_code}, retrying (attempt {attempt + 1}).")
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        return {
+            "requests": self.requests_sent,
+            "retries": self.retries,
+            "retriesDenied": self.retries_denied,
+            "rateLimited": self.rate_limited,
+            "tokensAvailable": round(self.limiter.available(), 2)
+        }
+
+nyt_client = NYTClient(BASE_NYT_URL)
+
+class SingleFlightTimeout(Exception):
+    pass
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs fn, callers that arrive
+    while it runs wait (up to timeout) and get the same result or exception.
+    """
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self._Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            # remove before waking followers so later callers start a new call instead of reusing this one
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "inFlight": len(self._calls),
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "timeouts": self.timeouts
+            }
+
+search_flight = SingleFlight()
+
+class SearchPrefetcher:
+    """
+    After a full page n of a search is served, fetches page n+1 into the search cache on a small
+    thread pool. Prefetches are dropped (never queued for the limiter) when fewer than
+    min_tokens rate-limit tokens are left or max_pending prefetches are already waiting.
+    """
+    def __init__(self, enabled, workers, max_pending, min_tokens):
+        self.enabled = enabled
+        self.max_pending = max_pending
+        self.min_tokens = min_tokens
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search-prefetch") if enabled else None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped_budget = 0
+        self.dropped_queue = 0
+
+    def _budget_low(self):
+        return nyt_client.limiter.available() < self.min_tokens
+
+    def maybe_prefetch(self, cache_key, result_count):
+        # returns the Future when a prefetch was scheduled, None otherwise
+        if not self.enabled or cache_key[-1] >= NYT_MAX_PAGE:
+            return None
+        if result_count < NYT_PAGE_SIZE:
+            # a short page is the last one, there is nothing after it to fetch
+            return None
+        next_key = cache_key[:-1] + (cache_key[-1] + 1,)
+        if search_cache.contains(next_key):
+            return None
+        with self._lock:
+            if self._budget_low():
+                self.dropped_budget += 1
+                return None
+            if next_key in self._pending:
+                return None
+            if len(self._pending) >= self.max_pending:
+                self.dropped_queue += 1
+                return None
+            self._pending.add(next_key)
+            self.scheduled += 1
+        return self._executor.submit(self._run, next_key)
+
+    def _run(self, cache_key):
+        try:
+            # budget may have drained while this sat in the queue
+            if self._budget_low():
+                with self._lock:
+                    self.dropped_budget += 1
+                return
+            if search_cache.contains(cache_key):
+                return
+            load_search(cache_key, prefetched=True)
+            with self._lock:
+                self.completed += 1
+        except (NYTSearchError, SingleFlightTimeout) as error:
+            with self._lock:
+                self.failed += 1
+            app.logger.info(f"Prefetch of search {cache_key} failed: {error}")
+        finally:
+            with self._lock:
+                self._pending.discard(cache_key)
+
+    def stats(self):
+        cache_stats = search_cache.stats()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._pending),
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "failed": self.failed,
+                "droppedBudget": self.dropped_budget,
+                "droppedQueue": self.dropped_queue,
+                "hits": cache_stats["prefetchHits"],
+                "hitRate": cache_stats["prefetchHits"] / self.completed if self.completed else 0.0
+            }
+
+search_prefetcher = SearchPrefetcher(
+    SEARCH_PREFETCH_ENABLED, SEARCH_PREFETCH_WORKERS, SEARCH_PREFETCH_MAX_PENDING, SEARCH_PREFETCH_MIN_TOKENS
+)
+
+# name -> callable returning a JSON-able dict, reported by /api/admin/stats
+STATS_PROVIDERS = {
+    "searchCache": lambda: search_cache.stats(),
+    "nytClient": lambda: nyt_client.stats(),
+    "searchFlight": lambda: search_flight.stats(),
+    "searchPrefetch": lambda: search_prefetcher.stats(),
+    "sessions": lambda: app.session_interface.store.stats(),
+    "jwks": lambda: jwks_cache.stats(),
+    "login": lambda: login_metrics.stats(),
+    "commentEvents": lambda: comment_events.stats(),
+    "staticManifest": lambda: static_manifest.stats(),
+    "compression": lambda: compression_metrics.stats(),
+    "profiler": lambda: request_profiler.stats(),
+}
+
+def parse_page_size(raw_limit):
+    # clamp client supplied page sizes so one request can't pull a whole collection
+    try:
+        limit = int(raw_limit) if raw_limit is not None else DEFAULT_COMMENT_PAGE_SIZE
+    except (TypeError, ValueError):
+        return None
+    return max(1, min(limit, MAX_COMMENT_PAGE_SIZE))
+
+def encode_comment_cursor(comment_doc, sort_field="timestamp"):
+    # cursor is "<sort value>_<objectid>", repr keeps the float exact
+    return f"{comment_doc[sort_field]!r}_{comment_doc['_id']}"
+
+def decode_comment_cursor(cursor):
+    # returns (timestamp, ObjectId) or None if the cursor is malformed
+    try:
+        raw_timestamp, raw_id = cursor.rsplit("_", 1)
+        if not ObjectId.is_valid(raw_id):
+            return None
+        return float(raw_timestamp), ObjectId(raw_id)
+    except (AttributeError, ValueError):
+        return None
+
+def keyset_before(sort_field, decoded_cursor):
+    # keyset: strictly after the last comment of the previous page in (sort_field, _id) descending order
+    cursor_value, cursor_id = decoded_cursor
+    return [
+        {sort_field: {"$lt": cursor_value}},
+        {sort_field: cursor_value, "_id": {"$lt": cursor_id}},
+    ]
+
+def child_path_and_depth(parent_doc):
+    # root comments have an empty path, replies extend the parent's path with the parent's id
+    if parent_doc is None:
+        return "", 0
+    return f"{parent_doc.get('path', '')}{parent_doc['_id']}/", parent_doc.get("depth", 0) + 1
+
+def comment_subtree_range(comment_doc):
+    # every descendant's path starts with "<path><id>/", "0" is the character right after "/"
+    prefix = f"{comment_doc.get('path', '')}{comment_doc['_id']}/"
+    return {"$gte": prefix, "$lt": prefix[:-1] + "0"}
+
+def newest_first(comment_doc):
+    return comment_doc.get("timestamp") or 0, comment_doc["_id"]
+
+def assemble_thread(top_level, reply_docs, max_depth, limit, has_more):
+    # link one page of top-level comments (newest first) and their depth-bounded replies into
+    # nested replies in O(n). reply_docs holds one level more than max_depth so leaf nodes know
+    # if they have hidden replies
+    children_by_parent = {}
+    for comment in reply_docs:
+        parent_id = str(comment["parentId"]) if comment.get("parentId") else None
+        children_by_parent.setdefault(parent_id, []).append(comment)
+
+    def build_node(comment, level):
+        node = serialize_comment_for_frontend(comment)
+        node["depth"] = comment.get("depth", 0)
+        children = sorted(children_by_parent.get(node["id"], []), key=newest_first, reverse=True)
+        if level + 1 >= max_depth:
+            # replies exist below the depth limit, client loads them from the start
+            node["replies"] = []
+            node["moreReplies"] = bool(children)
+            node["repliesCursor"] = None
+            return node
+        shown_children = children[:limit]
+        node["replies"] = [build_node(child, level + 1) for child in shown_children]
+        node["moreReplies"] = len(children) > limit
+        node["repliesCursor"] = encode_comment_cursor(shown_children[-1]) if node["moreReplies"] else None
+        return node
+
+    return {
+        "comments": [build_node(comment, 0) for comment in top_level],
+        "nextCursor": encode_comment_cursor(top_level[-1]) if has_more else None
+    }
+
 def get_key():
     api_key = os.getenv("NYT_API_KEY")
     # check for if not set or template placeholder is present
@@ -80,6 +1217,381 @@ def get_key():
         return None
     return api_key
 
+def increment_comment_count(article_id, total=0, removed=0):
+    # counters are derived data, a failed $inc is logged and repaired by rebuild-comment-counts
+    if comment_counts_collection is None:
+        return
+    try:
+        comment_counts_collection.update_one(
+            {"_id": article_id},
+            {"$inc": {"total": total, "removed": removed}},
+            upsert=True
+        )
+    except Exception as error:
+        app.logger.error(f"Failed to update comment count for article '{article_id}': {error}")
+
+def rebuild_comment_counts():
+    # recompute every counter from the comments themselves, e.g. after a bulk import
+    comments_collection.aggregate([
+        {"$group": {
+            "_id": "$articleId",
+            "total": {"$sum": 1},
+            "removed": {"$sum": {"$cond": [{"$eq": ["$removed", True]}, 1, 0]}}
+        }},
+        {"$merge": {"into": "comment_counts", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+    return comment_counts_collection.count_documents({})
+
+def backfill_comment_paths(batch_size=1000):
+    # comments written before materialized paths only have parentId, derive path/depth level by level
+    pending = {
+        str(comment["_id"]): comment.get("parentId")
+        for comment in comments_collection.find({"path": {"$exists": False}}, {"parentId": 1})
+    }
+    known_paths = {} # comment id -> (path, depth) for parents that already have one
+    updated_count = 0
+    while pending:
+        ready_updates = []
+        for comment_id, parent_id in list(pending.items()):
+            parent_id = str(parent_id) if parent_id else None
+            if parent_id is None or not ObjectId.is_valid(parent_id):
+                ready_updates.append((comment_id, "", 0))
+            elif parent_id in pending:
+                continue # parent gets its path in this or a later pass
+            else:
+                if parent_id not in known_paths:
+                    parent_doc = comments_collection.find_one({"_id": ObjectId(parent_id)}, {"path": 1, "depth": 1})
+                    known_paths[parent_id] = (parent_doc.get("path", ""), parent_doc.get("depth", 0)) if parent_doc else None
+                parent_path = known_paths[parent_id]
+                if parent_path is None: # orphaned reply, treat as a root comment
+                    ready_updates.append((comment_id, "", 0))
+                else:
+                    ready_updates.append((comment_id, f"{parent_path[0]}{parent_id}/", parent_path[1] + 1))
+        if not ready_updates:
+            break # parent cycle, leave the rest for manual repair
+        for comment_id, path, depth in ready_updates:
+            known_paths[comment_id] = (path, depth)
+            del pending[comment_id]
+        for start in range(0, len(ready_updates), batch_size):
+            comments_collection.bulk_write([
+                UpdateOne({"_id": ObjectId(comment_id)}, {"$set": {"path": path, "depth": depth}})
+                for comment_id, path, depth in ready_updates[start:start + batch_size]
+            ], ordered=False)
+        updated_count += len(ready_updates)
+    return updated_count
+
+@app.cli.command("backfill-comment-paths")
+def backfill_comment_paths_command():
+    """Add materialized path/depth to comments created before reply threads were indexed."""
+    updated_count = backfill_comment_paths()
+    print(f"Backfilled path and depth for {updated_count} comments.")
+
+@app.cli.command("rebuild-comment-counts")
+def rebuild_comment_counts_command():
+    """Recompute the per-article comment counters from the comments collection."""
+    article_count = rebuild_comment_counts()
+    print(f"Rebuilt comment counts for {article_count} articles.")
+
+@app.cli.command("ingest-comments")
+@click.argument("ndjson_file", type=click.File("rb"))
+@click.option("--batch-size", default=INGEST_BATCH_SIZE, show_default=True, help="Records per insert_many.")
+def ingest_comments_command(ndjson_file, batch_size):
+    """Bulk insert comments from an NDJSON file (one comment per line, "-" for stdin)."""
+    ingest = CommentIngest(batch_size)
+    ingest.add_lines(ndjson_file)
+    report = ingest.report()
+    for record_error in report["errors"]:
+        print(f"line {record_error['line']}: {record_error['error']}")
+    print(f"Inserted {report['inserted']} comments, {report['failed']} records failed.")
+
+# ---------- SESSIONS ----------
+
+class MemorySessionStore:
+    """
+    In-process TTL + LRU session store. Sessions are lost on restart and not shared between
+    workers, so this is meant for development, tests and single-process deployments.
+    Also used by MongoSessionStore as its per-process read cache.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # session id -> (data, expires_at), oldest use first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self._entries.pop(session_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[0]
+
+    def save(self, session_id, data, ttl=None):
+        with self._lock:
+            self._entries[session_id] = (data, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+class MongoSessionStore:
+    """
+    Session store backed by the sessions collection, shared by every worker and kept across
+    restarts. Reads are cached in-process for cache_ttl seconds so most auth checks never
+    leave the worker, unknown ids for miss_ttl seconds so a stale cookie doesn't cost a find_one
+    per request; writes and deletes go straight to Mongo and update the local cache.
+    """
+    MISSING = object() # cached in place of the data of a session that isn't in Mongo
+
+    def __init__(self, ttl, cache_size, cache_ttl, miss_ttl=SESSION_MISS_TTL):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.cache = MemorySessionStore(cache_size, cache_ttl)
+        self.db_reads = 0
+
+    def get(self, session_id):
+        data = self.cache.get(session_id)
+        if data is self.MISSING:
+            return None
+        if data is not None or sessions_collection is None:
+            return data
+        self.db_reads += 1
+        try:
+            # the TTL monitor only runs once a minute, so check expiresAt here as well
+            doc = sessions_collection.find_one(
+                {"_id": session_id, "expiresAt": {"$gt": datetime.now(timezone.utc)}}, {"data": 1}
+            )
+        except Exception as error:
+            app.logger.error(f"Failed to load session: {error}")
+            return None
+        if doc is None:
+            self.cache.save(session_id, self.MISSING, ttl=self.miss_ttl)
+            return None
+        self.cache.save(session_id, doc["data"])
+        return doc["data"]
+
+    def save(self, session_id, data):
+        if sessions_collection is None:
+            app.logger.error("Database not initialized, session not saved.")
+            return
+        try:
+            sessions_collection.replace_one(
+                {"_id": session_id},
+                {"data": data, "expiresAt": datetime.fromtimestamp(time.time() + self.ttl, timezone.utc)},
+                upsert=True
+            )
+        except Exception as error:
+            app.logger.error(f"Failed to save session: {error}")
+            return
+        self.cache.save(session_id, data)
+
+    def delete(self, session_id):
+        self.cache.delete(session_id)
+        if sessions_collection is None:
+            return
+        try:
+            sessions_collection.delete_one({"_id": session_id})
+        except Exception as error:
+            app.logger.error(f"Failed to delete session: {error}")
+
+    def stats(self):
+        return dict(self.cache.stats(), backend="mongo", dbReads=self.db_reads)
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, session_id=None, new=False, stale_cookie=False):
+        def on_update(session_data):
+            session_data.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.session_id = session_id
+        self.new = new
+        self.modified = False
+        self.stale_cookie = stale_cookie # the request's cookie named an unknown or expired session
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps session data in a session store and only an opaque random id in the cookie.
+    The session is written back (and the cookie set) only when it was modified.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        data = self.store.get(session_id) if session_id else None
+        if data is None:
+            return ServerSideSession(session_id=secrets.token_urlsafe(32), new=True, stale_cookie=bool(session_id))
+        # copy so changes made during the request don't leak into the cache before they are saved
+        return ServerSideSession(dict(data), session_id=session_id)
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.session_id)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            elif session.stale_cookie:
+                # the client keeps sending an id that isn't in the store, stop it
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.store.save(session.session_id, dict(session))
+        response.set_cookie(
+            cookie_name,
+            session.session_id,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def regenerate(self, session):
+        # same data under a new id, called at login so an id planted before it (session fixation)
+        # never becomes an authenticated session
+        if not session.new:
+            self.store.delete(session.session_id)
+        session.session_id = secrets.token_urlsafe(32)
+        session.new = True
+        session.modified = True
+
+def create_session_store():
+    if SESSION_BACKEND == "memory":
+        return MemorySessionStore(SESSION_MEMORY_SIZE, SESSION_TTL)
+    if SESSION_BACKEND != "mongo":
+        app.logger.warning(f"Unknown SESSION_BACKEND '{SESSION_BACKEND}', using mongo.")
+    return MongoSessionStore(SESSION_TTL, SESSION_MEMORY_SIZE, SESSION_CACHE_TTL)
+
+app.session_interface = ServerSideSessionInterface(create_session_store())
+
+# ---------- OIDC ----------
+
+class JWKSCache:
+    """
+    Dex signing keys by kid, shared by every login in the worker. The key set is reused for
+    ttl seconds; authlib asks for a forced refresh when a token's kid is unknown (key rotation),
+    which is honoured at most once per min_refresh_interval so bad tokens can't hammer Dex.
+    """
+    def __init__(self, jwks_uri, ttl, min_refresh_interval, timeout=5):
+        self.jwks_uri = jwks_uri
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {} # kid -> jwk
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+        self.forced_refreshes = 0
+        self.throttled_refreshes = 0
+        self.refresh_failures = 0
+
+    def key_set(self):
+        return {"keys": list(self._keys.values())}
+
+    def fetch_jwk_set(self, force=False):
+        # same signature as authlib's OpenIDMixin.fetch_jwk_set, see install_oidc_caching()
+        with self._lock:
+            age = None if self._fetched_at is None else time.monotonic() - self._fetched_at
+            if age is not None and not force and age <= self.ttl:
+                self.hits += 1
+                return self.key_set()
+            if age is not None and force and age < self.min_refresh_interval:
+                self.throttled_refreshes += 1
+                return self.key_set()
+            # fetched under the lock, logins arriving during a refresh wait for it instead of calling Dex too
+            try:
+                response = requests.get(self.jwks_uri, timeout=self.timeout)
+                response.raise_for_status()
+                keys = response.json().get("keys", [])
+            except (requests.exceptions.RequestException, ValueError) as error:
+                self.refresh_failures += 1
+                if not self._keys:
+                    raise
+                app.logger.warning(f"JWKS refresh from {self.jwks_uri} failed, keeping cached keys: {error}")
+                return self.key_set()
+            self._keys = {jwk.get("kid"): jwk for jwk in keys}
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+            if force:
+                self.forced_refreshes += 1
+            return self.key_set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.refreshes + self.throttled_refreshes
+            return {
+                "keys": len(self._keys),
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "forcedRefreshes": self.forced_refreshes,
+                "throttledRefreshes": self.throttled_refreshes,
+                "refreshFailures": self.refresh_failures,
+                "hitRate": self.hits / lookups if lookups else 0.0
+            }
+
+class LoginMetrics:
+    """Login count and per-stage latency (token exchange, ID token verification, user upsert)."""
+    STAGES = ("tokenExchange", "verification", "userUpsert", "total")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.logins = 0
+        self._totals = dict.fromkeys(self.STAGES, 0.0)
+        self._max = dict.fromkeys(self.STAGES, 0.0)
+
+    def record(self, durations):
+        with self._lock:
+            self.logins += 1
+            for stage, seconds in durations.items():
+                self._totals[stage] += seconds
+                self._max[stage] = max(self._max[stage], seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "logins": self.logins,
+                "avgMs": {stage: 1000 * total / self.logins if self.logins else 0.0
+                          for stage, total in self._totals.items()},
+                "maxMs": {stage: 1000 * longest for stage, longest in self._max.items()}
+            }
+
+login_metrics = LoginMetrics()
+
+def install_oidc_caching(oidc_client):
+    # authlib keeps the first key set forever and refetches on every unknown kid, use the shared cache
+    jwks_cache = JWKSCache(oidc_client.load_server_metadata().get("jwks_uri"), JWKS_CACHE_TTL, JWKS_MIN_REFRESH_INTERVAL)
+    oidc_client.fetch_jwk_set = jwks_cache.fetch_jwk_set
+
+    # time signature verification wherever authlib does it (normally inside authorize_access_token)
+    parse_id_token = oidc_client.parse_id_token
+    @wraps(parse_id_token)
+    def timed_parse_id_token(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return parse_id_token(*args, **kwargs)
+        finally:
+            g.id_token_verify_seconds = g.get("id_token_verify_seconds", 0.0) + time.perf_counter() - started
+    oidc_client.parse_id_token = timed_parse_id_token
+    return jwks_cache
+
+jwks_cache = install_oidc_caching(oidc_client)
+
 # ------------ DEX API ENDPOINTS ---------------
 @app.route('/')
 def get_user():
@@ -88,69 +1600,75 @@ def get_user():
         return {user['email']}
     return f"No user found."
 
-@app.route('/api/me')
-def current_user_api():
-    user_session_data = session.get('user')
-    app.logger.info(f"[/api/me] User session data from session: {user_session_data}")
-
-    if user_session_data:
-        user_id_for_check = user_session_data.get('userID')
-        username_for_check = user_session_data.get('username')
-
-        role = "user" # default role
-        # role checking
-        if str(user_id_for_check) == '123': # dex user id for admin
-            role = "admin"
-            app.logger.info(f"[/api/me] User ID '{user_id_for_check}' matches ADMIN_ID '123'. Role set to 'admin'.")
-        elif str(user_id_for_check) == '456': # dex user id for moderator
-            role = "moderator"
-            app.logger.info(f"[/api/me] User ID '{user_id_for_check}' matches MODERATOR_ID '456'. Role set to 'moderator'.")
-        elif username_for_check == 'admin' and role == 'user':
-            role = "admin"
-            app.logger.info(f"[/api/me] Username '{username_for_check}' matches 'admin'. Role set to 'admin'.")
-        elif username_for_check == 'moderator' and role == 'user':
-            role = "moderator"
-            app.logger.info(f"[/api/me] Username '{username_for_check}' matches 'moderator'. Role set to 'moderator'.")
-
-
-        app.logger.info(f"[/api/me] Final determined role: '{role}' for userID: '{user_id_for_check}', username: '{username_for_check}'")
+# ---------- ROLES ----------
+# role map: dex user id or username -> role, merged with the ROLE_MAP env var (same JSON shape,
+# e.g. '{"usernames": {"alice": "moderator"}}') at startup
+DEFAULT_ROLE_MAP = {
+    "ids": {"123": "admin", "456": "moderator"}, # static dex users, see config/dex/dex.yaml
+    "usernames": {"admin": "admin", "moderator": "moderator"},
+}
+
+def load_role_map():
+    role_map = {kind: dict(entries) for kind, entries in DEFAULT_ROLE_MAP.items()}
+    raw_role_map = os.getenv("ROLE_MAP")
+    if raw_role_map:
+        try:
+            for kind, entries in json.loads(raw_role_map).items():
+                role_map.setdefault(kind, {}).update({str(key): role for key, role in entries.items()})
+        except (ValueError, AttributeError) as error:
+            app.logger.error(f"Ignoring invalid ROLE_MAP env var: {error}")
+    return role_map
+
+ROLE_MAP = load_role_map()
+
+def resolve_role(user_id, username):
+    # ids win over usernames, same order as the old per-request checks
+    return ROLE_MAP["ids"].get(str(user_id)) or ROLE_MAP["usernames"].get(username) or "user"
+
+def session_role(user_session_data):
+    # resolved once in authorize(), sessions created before roles were stored fall back to the map
+    role = user_session_data.get('role')
+    if role is None:
+        role = resolve_role(user_session_data.get('userID'), user_session_data.get('username'))
+    return role
+
+def user_status_payload(user_session_data):
+    # /api/me body, shared with the ASGI app
+    if not user_session_data:
+        return {"loggedIn": False}
 
-        return jsonify({
-            "loggedIn": True,
-            "email": user_session_data.get('email'),
-            "username": username_for_check,
-            "userID": user_id_for_check,
-            "role": role
-        }), 200
+    return {
+        "loggedIn": True,
+        "email": user_session_data.get('email'),
+        "username": user_session_data.get('username'),
+        "userID": user_session_data.get('userID'),
+        "role": session_role(user_session_data)
+    }
 
-    return jsonify({"loggedIn": False}), 200
+def load_session_cookie(cookie_value):
+    # looks up the session behind a session cookie outside a Flask request (used by the ASGI app)
+    if not cookie_value:
+        return {}
+    return app.session_interface.store.get(cookie_value) or {}
+
+@app.route('/api/me')
+def current_user_api():
+    return jsonify(user_status_payload(session.get('user'))), 200
 
 
 def role_required(allowed_roles):
+    allowed_roles = frozenset(allowed_roles)
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             user_session_data = session.get('user')
-            app.logger.info(f"[role_required] User session data: {user_session_data}")
-
             if not user_session_data:
                 return jsonify({"error": "Authentication required"}), 401
 
-            user_id_for_check = user_session_data.get('userID')
-            username_for_check = user_session_data.get('username')
-
-            user_role = "user" # default role
-            if str(user_id_for_check) == '123':
-                user_role = "admin"
-            elif str(user_id_for_check) == '456':
-                user_role = "moderator"
-            elif username_for_check == 'admin' and user_role == 'user':
-                user_role = "admin"
-            elif username_for_check == 'moderator' and user_role == 'user':
-                user_role = "moderator"
-
-            app.logger.info(f"[role_required] Determined role: '{user_role}' for userID: '{user_id_for_check}', username: '{username_for_check}'. Allowed: {allowed_roles}")
-
+            user_role = session_role(user_session_data)
+            # runs on every protected request, keep it lazy and out of INFO
+            app.logger.debug("[role_required] role %r for userID %r, allowed %s",
+                             user_role, user_session_data.get('userID'), sorted(allowed_roles))
             if user_role not in allowed_roles:
                 return jsonify({"error": "Forbidden: Insufficient privileges"}), 403
 
@@ -181,6 +1699,7 @@ def authorize():
     if not REGISTERED_OIDC_CLIENT_NAME: # env load check
         app.logger.error("OIDC client name not available during /api/authorize.")
         return "OAuth client configuration error (authorize: name missing).", 500
+    login_started = time.perf_counter()
     try:
         oauth_client = getattr(oauth, REGISTERED_OIDC_CLIENT_NAME)
         token = oauth_client.authorize_access_token()
@@ -191,24 +1710,25 @@ def authorize():
         app.logger.error(f"Error during authorize_access_token for '{REGISTERED_OIDC_CLIENT_NAME}': {e}", exc_info=True)
         # check dex logs if this errors
         return "Error obtaining access token from provider.", 500
+    token_received = time.perf_counter()
 
     retrieved_nonce = session.pop('nonce', None) # get and remove nonce
     if not retrieved_nonce:
         app.logger.warning("Nonce not found in session during /api/authorize callback. This could be a security risk or indicate a flow issue.")
 
     try:
-        user_info = oauth_client.parse_id_token(token, nonce=retrieved_nonce)
+        # authorize_access_token already verified the ID token (and nonce) when authlib had the
+        # nonce in its state, only parse it here when it didn't
+        parsed_claims = token.get('userinfo') or oauth_client.parse_id_token(token, nonce=retrieved_nonce) # dict of claims
         # `token` is the dictionary containing id_token, access_token, etc.
         # parse_id_token = token['id_token']
     except Exception as e:
         app.logger.error(f"Error parsing ID token or invalid nonce for client '{REGISTERED_OIDC_CLIENT_NAME}': {e}", exc_info=True)
         return "Invalid token or authentication session.", 400 # bad req or unauthorized
+    verification_seconds = g.get("id_token_verify_seconds", 0.0)
 
     try:
-        oauth_client = getattr(oauth, REGISTERED_OIDC_CLIENT_NAME)
-        parsed_claims = oauth_client.parse_id_token(token, nonce=retrieved_nonce) # dict of claims
         app.logger.info(f"[/api/authorize] Parsed ID token claims from Authlib: {parsed_claims}")
-
         dex_user_id = parsed_claims.get('sub') # subject claim
         dex_email = parsed_claims.get('email') # should be admin@hw3.com, etc.
 
@@ -222,9 +1742,13 @@ def authorize():
             'raw_claims': parsed_claims # store all claims for debugging
         }
 
+        # resolved once here, role_required and /api/me just read it back from the session
+        session_user_data['role'] = resolve_role(session_user_data.get('userID'), session_user_data.get('username'))
         app.logger.info(f"[/api/authorize] Data to be stored in session['user']: {session_user_data}")
+        app.session_interface.regenerate(session)
         session['user'] = session_user_data
 
+        upsert_started = time.perf_counter()
         if users_collection is not None and session_user_data.get('userID'):
             users_collection.update_one(
                 {'dex_user_id': session_user_data['userID']},
@@ -237,8 +1761,15 @@ def authorize():
             )
         else:
             app.logger.warning(f"[/api/authorize] userID not found in session_user_data or users_collection is None. User DB update skipped. session_user_data: {session_user_data}")
-
-
+        login_finished = time.perf_counter()
+
+        # verification normally happens inside authorize_access_token, so take it out of the exchange time
+        login_metrics.record({
+            "tokenExchange": max(0.0, token_received - login_started - verification_seconds),
+            "verification": verification_seconds,
+            "userUpsert": login_finished - upsert_started,
+            "total": login_finished - login_started
+        })
         return redirect('http://localhost:5173/') # svelte
 
     except Exception as e:
@@ -250,7 +1781,543 @@ def logout():
     session.clear()
     return redirect('/')
 
+# ---------- LIVE COMMENT EVENTS ----------
+
+class CommentSubscription:
+    """One SSE connection. Events are queued up to max_pending, past that the watcher is too slow
+    and is marked overflowed (it gets a reset event and refetches) instead of buffering without bound."""
+    def __init__(self, article_id, max_pending=SSE_QUEUE_SIZE):
+        self.article_id = article_id
+        self.events = queue.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # called by the broker, must not block the publisher. Returns False once the watcher has overflowed
+        try:
+            self.events.put_nowait(event)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def next_event(self, timeout):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class CommentEventBroker:
+    """
+    In-process pub/sub for live comment events, one per worker. dispatch() hands an event to every
+    watcher of its article; the fan-out below decides how events from other workers get here.
+    Keeps the last replay_size events of recently active articles for Last-Event-ID resume in local mode.
+    """
+    def __init__(self, replay_size=SSE_REPLAY_SIZE, replay_articles=SSE_REPLAY_ARTICLES):
+        self.replay_size = replay_size
+        self.replay_articles = replay_articles
+        self._subscribers = {} # article id -> set of subscriptions
+        self._recent = OrderedDict() # article id -> deque of recent events, least recently active first
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.overflowed = 0
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscribers.setdefault(subscription.article_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # safe to call more than once, streams unsubscribe on close and when their generator ends
+        with self._lock:
+            watchers = self._subscribers.get(subscription.article_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._subscribers[subscription.article_id]
+
+    def dispatch(self, event):
+        article_id = event["articleId"]
+        with self._lock:
+            self.published += 1
+            recent = self._recent.get(article_id)
+            if recent is None:
+                recent = self._recent[article_id] = deque(maxlen=self.replay_size)
+                while len(self._recent) > self.replay_articles:
+                    self._recent.popitem(last=False)
+            self._recent.move_to_end(article_id)
+            recent.append(event)
+            watchers = list(self._subscribers.get(article_id, ()))
+        for subscription in watchers:
+            if subscription.deliver(event):
+                self.delivered += 1
+            else:
+                self.overflowed += 1
+                self.unsubscribe(subscription)
+
+    def recent_events(self, article_id, after_seq):
+        # (events after after_seq, False if older events were already dropped and the client must refetch)
+        with self._lock:
+            recent = list(self._recent.get(article_id, ()))
+        newer = [event for event in recent if int(event["id"]) > after_seq]
+        # complete if the client's last event is still here, or nothing was ever dropped for the article
+        complete = len(newer) < len(recent) or len(recent) < self.replay_size
+        return newer, complete
+
+    def stats(self):
+        with self._lock:
+            return {
+                "articlesWatched": len(self._subscribers),
+                "watchers": sum(len(watchers) for watchers in self._subscribers.values()),
+                "published": self.published,
+                "delivered": self.delivered,
+                "overflowed": self.overflowed
+            }
+
+comment_events = CommentEventBroker()
+flask_stream_slots = threading.BoundedSemaphore(SSE_MAX_FLASK_STREAMS)
+
+class LocalFanout:
+    # single process (dev server, tests): events go straight to this worker's watchers
+    def __init__(self):
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publish(self, events):
+        with self._lock:
+            for event in events:
+                self._seq += 1
+                event["id"] = str(self._seq)
+                comment_events.dispatch(event)
+
+    def replay(self, article_id, after_seq):
+        return comment_events.recent_events(article_id, after_seq)
+
+    def ensure_started(self):
+        pass
+
+class MongoEventLogFanout:
+    """
+    Cross-worker fan-out through the capped comment_events collection. publish() numbers the events
+    from a shared $inc counter (ObjectIds from different workers don't sort by time within a second)
+    and inserts them, one thread per worker follows the collection (change stream on a replica set,
+    tailable cursor on a standalone server) and dispatches new events to its watchers. Resume reads
+    the log by sequence number. When the follow cursor dies it picks up SSE_SEQ_REORDER_WINDOW
+    numbers behind the last dispatched event and skips the ones it already dispatched.
+    """
+    def __init__(self, use_change_stream):
+        self.use_change_stream = use_change_stream
+        self._started_pid = None
+        self._lock = threading.Lock()
+        self.follow_errors = 0
+        self._last_seq = None # tailable cursor position
+        self._dispatched = deque(maxlen=4 * SSE_SEQ_REORDER_WINDOW) # ids of recently dispatched events
+        self._dispatched_ids = set()
+        self._resume_token = None # change stream position
+
+    def publish(self, events):
+        # one counter bump and one insert for a whole batch (bulk moderation)
+        counter = sequences_collection.find_one_and_update(
+            {"_id": "comment_events"}, {"$inc": {"seq": len(events)}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        log_docs = []
+        for seq, event in enumerate(events, counter["seq"] - len(events) + 1):
+            event["id"] = str(seq)
+            log_docs.append({"seq": seq, "type": event["type"], "articleId": event["articleId"], "comment": event["comment"]})
+        events_collection.insert_many(log_docs)
+
+    def replay(self, article_id, after_seq):
+        oldest = events_collection.find_one({}, {"seq": 1}, sort=[("$natural", ASCENDING)])
+        events = [
+            event_from_log(doc)
+            for doc in events_collection.find({"articleId": article_id, "seq": {"$gt": after_seq}})
+            .sort("seq", ASCENDING).limit(SSE_REPLAY_SIZE)
+        ]
+        # the capped log has already dropped events the client missed
+        complete = oldest is None or oldest.get("seq", 0) <= after_seq
+        return events, complete
+
+    def ensure_started(self):
+        # started on the first watcher, per process, threads don't survive gunicorn's fork
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        threading.Thread(target=self._follow, name="comment-events", daemon=True).start()
+
+    def _follow(self):
+        while True:
+            try:
+                self._follow_once()
+            except OperationFailure as error:
+                self.follow_errors += 1
+                if error.code == CHANGE_STREAM_HISTORY_LOST:
+                    # the oplog no longer has our position, start over from now
+                    app.logger.warning(f"comment_events resume token expired, events may have been missed: {error}")
+                    self._resume_token = None
+                else:
+                    app.logger.warning(f"Following comment_events failed, retrying: {error}")
+            except Exception as error:
+                self.follow_errors += 1
+                app.logger.warning(f"Following comment_events failed, retrying: {error}")
+            time.sleep(1) # tailable cursors on an empty log die right away, don't spin
+
+    def _follow_once(self):
+        # runs until the cursor or stream dies, remembering the position of every dispatched event
+        if self.use_change_stream:
+            pipeline = [{"$match": {"operationType": "insert"}}]
+            with events_collection.watch(pipeline, resume_after=self._resume_token) as stream:
+                for change in stream:
+                    self._dispatch(change["fullDocument"])
+                    self._resume_token = change["_id"]
+            return
+        if self._last_seq is None:
+            # first start: only events published from now on, the ones already in the window count as seen
+            newest = events_collection.find_one({}, {"seq": 1}, sort=[("$natural", DESCENDING)])
+            self._last_seq = newest.get("seq", 0) if newest else 0
+            for doc in events_collection.find({"seq": {"$gt": self._last_seq - SSE_SEQ_REORDER_WINDOW}}, {"seq": 1}):
+                self._remember(str(doc["seq"]))
+        query = {"seq": {"$gt": self._last_seq - SSE_SEQ_REORDER_WINDOW}}
+        cursor = events_collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            for doc in cursor:
+                self._dispatch(doc)
+
+    def _remember(self, event_id):
+        if len(self._dispatched) == self._dispatched.maxlen:
+            self._dispatched_ids.discard(self._dispatched[0])
+        self._dispatched.append(event_id)
+        self._dispatched_ids.add(event_id)
+
+    def _dispatch(self, doc):
+        event = event_from_log(doc)
+        if event["id"] in self._dispatched_ids:
+            return
+        self._remember(event["id"])
+        self._last_seq = max(self._last_seq or 0, int(event["id"]))
+        comment_events.dispatch(event)
+
+def event_from_log(doc):
+    # comment_events document -> event, the sequence number is the SSE id
+    event = {field: value for field, value in doc.items() if field not in ("_id", "seq")}
+    event["id"] = str(doc["seq"])
+    return event
+
+def create_comment_fanout():
+    if SSE_FANOUT == "local":
+        return LocalFanout()
+    if SSE_FANOUT not in ("capped", "changestream"):
+        app.logger.warning(f"Unknown SSE_FANOUT '{SSE_FANOUT}', using capped.")
+    return MongoEventLogFanout(use_change_stream=SSE_FANOUT == "changestream")
+
+comment_fanout = create_comment_fanout()
+
+def publish_comment_events(event_type, comment_docs):
+    # live updates are best effort, a failed publish never fails the write that triggered it
+    # the fan-out assigns each event its id (sequence number)
+    events = [
+        {
+            "type": event_type,
+            "articleId": comment_doc.get("articleId"),
+            "comment": serialize_comment_for_frontend(comment_doc)
+        }
+        for comment_doc in comment_docs
+    ]
+    if not events:
+        return
+    try:
+        comment_fanout.publish(events)
+    except Exception as error:
+        comment_ids = [event["comment"].get("id") for event in events]
+        app.logger.error(f"Failed to publish {event_type} for comments {comment_ids}: {error}")
+
+def publish_comment_event(event_type, comment_doc):
+    publish_comment_events(event_type, [comment_doc])
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['comment'])}\n\n"
+
+SSE_RESET = "event: reset\ndata: {}\n\n" # client should refetch the comments and reconnect without Last-Event-ID
+SSE_HEARTBEAT = ": keep-alive\n\n"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def stream_start(article_id, last_event_id):
+    """
+    Opening chunks of a comment stream (retry hint, resumed events or a reset) and the ids of the
+    events replayed. Shared by the Flask and ASGI endpoints, subscribe before calling this so no
+    event falls between the replay and the live stream.
+    """
+    chunks = [f"retry: {SSE_RETRY_MS}\n\n"]
+    if not last_event_id or not last_event_id.isdigit():
+        return chunks, set()
+    try:
+        events, complete = comment_fanout.replay(article_id, int(last_event_id))
+    except Exception as error:
+        app.logger.error(f"Comment stream resume failed for article '{article_id}': {error}")
+        events, complete = [], False
+    if not complete:
+        chunks.append(SSE_RESET)
+    chunks.extend(format_sse(event) for event in events)
+    return chunks, {event["id"] for event in events}
+
+def already_sent(event, replayed_ids):
+    # live events that were also part of the replay; by id, sequence numbers may arrive out of order
+    return event["id"] in replayed_ids
+
+# ---------- RESPONSE COMPRESSION ----------
+
+# preferred first when the client accepts several at the same quality
+COMPRESS_ENCODINGS = tuple(
+    encoding for encoding, available in (("zstd", zstandard is not None), ("br", brotli is not None), ("gzip", True))
+    if available
+)
+
+class StreamCompressor:
+    # same compress/finish calls for every codec, compress(flush=True) emits everything seen so far
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._codec = zstandard.ZstdCompressor(level=COMPRESS_ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._codec = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._codec = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31) # wbits 31: gzip container
+
+    def compress(self, data, flush=False):
+        if self.encoding == "zstd":
+            return self._codec.compress(data) + (self._codec.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else b"")
+        if self.encoding == "br":
+            return self._codec.process(data) + (self._codec.flush() if flush else b"")
+        return self._codec.compress(data) + (self._codec.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._codec.finish()
+        return self._codec.flush()
+
+class CompressionMetrics:
+    # per encoding totals for tuning the levels against CPU, reported by /api/admin/stats
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._encodings = {}
+        self.skipped_small = 0
+        self.skipped_incompressible = 0
+
+    def record(self, encoding, bytes_in, bytes_out, cpu_seconds, streamed=False):
+        with self._lock:
+            totals = self._encodings.setdefault(encoding, {"responses": 0, "streamed": 0, "bytesIn": 0, "bytesOut": 0, "cpuSeconds": 0.0})
+            totals["responses"] += 1
+            totals["streamed"] += int(streamed)
+            totals["bytesIn"] += bytes_in
+            totals["bytesOut"] += bytes_out
+            totals["cpuSeconds"] += cpu_seconds
+
+    def skipped(self, small=False):
+        with self._lock:
+            if small:
+                self.skipped_small += 1
+            else:
+                self.skipped_incompressible += 1
+
+    def stats(self):
+        with self._lock:
+            encodings = {
+                encoding: dict(
+                    totals,
+                    cpuSeconds=round(totals["cpuSeconds"], 6),
+                    bytesSaved=totals["bytesIn"] - totals["bytesOut"],
+                    ratio=round(totals["bytesOut"] / totals["bytesIn"], 4) if totals["bytesIn"] else None
+                )
+                for encoding, totals in self._encodings.items()
+            }
+            return {
+                "available": list(COMPRESS_ENCODINGS),
+                "encodings": encodings,
+                "bytesSaved": sum(totals["bytesSaved"] for totals in encodings.values()),
+                "skippedSmall": self.skipped_small,
+                "skippedIncompressible": self.skipped_incompressible
+            }
+
+compression_metrics = CompressionMetrics()
+
+def choose_compression(accept_encoding):
+    # best encoding the client accepts (honouring q-values, q=0 refuses), None for identity
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(COMPRESS_ENCODINGS)
+
+def compress_body(encoding, body):
+    # whole-body compression, None when it wouldn't make the response smaller
+    started = time.thread_time()
+    compressor = StreamCompressor(encoding)
+    compressed = compressor.compress(body) + compressor.finish()
+    cpu_seconds = time.thread_time() - started
+    if len(compressed) >= len(body):
+        compression_metrics.skipped()
+        return None
+    compression_metrics.record(encoding, len(body), len(compressed), cpu_seconds)
+    return compressed
+
+class StreamedCompression:
+    """
+    One streamed body. Chunks go into the codec as they come but are only flushed every
+    COMPRESS_STREAM_FLUSH_BYTES of input (or COMPRESS_STREAM_FLUSH_SECONDS), a sync flush per
+    NDJSON line would cost most of the ratio. Shared by compress_stream and asgi.py.
+    """
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.compressor = StreamCompressor(encoding)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def feed(self, chunk):
+        # compressed bytes ready to send, often empty until the next flush
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        self._unflushed += len(chunk)
+        flush = self._unflushed >= COMPRESS_STREAM_FLUSH_BYTES \
+            or time.monotonic() - self._last_flush >= COMPRESS_STREAM_FLUSH_SECONDS
+        started = time.thread_time()
+        compressed = self.compressor.compress(chunk, flush=flush)
+        self.cpu_seconds += time.thread_time() - started
+        if flush:
+            self._unflushed = 0
+            self._last_flush = time.monotonic()
+        self.bytes_in += len(chunk)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def finish(self):
+        started = time.thread_time()
+        tail = self.compressor.finish()
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_out += len(tail)
+        return tail
+
+    def record(self):
+        compression_metrics.record(self.encoding, self.bytes_in, self.bytes_out, self.cpu_seconds, streamed=True)
+
+def compress_stream(encoding, chunks):
+    body = StreamedCompression(encoding)
+    try:
+        for chunk in chunks:
+            compressed = body.feed(chunk) if chunk else b""
+            if compressed:
+                yield compressed
+        yield body.finish()
+    finally:
+        # closing the wrapper has to close the wrapped generator too (SSE cleanup, stream_with_context)
+        if hasattr(chunks, "close"):
+            chunks.close()
+        body.record()
+
+def weaken_etag(headers):
+    # encoded bytes differ from the identity ones, a strong ETag would say they're the same
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+
+def no_compression(view):
+    # per-route opt-out, put it under @app.route
+    view.no_compression = True
+    return view
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses /api/ responses with the best of zstd/br/gzip the client accepts. Buffered bodies
+    under COMPRESS_MIN_BYTES are left alone, streamed bodies are flushed in blocks (see
+    StreamedCompression). A compressed response's ETag is made weak, since it names the collection
+    version and not these bytes; If-None-Match is compared weakly so revalidation still hits, and
+    Vary: Accept-Encoding keeps shared caches from mixing encodings.
+    """
+    if not request.path.startswith("/api/") or request.method == "HEAD":
+        return response
+    if getattr(app.view_functions.get(request.endpoint), "no_compression", False):
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough:
+        return response
+    if "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_compression(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(encoding, response.response)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            compression_metrics.skipped(small=True)
+            return response
+        compressed = compress_body(encoding, body)
+        if compressed is None:
+            return response
+        response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    weaken_etag(response.headers)
+    return response
+
 # ------------ MONGO API ENDPOINTS ---------------
+# the comment helpers below hold the request logic shared by the Flask routes and the ASGI app (asgi.py)
+
+def new_comment_doc(data, user_session_info):
+    # comment document for a validated POST body, path/depth are filled in by attach_parent()
+    author_name = "TEMP - Anon" # default if not logged in or no username
+    if user_session_info:
+        # p]refer username from Dex staticPasswords, fallback to email
+        author_name = user_session_info.get('username', user_session_info.get('email', "TEMP - Anon"))
+
+    comment_doc = {
+        "articleId": str(data["articleId"]), # str cast to ensure consistency
+        "author": author_name,
+        "content": data["content"],
+        "timestamp": time.time(),  # UNIX timestamp (float)
+        "removed": False,
+        "removedBy": "",
+        "needsReview": True, # in the pending moderation queue until a moderator acts on it
+        "parentId": data.get("parentId") # parentId for replies, None if not present
+    }
+    # bumped on every write (insert or moderation) so delta syncs pick it up
+    comment_doc["lastModified"] = comment_doc["timestamp"]
+    return comment_doc
+
+def parent_object_id(comment_doc):
+    # ObjectId of the parent to look up, None for root comments or malformed ids
+    if comment_doc["parentId"] is None:
+        return None
+    try:
+        # object ID generated via Mongo
+        return ObjectId(comment_doc["parentId"]) # already a string from data.get()
+    except Exception as error:
+        app.logger.warning(f"Invalid parentId format: {comment_doc['parentId']}. Storing as null. {error}")
+        return None
+
+def attach_parent(comment_doc, parent_doc):
+    if comment_doc["parentId"] is not None and parent_doc is None:
+        app.logger.warning(f"Parent comment {comment_doc['parentId']} not found. Storing as null.")
+        comment_doc["parentId"] = None
+    # materialized path: ancestor ids joined by "/", so a subtree is one index range
+    comment_doc["path"], comment_doc["depth"] = child_path_and_depth(parent_doc)
+
+def created_comment_payload(comment_doc, inserted_id):
+    return {
+        "id": str(inserted_id),
+        "articleId": comment_doc["articleId"],
+        "author": comment_doc["author"],
+        "content": comment_doc["content"],
+        "removed": comment_doc["removed"],
+        "removedBy": comment_doc["removedBy"],
+        "timestamp": comment_doc["timestamp"],
+        "lastModified": comment_doc["lastModified"],
+        "parentId": comment_doc["parentId"] # string or None
+    }
+
 @app.route("/api/comments", methods=["POST"])
 def add_comment():
     if comments_collection is None:
@@ -260,83 +2327,662 @@ def add_comment():
         if not data or 'content' not in data or 'articleId' not in data:
             return jsonify({"error": "Missing articleId or content in request"}), 400
 
-        user_session_info = session.get('user')
-        author_name = "TEMP - Anon" # default if not logged in or no username
-        if user_session_info:
-            # p]refer username from Dex staticPasswords, fallback to email
-            author_name = user_session_info.get('username', user_session_info.get('email', "TEMP - Anon"))
-
-        comment_doc = {
-            "articleId": str(data["articleId"]), # str cast to ensure consistency
-            "author": author_name,
-            "content": data["content"],
-            "timestamp": time.time(),  # UNIX timestamp (float)
-            "removed": False,
-            "removedBy": "",
-            "parentId": data.get("parentId") # parentId for replies, None if not present
-        }
+        comment_doc = new_comment_doc(data, session.get('user'))
 
         # confirm parent exists
-        if comment_doc["parentId"] is not None:
-            try:
-                # object ID generated via Mongo
-                ObjectId(comment_doc["parentId"]) # already a string from data.get()
-            except Exception as error:
-                app.logger.warning(f"Invalid parentId format: {comment_doc['parentId']}. Storing as null.", error)
-                comment_doc["parentId"] = None
-
+        parent_id = parent_object_id(comment_doc)
+        parent_doc = None
+        if parent_id is not None:
+            parent_doc = comments_collection.find_one({"_id": parent_id}, {"path": 1, "depth": 1})
+        attach_parent(comment_doc, parent_doc)
 
         result = comments_collection.insert_one(comment_doc)
+        increment_comment_count(comment_doc["articleId"], total=1)
+        publish_comment_event("comment.created", dict(comment_doc, _id=result.inserted_id))
 
         # new comment in frontend structure
-        created_comment_response = {
-            "id": str(result.inserted_id),
-            "articleId": comment_doc["articleId"],
-            "author": comment_doc["author"],
-            "content": comment_doc["content"],
-            "removed": comment_doc["removed"],
-            "removedBy": comment_doc["removedBy"],
-            "timestamp": comment_doc["timestamp"],
-            "parentId": comment_doc["parentId"] # string or None
-        }
+        created_comment_response = created_comment_payload(comment_doc, result.inserted_id)
         return jsonify(created_comment_response), 201
 
     except Exception as error:
         app.logger.error(f"Error adding comment: {error}", exc_info=True)
         return jsonify({"error": f"Internal server error: {str(error)}"}), 500
 
+class CommentIngest:
+    """
+    Bulk comment import from NDJSON records, validated and normalized like add_comment.
+
+    Record: {"articleId", "content", "author"?, "timestamp"?, "removed"?, "removedBy"?,
+             "moderationTimestamp"?, "id"? (id in the source system),
+             "parentId"? (a source id or an existing comment id)}
+
+    lastModified is the ingest time, not the source timestamp, so delta-sync clients whose
+    high-water mark is past the historical timestamps still pick the imported comments up.
+
+    Each batch costs one find (existing imports and unknown parents), one unordered insert_many
+    and one counter bulk_write. _ids are generated before the insert, so replies can point to
+    parents earlier in the same batch. Bad records are reported per line and skipped; replies
+    whose parent in the same batch failed to insert are deleted again and reported too.
+    """
+    def __init__(self, batch_size=INGEST_BATCH_SIZE):
+        self.batch_size = max(1, min(batch_size, MAX_INGEST_BATCH_SIZE))
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self._pending = [] # (line number, record) waiting for the next batch
+        self._line_number = 0
+        # source id or comment id -> (ObjectId, path, depth) of recently ingested or looked up comments
+        self._known = OrderedDict()
+
+    def add_lines(self, lines):
+        for raw_line in lines:
+            self._line_number += 1
+            if not raw_line.strip():
+                continue
+            try:
+                record = json.loads(raw_line)
+            except ValueError as error:
+                self.record_error(self._line_number, f"Invalid JSON: {error}")
+                continue
+            if not isinstance(record, dict) or 'content' not in record or 'articleId' not in record:
+                self.record_error(self._line_number, "Missing articleId or content in record")
+                continue
+            self._pending.append((self._line_number, record))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+        self.flush()
+
+    def record_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_INGEST_ERRORS:
+            self.errors.append({"line": line_number, "error": message})
+
+    def remember(self, key, comment_id, path, depth):
+        self._known[key] = (comment_id, path, depth)
+        self._known.move_to_end(key)
+        if len(self._known) > INGEST_PARENT_CACHE_SIZE:
+            self._known.popitem(last=False)
+
+    def lookup_batch(self, batch):
+        # one read for the batch: records imported by an earlier run, and parents not seen in this run
+        import_ids = [str(record["id"]) for _, record in batch if record.get("id") is not None]
+        parent_refs = {str(record["parentId"]) for _, record in batch if record.get("parentId")} - set(self._known)
+        clauses = []
+        if import_ids or parent_refs:
+            clauses.append({"importId": {"$in": import_ids + list(parent_refs)}})
+        parent_object_ids = [ObjectId(ref) for ref in parent_refs if ObjectId.is_valid(ref)]
+        if parent_object_ids:
+            clauses.append({"_id": {"$in": parent_object_ids}})
+        if not clauses:
+            return set()
+        already_imported = set()
+        for doc in comments_collection.find({"$or": clauses}, {"importId": 1, "path": 1, "depth": 1}):
+            path, depth = doc.get("path", ""), doc.get("depth", 0)
+            self.remember(str(doc["_id"]), doc["_id"], path, depth)
+            if doc.get("importId") is not None:
+                self.remember(doc["importId"], doc["_id"], path, depth)
+                already_imported.add(doc["importId"])
+        return already_imported
+
+    def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        already_imported = self.lookup_batch(batch)
+
+        docs, doc_lines = [], []
+        # source id or comment id -> (ObjectId, path, depth, position in docs) for this batch,
+        # only moved into _known once the insert went through
+        batch_known = {}
+        parent_positions = [] # position in docs of each doc's parent, None if it isn't in this batch
+        for line_number, record in batch:
+            import_id = str(record["id"]) if record.get("id") is not None else None
+            if import_id in already_imported:
+                self.record_error(line_number, f"Comment {import_id} was already imported")
+                continue
+            if import_id is not None and import_id in batch_known:
+                self.record_error(line_number, f"Comment {import_id} appears more than once in the batch")
+                continue
+            removed = record.get("removed", False)
+            if removed in ("true", "false"):
+                removed = removed == "true"
+            if removed is not None and not isinstance(removed, bool):
+                self.record_error(line_number, "Invalid removed, must be true or false")
+                continue
+            # same normalization as add_comment, the author comes from the record instead of the session
+            author = record.get("author")
+            comment_doc = new_comment_doc(record, {"username": str(author)} if author else None)
+            ingested_at = comment_doc["lastModified"]
+            try:
+                if record.get("timestamp") is not None:
+                    comment_doc["timestamp"] = float(record["timestamp"])
+                if removed:
+                    comment_doc["removed"] = True
+                    comment_doc["removedBy"] = str(record.get("removedBy") or "")
+                    # the removed/moderator queues sort and page on moderationTimestamp
+                    moderation_time = record.get("moderationTimestamp")
+                    comment_doc["moderationTimestamp"] = float(moderation_time) if moderation_time is not None else ingested_at
+            except (TypeError, ValueError):
+                self.record_error(line_number, "Invalid timestamp or moderationTimestamp, must be a number")
+                continue
+            comment_doc["needsReview"] = False # history, not new submissions
+
+            parent_ref = str(record["parentId"]) if record.get("parentId") else None
+            batch_parent = batch_known.get(parent_ref) if parent_ref else None
+            parent = batch_parent or (self._known.get(parent_ref) if parent_ref else None)
+            if parent_ref and parent is None:
+                self.record_error(line_number, f"Unknown parentId {record['parentId']}")
+                continue
+            if parent is not None:
+                comment_doc["parentId"] = str(parent[0])
+                comment_doc["path"], comment_doc["depth"] = child_path_and_depth(
+                    {"_id": parent[0], "path": parent[1], "depth": parent[2]}
+                )
+            else:
+                comment_doc["parentId"] = None
+                comment_doc["path"], comment_doc["depth"] = child_path_and_depth(None)
+
+            comment_doc["_id"] = ObjectId()
+            entry = (comment_doc["_id"], comment_doc["path"], comment_doc["depth"], len(docs))
+            if import_id is not None:
+                comment_doc["importId"] = import_id
+                batch_known[import_id] = entry
+            batch_known[str(comment_doc["_id"])] = entry
+            parent_positions.append(batch_parent[3] if batch_parent else None)
+            docs.append(comment_doc)
+            doc_lines.append(line_number)
+
+        if not docs:
+            return
+        failed_positions = set()
+        try:
+            comments_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as bulk_error:
+            for write_error in bulk_error.details.get("writeErrors", []):
+                failed_positions.add(write_error["index"])
+                self.record_error(doc_lines[write_error["index"]], write_error.get("errmsg", "Insert failed"))
+
+        # parents come before their replies in docs, so one pass also catches replies to orphaned replies
+        orphaned = []
+        for position, parent_position in enumerate(parent_positions):
+            if parent_position in failed_positions and position not in failed_positions:
+                failed_positions.add(position)
+                orphaned.append(docs[position]["_id"])
+                self.record_error(doc_lines[position], "Parent comment failed to insert")
+        if orphaned:
+            comments_collection.delete_many({"_id": {"$in": orphaned}})
+
+        for key, (comment_id, path, depth, position) in batch_known.items():
+            if position not in failed_positions:
+                self.remember(key, comment_id, path, depth)
+
+        counts = {} # articleId -> [total, removed] for the comments that made it in
+        for position, comment_doc in enumerate(docs):
+            if position in failed_positions:
+                continue
+            article_counts = counts.setdefault(comment_doc["articleId"], [0, 0])
+            article_counts[0] += 1
+            article_counts[1] += 1 if comment_doc["removed"] else 0
+        self.inserted += len(docs) - len(failed_positions)
+        if comment_counts_collection is not None and counts:
+            try:
+                comment_counts_collection.bulk_write([
+                    UpdateOne({"_id": article_id}, {"$inc": {"total": total, "removed": removed}}, upsert=True)
+                    for article_id, (total, removed) in counts.items()
+                ], ordered=False)
+            except Exception as error:
+                app.logger.error(f"Failed to update comment counts after ingest batch: {error}")
+
+    def report(self):
+        return {"inserted": self.inserted, "failed": self.failed, "errors": self.errors}
+
+@app.route("/api/comments/ingest", methods=["POST"])
+@role_required(["admin"])
+def ingest_comments(moderator_info):
+    # NDJSON body, read line by line so large imports aren't held in memory
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+    try:
+        batch_size = int(request.args.get("batchSize", INGEST_BATCH_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid batchSize, must be an integer"}), 400
+
+    try:
+        ingest = CommentIngest(batch_size)
+        ingest.add_lines(request.stream)
+        report = ingest.report()
+        app.logger.info(f"Comment ingest by {moderator_info.get('username')}: {report['inserted']} inserted, {report['failed']} failed.")
+        return jsonify(report), 200
+
+    except Exception as error:
+        app.logger.error(f"Error ingesting comments: {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
+# the fields serialize_comment_for_frontend reads (plus _id), list reads project to these so Mongo
+# doesn't send and pymongo doesn't decode paths, moderation and review fields nobody serializes
+COMMENT_FRONTEND_PROJECTION = dict.fromkeys(
+    ("articleId", "author", "content", "removed", "removedBy", "timestamp", "lastModified", "parentId"), 1
+)
+
+# thread nodes also need their position in the tree
+COMMENT_THREAD_PROJECTION = dict(COMMENT_FRONTEND_PROJECTION, path=1, depth=1)
+
 def serialize_comment_for_frontend(comment_doc):
     if not comment_doc:
         return None
+    get = comment_doc.get # called 8 times per comment, list endpoints run this for every document
+    timestamp = get("timestamp")
+    parent_id = get("parentId")
     return {
         "id": str(comment_doc["_id"]),
-        "articleId": comment_doc.get("articleId", ""), # must be present
-        "author": comment_doc.get("author", "Anonymous"),
-        "content": comment_doc.get("content", ""),
-        "removed": comment_doc.get("removed", False),
-        "removedBy": comment_doc.get("removedBy", ""),
-        "timestamp": comment_doc.get("timestamp"),
-        "parentId": str(comment_doc["parentId"]) if comment_doc.get("parentId") else None # type check again, I think unneeded but safe to keep
+        "articleId": get("articleId", ""), # must be present
+        "author": get("author", "Anonymous"),
+        "content": get("content", ""),
+        "removed": get("removed", False),
+        "removedBy": get("removedBy", ""),
+        "timestamp": timestamp,
+        # comments written before delta sync have no lastModified, fall back to creation time
+        "lastModified": get("lastModified", timestamp),
+        "parentId": str(parent_id) if parent_id else None # type check again, I think unneeded but safe to keep
+    }
+
+def serialize_comment_list(comment_docs):
+    # skips failed or missing data (no articleId) in the same pass instead of filtering a second list
+    serialize = serialize_comment_for_frontend
+    return [serialize(comment) for comment in comment_docs if comment and comment.get("articleId")]
+
+# delta pages are ordered by (lastModified, _id): a bulk moderation gives hundreds of comments
+# the same lastModified, and a float high-water mark alone would skip the ones past the page end
+DELTA_SORT = [("lastModified", ASCENDING), ("_id", ASCENDING)]
+
+def parse_since(raw_since):
+    # returns ((lastModified, ObjectId or None), error message). Accepts the highWaterMark
+    # cursor of a previous delta ("<lastModified>_<id>") or a bare UNIX timestamp for the first sync
+    if raw_since is None:
+        return None, None
+    decoded_cursor = decode_comment_cursor(raw_since)
+    if decoded_cursor is not None:
+        return decoded_cursor, None
+    try:
+        return (float(raw_since), None), None
+    except ValueError:
+        return None, "Invalid 'since', must be a highWaterMark cursor or a UNIX timestamp"
+
+def delta_query(since):
+    modified_after, last_id = since
+    if last_id is None:
+        return {"lastModified": {"$gt": modified_after}}
+    return {"$or": [
+        {"lastModified": {"$gt": modified_after}},
+        {"lastModified": modified_after, "_id": {"$gt": last_id}},
+    ]}
+
+def delta_payload(changed_comments, raw_since):
+    # changed_comments holds up to MAX_COMMENT_DELTA_SIZE + 1 docs in DELTA_SORT order
+    has_more = len(changed_comments) > MAX_COMMENT_DELTA_SIZE
+    changed_comments = changed_comments[:MAX_COMMENT_DELTA_SIZE]
+    return {
+        "comments": serialize_comment_list(changed_comments),
+        # passed back as ?since= for the next delta
+        "highWaterMark": encode_comment_cursor(changed_comments[-1], "lastModified") if changed_comments else raw_since,
+        "hasMore": has_more
     }
 
+def comments_version_tag(latest_docs, document_count):
+    latest_modified = latest_docs[0].get("lastModified", 0) if latest_docs else 0
+    return f"{latest_modified!r}-{document_count}"
+
+def get_comments_version():
+    # cheap collection version for ETags: newest lastModified (index lookup) + estimated count (metadata)
+    latest_docs = list(
+        comments_collection.find({}, {"lastModified": 1}).sort("lastModified", DESCENDING).limit(1)
+    )
+    return comments_version_tag(latest_docs, comments_collection.estimated_document_count())
+
 @app.route("/api/comments", methods=["GET"])
 def get_all_comments():
     if comments_collection is None:
         return jsonify({"error": "Database service not available"}), 503
-    try:
-        # fetch and sort by newest (DESCENDING)
-        all_db_comments = list(comments_collection.find().sort("timestamp", DESCENDING))
 
-        serialized_comments = [serialize_comment_for_frontend(comment) for comment in all_db_comments]
-        # filter None's i.e., failed or missing data
-        serialized_comments = [c for c in serialized_comments if c and c.get("articleId")]
+    raw_since = request.args.get("since")
+    since, error_message = parse_since(raw_since)
+    if error_message:
+        return jsonify({"error": error_message}), 400
+
+    try:
+        # unchanged collection -> 304 before touching any comment documents
+        comments_version = get_comments_version()
+        # weak comparison: compressed responses carry W/"<version>"
+        if request.if_none_match.contains_weak(comments_version):
+            not_modified = app.response_class(status=304)
+            # same validator the 200 would carry, weak when it would have been compressed
+            accepts_compression = choose_compression(request.headers.get("Accept-Encoding")) is not None
+            not_modified.set_etag(comments_version, weak=accepts_compression)
+            not_modified.vary.add("Accept-Encoding")
+            return not_modified
+
+        if since is not None:
+            # delta mode: only comments inserted or moderated after the client's high-water mark
+            changed_comments = list(
+                comments_collection.find(delta_query(since), COMMENT_FRONTEND_PROJECTION)
+                .sort(DELTA_SORT)
+                .limit(MAX_COMMENT_DELTA_SIZE + 1)
+            )
+            response = jsonify(delta_payload(changed_comments, raw_since))
+        else:
+            # fetch and sort by newest (DESCENDING)
+            all_db_comments = list(comments_collection.find({}, COMMENT_FRONTEND_PROJECTION).sort("timestamp", DESCENDING))
+            response = jsonify(serialize_comment_list(all_db_comments))
 
-        return jsonify(serialized_comments), 200
+        response.set_etag(comments_version)
+        return response, 200
 
     except Exception as error:
         app.logger.error(f"Error fetching comments: {error}", exc_info=True)
         return jsonify({"error": f"Internal server error: {str(error)}"}), 500
 
+@app.route("/api/articles/<path:article_id>/comments", methods=["GET"])
+def get_article_comments(article_id):
+    # one page of an article's comments, newest first, served from the articleId_timestamp_id index
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    limit = parse_page_size(request.args.get("limit"))
+    if limit is None:
+        return jsonify({"error": "Invalid limit, must be an integer"}), 400
+
+    query = {"articleId": str(article_id)}
+    cursor = request.args.get("cursor")
+    if cursor:
+        decoded_cursor = decode_comment_cursor(cursor)
+        if decoded_cursor is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query["$or"] = keyset_before("timestamp", decoded_cursor)
+
+    try:
+        # fetch one extra document to know if another page exists
+        page_docs = list(
+            comments_collection.find(query, COMMENT_FRONTEND_PROJECTION)
+            .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+        )
+        has_more = len(page_docs) > limit
+        page_docs = page_docs[:limit]
+
+        return jsonify({
+            "comments": [serialize_comment_for_frontend(comment) for comment in page_docs],
+            "nextCursor": encode_comment_cursor(page_docs[-1]) if has_more else None
+        }), 200
+
+    except Exception as error:
+        app.logger.error(f"Error fetching comments for article '{article_id}': {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
+@app.route("/api/articles/<path:article_id>/comments/stream", methods=["GET"])
+@no_compression
+def stream_article_comments(article_id):
+    """
+    Server-Sent Events for one article: comment.created and comment.moderated events carrying the
+    serialized comment, a heartbeat comment every SSE_HEARTBEAT_INTERVAL seconds, and resume from
+    Last-Event-ID (header, or ?lastEventId=). Under gunicorn every open stream holds a worker
+    thread, so at most SSE_MAX_FLASK_STREAMS are open per worker and the rest get a 503, serve many
+    watchers through asgi.py instead.
+    """
+    if not flask_stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many live comment streams, please try again later."})
+        response.headers["Retry-After"] = str(SSE_RETRY_MS // 1000)
+        return response, 503
+
+    article_id = str(article_id)
+    try:
+        comment_fanout.ensure_started()
+        subscription = comment_events.subscribe(CommentSubscription(article_id))
+    except Exception:
+        flask_stream_slots.release()
+        raise
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+
+    def generate():
+        try:
+            chunks, replayed_ids = stream_start(article_id, last_event_id)
+            yield from chunks
+            deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                event = subscription.next_event(SSE_HEARTBEAT_INTERVAL)
+                if subscription.overflowed:
+                    yield SSE_RESET
+                    return
+                if event is None:
+                    yield SSE_HEARTBEAT # also how a closed connection gets noticed
+                elif not already_sent(event, replayed_ids):
+                    yield format_sse(event)
+        finally:
+            comment_events.unsubscribe(subscription)
+
+    def close_stream():
+        # runs when the server closes the response, even if the generator never started
+        comment_events.unsubscribe(subscription)
+        flask_stream_slots.release()
+
+    response = Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+    response.call_on_close(close_stream)
+    return response
+
+@app.route("/api/comments/counts", methods=["POST"])
+def get_comment_counts():
+    # comment counts for a page of articles in one round trip, read from the counter documents
+    if comment_counts_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    data = request.get_json(silent=True)
+    article_ids = data.get("articleIds") if isinstance(data, dict) else None
+    if not isinstance(article_ids, list):
+        return jsonify({"error": "Missing 'articleIds' list in request body"}), 400
+    if len(article_ids) > MAX_COUNT_BATCH_SIZE:
+        return jsonify({"error": f"Too many articleIds, max is {MAX_COUNT_BATCH_SIZE}"}), 400
+
+    article_ids = [str(article_id) for article_id in article_ids]
+    try:
+        # articles without a counter document have no comments yet
+        counts = {article_id: {"total": 0, "removed": 0} for article_id in article_ids}
+        for counter in comment_counts_collection.find({"_id": {"$in": article_ids}}):
+            counts[counter["_id"]] = {
+                "total": counter.get("total", 0),
+                "removed": counter.get("removed", 0)
+            }
+        return jsonify({"counts": counts}), 200
+
+    except Exception as error:
+        app.logger.error(f"Error fetching comment counts: {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
+def thread_response(base_query, top_depth):
+    # shared by the article and comment thread endpoints: parse limits, page the top level, load
+    # its replies with one range query, nest
+    limit = parse_page_size(request.args.get("limit"))
+    try:
+        max_depth = int(request.args.get("depth", DEFAULT_THREAD_DEPTH))
+    except ValueError:
+        max_depth = None
+    if limit is None or max_depth is None:
+        return jsonify({"error": "Invalid limit or depth, must be integers"}), 400
+    max_depth = max(1, min(max_depth, MAX_THREAD_DEPTH))
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        cursor = decode_comment_cursor(cursor)
+        if cursor is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    # the page's top level first, so the work below follows the page size, not the thread size
+    top_query = dict(base_query, depth=top_depth)
+    if cursor:
+        top_query["$or"] = keyset_before("timestamp", cursor)
+    top_level = list(
+        comments_collection.find(top_query, COMMENT_THREAD_PROJECTION)
+        .sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+    has_more = len(top_level) > limit
+    top_level = top_level[:limit]
+
+    reply_docs = []
+    if top_level:
+        # then only those comments' subtrees, one path range each, plus one extra level so nodes
+        # at the depth limit can report hidden replies
+        reply_query = {
+            "articleId": base_query["articleId"],
+            "$or": [{"path": comment_subtree_range(comment)} for comment in top_level],
+            "depth": {"$gt": top_depth, "$lte": top_depth + max_depth},
+        }
+        reply_docs = list(
+            comments_collection.find(reply_query, COMMENT_THREAD_PROJECTION).sort("path", ASCENDING).limit(MAX_THREAD_DOCS)
+        )
+        if len(reply_docs) == MAX_THREAD_DOCS:
+            app.logger.warning(f"Thread query {base_query} hit MAX_THREAD_DOCS, deep replies truncated.")
+
+    return jsonify(assemble_thread(top_level, reply_docs, max_depth, limit, has_more)), 200
+
+@app.route("/api/articles/<path:article_id>/thread", methods=["GET"])
+def get_article_thread(article_id):
+    # an article's comments already nested, top level newest first with a cursor
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+    try:
+        return thread_response({"articleId": str(article_id)}, 0)
+    except Exception as error:
+        app.logger.error(f"Error fetching thread for article '{article_id}': {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
+@app.route("/api/comments/<comment_id>/thread", methods=["GET"])
+def get_comment_thread(comment_id):
+    # the replies under one comment, nested; the cursor continues a "load more replies" list
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+    if not ObjectId.is_valid(comment_id):
+        return jsonify({"error": "Invalid comment ID format"}), 400
+    try:
+        parent_doc = comments_collection.find_one(
+            {"_id": ObjectId(comment_id)}, {"articleId": 1, "path": 1, "depth": 1}
+        )
+        if parent_doc is None:
+            return jsonify({"error": "Comment not found"}), 404
+        return thread_response(
+            {"articleId": parent_doc.get("articleId"), "path": comment_subtree_range(parent_doc)},
+            parent_doc.get("depth", 0) + 1
+        )
+    except Exception as error:
+        app.logger.error(f"Error fetching thread for comment '{comment_id}': {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
+# ---------- COMMENT SEARCH ----------
+
+SEARCH_TERM_PATTERN = re.compile(r'"([^"]+)"|(\S+)')
+SEARCH_SUFFIXES = ("ing", "ed", "es", "s", "ly") # rough stand-in for Mongo's stemming when highlighting
+
+def comment_search_terms(query):
+    # words and "quoted phrases" the text index matches on, negated terms ("-word") are skipped
+    terms = []
+    for phrase, word in SEARCH_TERM_PATTERN.findall(query):
+        if phrase:
+            terms.append(phrase)
+        elif not word.startswith("-"):
+            for suffix in SEARCH_SUFFIXES:
+                if len(word) > len(suffix) + 2 and word.lower().endswith(suffix):
+                    word = word[:-len(suffix)]
+                    break
+            terms.append(word)
+    return terms
+
+def highlight_snippet(text, terms, length=COMMENT_SNIPPET_LENGTH):
+    # window of text around the first match, with [start, end) offsets of every match in the window
+    if not text or not terms:
+        return {"text": (text or "")[:length], "highlights": []}
+    pattern = re.compile("|".join(rf"\b{re.escape(term)}\w*" for term in terms), re.IGNORECASE)
+    first_match = pattern.search(text)
+    start = 0
+    if first_match and len(text) > length:
+        start = max(0, min(first_match.start() - length // 3, len(text) - length))
+    window = text[start:start + length]
+    return {
+        "text": window,
+        "highlights": [[match.start(), match.end()] for match in pattern.finditer(window)],
+        "truncatedStart": start > 0,
+        "truncatedEnd": start + length < len(text)
+    }
+
+def parse_search_time(raw_value, name):
+    # returns (timestamp or None, error message)
+    if raw_value is None:
+        return None, None
+    try:
+        return float(raw_value), None
+    except ValueError:
+        return None, f"Invalid {name}, must be a UNIX timestamp"
+
+@app.route("/api/comments/search", methods=["GET"])
+@role_required(["admin", "moderator"])
+def search_comments(moderator_info):
+    """
+    ?q=<text index query>&articleId=&since=&until=&limit=&page=
+    Uses the content/author text index, ordered by relevance then newest first.
+    """
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    search_query = (request.args.get("q") or "").strip()
+    if not search_query:
+        return jsonify({"error": "Missing search query 'q'"}), 400
+    if len(search_query) > MAX_COMMENT_SEARCH_QUERY_LENGTH:
+        return jsonify({"error": f"Search query longer than {MAX_COMMENT_SEARCH_QUERY_LENGTH} characters"}), 400
+
+    limit = parse_page_size(request.args.get("limit"))
+    try:
+        page = int(request.args.get("page", 0))
+    except ValueError:
+        page = None
+    if limit is None or page is None or page < 0:
+        return jsonify({"error": "Invalid limit or page, must be integers"}), 400
+    if (page + 1) * limit > MAX_COMMENT_SEARCH_RESULTS:
+        return jsonify({"error": f"Only the first {MAX_COMMENT_SEARCH_RESULTS} results can be paged through, refine the query"}), 400
+
+    query = {"$text": {"$search": search_query}}
+    if request.args.get("articleId"):
+        query["articleId"] = request.args["articleId"]
+    time_range = {}
+    for name, operator in (("since", "$gte"), ("until", "$lt")):
+        value, error_message = parse_search_time(request.args.get(name), name)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+        if value is not None:
+            time_range[operator] = value
+    if time_range:
+        query["timestamp"] = time_range
+
+    try:
+        found_docs = list(
+            comments_collection.find(query, {"score": {"$meta": "textScore"}})
+            .sort([("score", {"$meta": "textScore"}), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+            .skip(page * limit)
+            .limit(limit + 1)
+        )
+        has_more = len(found_docs) > limit and (page + 2) * limit <= MAX_COMMENT_SEARCH_RESULTS
+        terms = comment_search_terms(search_query)
+
+        return jsonify({
+            "comments": [
+                dict(serialize_comment_for_frontend(comment),
+                     score=comment.get("score"),
+                     snippet=highlight_snippet(comment.get("content", ""), terms))
+                for comment in found_docs[:limit]
+            ],
+            "nextPage": page + 1 if has_more else None
+        }), 200
+
+    except Exception as error:
+        app.logger.error(f"Error searching comments for '{search_query}': {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
 # unused current, I think useful for moderation
 @app.route("/api/comments/<comment_id>", methods=["GET"])
 def get_comment_by_id(comment_id):
@@ -355,65 +3001,325 @@ def get_comment_by_id(comment_id):
         app.logger.error(f"Error fetching comment by ID '{comment_id}': {error}", exc_info=True)
         return jsonify({"error": f"Internal server error: {str(error)}"}), 500
 
+# fields written by /api/comments/export (everything needed to restore a comment)
+EXPORT_PROJECTION = {
+    "articleId": 1, "author": 1, "content": 1, "timestamp": 1, "lastModified": 1, "removed": 1,
+    "removedBy": 1, "moderationTimestamp": 1, "parentId": 1, "path": 1, "depth": 1
+}
+
+def export_comment(comment_doc):
+    comment_doc["id"] = str(comment_doc.pop("_id"))
+    return json.dumps(comment_doc, default=str)
+
+def parse_export_filters(args):
+    # returns (query, error message)
+    query = {}
+    if args.get("articleId"):
+        query["articleId"] = args["articleId"]
+    try:
+        time_range = {}
+        if args.get("since"):
+            time_range["$gte"] = float(args["since"])
+        if args.get("until"):
+            time_range["$lt"] = float(args["until"])
+    except ValueError:
+        return None, "Invalid 'since' or 'until', must be UNIX timestamps"
+    if time_range:
+        query["timestamp"] = time_range
+    removed = args.get("removed")
+    if removed is not None:
+        if removed not in ("true", "false"):
+            return None, "Invalid 'removed', must be 'true' or 'false'"
+        query["removed"] = removed == "true"
+    return query, None
+
 # ----------------- MODERATION ENDPOINTS ------------------
-@app.route("/api/comments/<comment_id>/moderate", methods=["PUT"])
-@role_required(["admin", "moderator"]) # Protect this endpoint
-def moderate_comment(comment_id, moderator_info): # moderator_info injected by decorator
+@app.route("/api/comments/export", methods=["GET"])
+@role_required(["admin", "moderator"])
+def export_comments(moderator_info):
+    # streams comments as NDJSON (default) or a chunked JSON array, one cursor batch in memory at a time
     if comments_collection is None:
         return jsonify({"error": "Database service not available"}), 503
 
-    if not ObjectId.is_valid(comment_id):
-        return jsonify({"error": "Invalid comment ID format"}), 400
-
-    data = request.get_json()
-    if not data or "action" not in data:
-        return jsonify({"error": "Missing 'action' in request body (e.g., 'delete_full', 'redact_partial')"}), 400
-
-    action = data.get("action")
-    moderator_name = moderator_info.get('username', moderator_info.get('email', "Unknown Moderator"))
+    query, error_message = parse_export_filters(request.args)
+    if error_message:
+        return jsonify({"error": error_message}), 400
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "json"):
+        return jsonify({"error": "Invalid 'format', must be 'ndjson' or 'json'"}), 400
+
+    cursor = comments_collection.find(query, EXPORT_PROJECTION).sort("_id", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+
+    def generate():
+        try:
+            if export_format == "ndjson":
+                for comment in cursor:
+                    yield export_comment(comment) + "\n"
+            else:
+                yield "["
+                separator = ""
+                for comment in cursor:
+                    yield separator + export_comment(comment)
+                    separator = ","
+                yield "]"
+        except Exception as error:
+            # headers are already sent, the truncated body is the only signal the client gets
+            app.logger.error(f"Comment export failed mid-stream: {error}", exc_info=True)
+        finally:
+            cursor.close()
+
+    app.logger.info(f"Comment export started by {moderator_info.get('username')} with filters {query}")
+    mimetype = "application/x-ndjson" if export_format == "ndjson" else "application/json"
+    return Response(generate(), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename=comments.{export_format}"
+    })
+
+def moderation_update_fields(action, new_content, moderator_name, moderation_time):
+    # $set for one moderation action, shared by the single and bulk endpoints. Returns (fields, error message)
+    if action == "approve":
+        # reviewed and kept, only takes the comment out of the pending queue
+        return {
+            "needsReview": False,
+            "reviewedBy": moderator_name,
+            "reviewTimestamp": moderation_time,
+            "lastModified": moderation_time
+        }, None
 
     update_fields = {
         "removed": True,
         "removedBy": moderator_name,
-        "moderationTimestamp": time.time()
+        "moderationTimestamp": moderation_time,
+        "needsReview": False,
+        "lastModified": moderation_time # picked up by delta syncs
     }
 
     if action == "delete_full":
         update_fields["content"] = "Comment has been deleted by moderation."
     elif action == "redact_partial":
-        new_content = data.get("new_content")
         if new_content is None: # Check for None, empty string might be valid for full clear by mistake
-            return jsonify({"error": "Missing 'new_content' for redaction"}), 400
+            return None, "Missing 'new_content' for redaction"
         update_fields["content"] = new_content # frontend sends the block characters
     else:
-        return jsonify({"error": f"Invalid moderation action: {action}"}), 400
+        return None, f"Invalid moderation action: {action}"
+    return update_fields, None
+
+@app.route("/api/comments/<comment_id>/moderate", methods=["PUT"])
+@role_required(["admin", "moderator"]) # Protect this endpoint
+def moderate_comment(comment_id, moderator_info): # moderator_info injected by decorator
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    if not ObjectId.is_valid(comment_id):
+        return jsonify({"error": "Invalid comment ID format"}), 400
+
+    data = request.get_json()
+    if not data or "action" not in data:
+        return jsonify({"error": "Missing 'action' in request body (e.g., 'delete_full', 'redact_partial', 'approve')"}), 400
+
+    moderator_name = moderator_info.get('username', moderator_info.get('email', "Unknown Moderator"))
+    update_fields, error_message = moderation_update_fields(data.get("action"), data.get("new_content"), moderator_name, time.time())
+    if error_message:
+        return jsonify({"error": error_message}), 400
 
     try:
-        result = comments_collection.update_one(
+        # one round trip: the previous state tells us whether this moderation removes the comment
+        # for the first time, and with the $set applied it is the updated comment
+        previous_doc = comments_collection.find_one_and_update(
             {"_id": ObjectId(comment_id)},
-            {"$set": update_fields}
+            {"$set": update_fields},
+            return_document=ReturnDocument.BEFORE
         )
 
-        if result.matched_count == 0:
+        if previous_doc is None:
             return jsonify({"error": "Comment not found"}), 404
 
-        if result.modified_count == 0 and result.matched_count > 0:
-            # comment was already in target state
-            app.logger.info(f"Comment {comment_id} was matched but not modified by moderation. State might have been identical.")
-
-
-        # fetch updated comment
-        updated_comment_doc = comments_collection.find_one({"_id": ObjectId(comment_id)})
-        if not updated_comment_doc:
-            # if matched_count > 0 will not happen
-            return jsonify({"error": "Failed to retrieve comment after moderation"}), 500
+        if update_fields.get("removed") and not previous_doc.get("removed", False):
+            increment_comment_count(previous_doc.get("articleId"), removed=1)
+        elif update_fields.get("removed"):
+            # comment was already removed, only the content/moderator changes
+            app.logger.info(f"Comment {comment_id} was already removed, counters unchanged.")
 
+        updated_comment_doc = dict(previous_doc, **update_fields)
+        if update_fields.get("removed"):
+            publish_comment_event("comment.moderated", updated_comment_doc)
         return jsonify(serialize_comment_for_frontend(updated_comment_doc)), 200
 
     except Exception as e:
         app.logger.error(f"Error moderating comment {comment_id}: {e}", exc_info=True)
         return jsonify({"error": f"Internal server error during moderation: {str(e)}"}), 500
 
+def bulk_moderation_target(operation):
+    # filter for one bulk operation: one comment by id, or every comment by an author on an article
+    if "id" in operation:
+        if not ObjectId.is_valid(operation["id"]):
+            return None, "Invalid comment ID format"
+        return {"_id": ObjectId(operation["id"])}, None
+    if operation.get("author") and operation.get("articleId"):
+        return {"author": operation["author"], "articleId": operation["articleId"]}, None
+    return None, "Each operation needs an 'id', or an 'author' and 'articleId'"
+
+def matches_moderation_target(comment_doc, target):
+    return all(comment_doc.get(field) == value for field, value in target.items())
+
+@app.route("/api/comments/moderate/bulk", methods=["POST"])
+@role_required(["admin", "moderator"])
+def bulk_moderate_comments(moderator_info):
+    """
+    Body: {"operations": [{"id", "action", "new_content"} or {"author", "articleId", "action", ...}],
+           "ordered": false}
+    All valid operations go to Mongo in one bulk_write, the response has one result per operation.
+    """
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Missing 'operations' list in request body"}), 400
+    if len(operations) > MAX_BULK_MODERATION_OPS:
+        return jsonify({"error": f"At most {MAX_BULK_MODERATION_OPS} operations per request"}), 400
+    ordered = bool(data.get("ordered", False)) # ordered stops at the first failed write
+
+    moderator_name = moderator_info.get('username', moderator_info.get('email', "Unknown Moderator"))
+    moderation_time = time.time()
+
+    results = []
+    writes = [] # (result, target filter, $set fields) for every valid operation, in request order
+    for operation in operations:
+        if not isinstance(operation, dict):
+            results.append({"status": "invalid", "error": "Operation must be an object"})
+            continue
+        result = {field: operation[field] for field in ("id", "author", "articleId") if field in operation}
+        results.append(result)
+        target, error_message = bulk_moderation_target(operation)
+        if target is not None:
+            update_fields, error_message = moderation_update_fields(
+                operation.get("action"), operation.get("new_content"), moderator_name, moderation_time
+            )
+        if error_message:
+            result.update(status="invalid", error=error_message)
+            continue
+        writes.append((result, target, update_fields))
+
+    if not writes:
+        return jsonify({"results": results, "matched": 0, "modified": 0}), 400
+
+    try:
+        # one read of the targeted comments' current state: which exist, which are removed for the
+        # first time (for the counters) and what their moderation events carry. A comment added by
+        # the author between this read and the write is moderated but not counted, rebuild-comment-counts
+        # repairs that.
+        current_docs = list(comments_collection.find(
+            {"$or": [target for _, target, _ in writes]}, COMMENT_FRONTEND_PROJECTION
+        ))
+
+        bulk_requests = [
+            UpdateOne(target, {"$set": update_fields}) if "_id" in target else UpdateMany(target, {"$set": update_fields})
+            for _, target, update_fields in writes
+        ]
+        failed_writes = {}
+        try:
+            bulk_result = comments_collection.bulk_write(bulk_requests, ordered=ordered)
+            matched, modified = bulk_result.matched_count, bulk_result.modified_count
+        except BulkWriteError as bulk_error:
+            failed_writes = {write_error["index"]: write_error.get("errmsg") for write_error in bulk_error.details.get("writeErrors", [])}
+            matched, modified = bulk_error.details.get("nMatched", 0), bulk_error.details.get("nModified", 0)
+        # an ordered bulk write doesn't run anything after its first failure
+        skipped_from = min(failed_writes) + 1 if ordered and failed_writes else len(writes)
+
+        newly_removed = {} # articleId -> comments removed for the first time
+        counted_ids = set()
+        moderated_docs = []
+        for position, (result, target, update_fields) in enumerate(writes):
+            if position in failed_writes:
+                result.update(status="error", error=failed_writes[position])
+                continue
+            if position >= skipped_from:
+                result["status"] = "skipped"
+                continue
+            matched_docs = [doc for doc in current_docs if matches_moderation_target(doc, target)]
+            result.update(status="ok" if matched_docs else "not_found", matched=len(matched_docs))
+            for doc in matched_docs:
+                if update_fields.get("removed"):
+                    moderated_docs.append(dict(doc, **update_fields))
+                if update_fields.get("removed") and not doc.get("removed", False) and doc["_id"] not in counted_ids:
+                    counted_ids.add(doc["_id"])
+                    newly_removed[doc.get("articleId")] = newly_removed.get(doc.get("articleId"), 0) + 1
+
+        for article_id, removed_count in newly_removed.items():
+            increment_comment_count(article_id, removed=removed_count)
+        publish_comment_events("comment.moderated", moderated_docs)
+
+        app.logger.info(f"Bulk moderation by {moderator_name}: {len(writes)} operations, {modified} comments modified.")
+        return jsonify({"results": results, "matched": matched, "modified": modified}), 200
+
+    except Exception as e:
+        app.logger.error(f"Error during bulk moderation: {e}", exc_info=True)
+        return jsonify({"error": f"Internal server error during moderation: {str(e)}"}), 500
+
+
+# status -> (filter, sort field), each one is served by a partial index in INDEX_SPECS
+MODERATION_QUEUES = {
+    "removed": ({"removed": True}, "moderationTimestamp"),
+    "moderator": ({"removed": True}, "moderationTimestamp"), # narrowed to ?moderator=<username>
+    "pending": ({"needsReview": True}, "timestamp"),
+}
+
+def serialize_queue_comment(comment_doc):
+    return dict(
+        serialize_comment_for_frontend(comment_doc),
+        moderationTimestamp=comment_doc.get("moderationTimestamp"),
+        needsReview=comment_doc.get("needsReview", False)
+    )
+
+@app.route("/api/moderation/queue", methods=["GET"])
+@role_required(["admin", "moderator"])
+def get_moderation_queue(moderator_info):
+    """
+    ?status=removed|pending|moderator (&moderator=<username>), newest first.
+    Keyset paginated on (moderationTimestamp, _id), or (timestamp, _id) for pending.
+    """
+    if comments_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    status = request.args.get("status", "pending")
+    if status not in MODERATION_QUEUES:
+        return jsonify({"error": f"Invalid status, must be one of: {', '.join(MODERATION_QUEUES)}"}), 400
+    base_query, sort_field = MODERATION_QUEUES[status]
+    query = dict(base_query)
+    if status == "moderator":
+        moderator_name = request.args.get("moderator") or moderator_info.get('username')
+        query["removedBy"] = moderator_name
+
+    limit = parse_page_size(request.args.get("limit"))
+    if limit is None:
+        return jsonify({"error": "Invalid limit, must be an integer"}), 400
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        decoded_cursor = decode_comment_cursor(cursor)
+        if decoded_cursor is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query["$or"] = keyset_before(sort_field, decoded_cursor)
+
+    try:
+        page_docs = list(
+            comments_collection.find(query)
+            .sort([(sort_field, DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+        )
+        has_more = len(page_docs) > limit
+        page_docs = page_docs[:limit]
+
+        return jsonify({
+            "comments": [serialize_queue_comment(comment) for comment in page_docs],
+            "nextCursor": encode_comment_cursor(page_docs[-1], sort_field) if has_more else None
+        }), 200
+
+    except Exception as error:
+        app.logger.error(f"Error fetching moderation queue '{status}': {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
 
 
 # Redacted text per HW should be replaced with Unicode character 'FULL BLOCK' (U+2588) -- possibly done via frontend?
@@ -471,79 +3377,261 @@ def parse_article_data(article_doc): # renamed 'article' to 'article_doc' to avo
             'author': author,
             'content': content_summary,
             'imageUrl': image_url, # none if no image found
-            'articleUrl': web_url
+            'articleUrl': web_url,
+            'pubDate': article_doc.get('pub_date') # ISO 8601 string from NYT
         }
     except Exception as e:
         # includes exc for ease of debugging
         app.logger.error(f"Error parsing article data for article ID {article_doc.get('_id', 'N/A')}: {e}", exc_info=True)
         return None
 
-@app.route("/api/search")
-def fetch_nyt_articles():
+class NYTSearchError(Exception):
+    # upstream failure with the status/message the frontend should see
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def search_cache_key(search_query, begin_date, end_date, search_filter, page):
+    # normalized so "  davis " and "davis" share an entry, empty params are treated as absent
+    normalize = lambda value: " ".join(value.split()) if value else None
+    return (normalize(search_query), normalize(begin_date), normalize(end_date), normalize(search_filter), page)
+
+def search_nyt(cache_key):
+    # one upstream NYT call for a normalized search key, returns the parsed article list
     api_key = get_key()
     if not api_key:
-        # send error to frontend to show on webpage
-        return jsonify({"error": "Server error: NYT API key not set."}), 500
-
-    processed_articles = []
+        raise NYTSearchError("Server error: NYT API key not set.", 500)
 
-    search_query = request.args.get('query')
+    search_query = cache_key[0]
+    params = nyt_search_params(cache_key, api_key)
 
-    search_begin_date = request.args.get('begin_date')
-    search_end_date = request.args.get('end_date')
-    search_filter = request.args.get('filter') # None most of the time
-    search_page = request.args.get('page', default=0, type=int)
+    nyt_req = None
+    try:
+        nyt_req = nyt_client.get(params)
+        nyt_req.raise_for_status() # check for an HTTP error (4xx or 5xx)
+        nyt_data = nyt_req.json()
+    except NYTRateLimited as limited:
+        app.logger.warning(f"NYT search for '{search_query}' rejected by client-side rate limit: {limited}")
+        raise NYTSearchError("Too many searches right now, please try again shortly.", 429, limited.retry_after)
+    except requests.exceptions.HTTPError as http_err:
+        app.logger.error(nyt_http_error_message(http_err, nyt_req))
+        raise NYTSearchError("Failed to retrieve articles from NYT.", nyt_req.status_code if nyt_req is not None else 500)
+    except Exception as e:
+        app.logger.error(f"An unexpected error occurred while fetching NYT articles: {e}", exc_info=True)
+        raise NYTSearchError("An unexpected server error occurred. Please try again later.", 500)
 
-    # debug info for reference, check vite.config.ts for what is actually being sent
-    app.logger.info(f"NYT API Search - Query:'{search_query}', BeginDate:'{search_begin_date}', EndDate:'{search_end_date}', Filter:'{search_filter}', Page:'{search_page}'")
+    return parse_nyt_search_response(nyt_data, search_query)
 
+def nyt_search_params(cache_key, api_key):
+    search_query, search_begin_date, search_end_date, search_filter, search_page = cache_key
     params = { 'api-key': api_key, 'page': search_page }
     if search_query: params['q'] = search_query
     if search_begin_date: params['begin_date'] = search_begin_date # format YYYYMMDD
     if search_end_date: params['end_date'] = search_end_date     # format YYYYMMDD
     if search_filter: params['fq'] = search_filter # add fq as a param if it actually has something
+    return params
+
+def nyt_http_error_message(http_err, nyt_req):
+    # works for both requests and httpx responses
+    error_message = f"HTTP error occurred while fetching NYT articles: {http_err}."
+    try: # try to get more specific error from NYT response if available
+        error_detail_json = nyt_req.json()
+        if "fault" in error_detail_json and "faultstring" in error_detail_json["fault"]:
+            error_message += f" Detail: {error_detail_json['fault']['faultstring']}"
+        elif "message" in error_detail_json:
+            error_message += f" Detail: {error_detail_json['message']}"
+
+    except ValueError: # if not JSON
+        error_message += f" Response: {nyt_req.text[:200]}" # log snippet of non-JSON response
+    return error_message
+
+def parse_nyt_search_response(nyt_data, search_query):
+    # NYT response body -> list of parsed articles, raises NYTSearchError on an unexpected shape
+    # structure check
+    if 'response' not in nyt_data or 'docs' not in nyt_data['response']:
+        app.logger.error(f"Unexpected NYT API response structure for query '{search_query}': {nyt_data}")
+        raise NYTSearchError("Malformed response from NYT API.", 502) # Bad Gateway or similar error
 
+    processed_articles = []
+    for indiv_article in nyt_data['response']['docs']:
+        # type check before parse
+        if isinstance(indiv_article, dict) :
+            parsed_article = parse_article_data(indiv_article)
+            if parsed_article:
+                processed_articles.append(parsed_article)
+        else :
+            app.logger.warning(f"Article item is not a dict - skipped: {indiv_article}")
+    return processed_articles
+
+def parse_pub_date(pub_date):
+    # NYT sends e.g. "2025-05-01T12:00:05+0000", stored as a real date so it can be sorted/indexed
     try:
-        nyt_req = requests.get(BASE_NYT_URL, params=params)
-        nyt_req.raise_for_status() # check for an HTTP error (4xx or 5xx)
-        nyt_data = nyt_req.json()
+        return datetime.strptime(pub_date, "%Y-%m-%dT%H:%M:%S%z")
+    except (TypeError, ValueError):
+        return None
+
+def article_upserts(processed_articles):
+    stored_at = datetime.now(timezone.utc)
+    return [
+        UpdateOne(
+            {"id": article["id"]},
+            {"$set": dict(article, publishedAt=parse_pub_date(article.get("pubDate")), storedAt=stored_at)},
+            upsert=True
+        )
+        for article in processed_articles
+    ]
 
-        # structure check
-        if 'response' not in nyt_data or 'docs' not in nyt_data['response']:
-            app.logger.error(f"Unexpected NYT API response structure for query '{search_query}': {nyt_data}")
-            return jsonify({"error": "Malformed response from NYT API."}), 502 # Bad Gateway or similar error
+def store_articles(processed_articles):
+    # upsert parsed articles into the shared store in one round trip, failures only cost the store
+    if articles_collection is None or not processed_articles:
+        return
+    try:
+        articles_collection.bulk_write(article_upserts(processed_articles), ordered=False)
+    except Exception as error:
+        app.logger.error(f"Failed to store {len(processed_articles)} articles: {error}")
+
+def load_search(cache_key, prefetched=False):
+    # upstream fetch + cache fill, identical concurrent searches share a single NYT call
+    def fetch_and_cache():
+        processed_articles = search_nyt(cache_key)
+        store_articles(processed_articles)
+        search_cache.set(cache_key, processed_articles, prefetched=prefetched)
+        return processed_articles
+    return search_flight.do(cache_key, fetch_and_cache, SEARCH_FLIGHT_TIMEOUT)
+
+def refresh_search_in_background(cache_key):
+    # stale-while-revalidate: at most one refresh per key, the stale entry keeps serving meanwhile
+    if not search_cache.begin_refresh(cache_key):
+        return
+
+    def refresh():
+        try:
+            load_search(cache_key)
+        except NYTSearchError as error:
+            app.logger.warning(f"Background refresh failed for search {cache_key}: {error.message}")
+        except SingleFlightTimeout as error:
+            app.logger.warning(f"Background refresh gave up for search {cache_key}: {error}")
+        finally:
+            search_cache.end_refresh(cache_key)
+
+    threading.Thread(target=refresh, name="search-refresh", daemon=True).start()
+
+SEARCH_TIMEOUT_ERROR = {"error": "Search is taking too long, please try again."}
+
+def search_error_headers(error):
+    return {"Retry-After": str(max(1, round(error.retry_after)))} if error.retry_after is not None else {}
+
+def search_args_key(args):
+    # /api/search query string -> normalized cache key
+    search_query = args.get('query')
+
+    search_begin_date = args.get('begin_date')
+    search_end_date = args.get('end_date')
+    search_filter = args.get('filter') # None most of the time
+    try:
+        search_page = int(args.get('page', 0))
+    except ValueError:
+        search_page = 0
 
-        articles_list = nyt_data['response']['docs'] # error check on data structure can go here
+    # debug info for reference, check vite.config.ts for what is actually being sent
+    app.logger.info(f"NYT API Search - Query:'{search_query}', BeginDate:'{search_begin_date}', EndDate:'{search_end_date}', Filter:'{search_filter}', Page:'{search_page}'")
+    return search_cache_key(search_query, search_begin_date, search_end_date, search_filter, search_page)
 
-        for indiv_article in articles_list: # Renamed 'article' to 'article_item'
-            # type check before parse
-            if isinstance(indiv_article, dict) :
-                parsed_article = parse_article_data(indiv_article)
-                if parsed_article:
-                    processed_articles.append(parsed_article)
-            else :
-                app.logger.warning(f"Article item is not a dict - skipped: {indiv_article}")
+@app.route("/api/search")
+def fetch_nyt_articles():
+    cache_key = search_args_key(request.args)
+    cached_articles, cache_state = search_cache.get(cache_key)
+    if cache_state == "stale":
+        refresh_search_in_background(cache_key)
+    if cached_articles is not None:
+        search_prefetcher.maybe_prefetch(cache_key, len(cached_articles))
+        return jsonify(cached_articles)
 
-        return jsonify(processed_articles)
+    try:
+        processed_articles = load_search(cache_key)
+    except SingleFlightTimeout:
+        app.logger.warning(f"Timed out waiting on in-flight NYT search {cache_key}")
+        return jsonify(SEARCH_TIMEOUT_ERROR), 504
+    except NYTSearchError as error:
+        # send error to frontend to show on webpage
+        error_response = jsonify({"error": error.message})
+        error_response.headers.update(search_error_headers(error))
+        return error_response, error.status_code
 
-    except requests.exceptions.HTTPError as http_err:
-        error_message = f"HTTP error occurred while fetching NYT articles: {http_err}."
-        try: # try to get more specific error from NYT response if available
-            error_detail_json = nyt_req.json()
-            if "fault" in error_detail_json and "faultstring" in error_detail_json["fault"]:
-                error_message += f" Detail: {error_detail_json['fault']['faultstring']}"
-            elif "message" in error_detail_json:
-                error_message += f" Detail: {error_detail_json['message']}"
-
-        except ValueError: # if not JSON
-            error_message += f" Response: {nyt_req.text[:200]}" # log snippet of non-JSON response
-
-        app.logger.error(error_message)
-        return jsonify({"error": "Failed to retrieve articles from NYT."}), nyt_req.status_code if nyt_req else 500
-    except Exception as e:
-        app.logger.error(f"An unexpected error occurred while fetching NYT articles: {e}", exc_info=True)
-        return jsonify({"error": "An unexpected server error occurred. Please try again later."}), 500
+    search_prefetcher.maybe_prefetch(cache_key, len(processed_articles))
+    return jsonify(processed_articles)
+
+
+# stored copies are returned in the same shape as /api/search results
+ARTICLE_PROJECTION = {"_id": 0, "publishedAt": 0, "storedAt": 0}
+
+@app.route("/api/articles/batch", methods=["POST"])
+def get_articles_batch():
+    # look up many stored articles by id in one query, e.g. the articles a comment page refers to
+    if articles_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+
+    data = request.get_json(silent=True)
+    article_ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(article_ids, list):
+        return jsonify({"error": "Missing 'ids' list in request body"}), 400
+    if len(article_ids) > MAX_ARTICLE_BATCH_SIZE:
+        return jsonify({"error": f"Too many ids, max is {MAX_ARTICLE_BATCH_SIZE}"}), 400
+
+    article_ids = [str(article_id) for article_id in article_ids]
+    try:
+        found_articles = {
+            article["id"]: article
+            for article in articles_collection.find({"id": {"$in": article_ids}}, ARTICLE_PROJECTION)
+        }
+        return jsonify({
+            "articles": found_articles,
+            "missing": [article_id for article_id in article_ids if article_id not in found_articles]
+        }), 200
+    except Exception as error:
+        app.logger.error(f"Error fetching article batch: {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
+
+@app.route("/api/articles/<path:article_id>", methods=["GET"])
+def get_article_by_id(article_id):
+    if articles_collection is None:
+        return jsonify({"error": "Database service not available"}), 503
+    try:
+        article = articles_collection.find_one({"id": article_id}, ARTICLE_PROJECTION)
+        if article is None:
+            return jsonify({"error": "Article not found"}), 404
+        return jsonify(article), 200
+    except Exception as error:
+        app.logger.error(f"Error fetching article '{article_id}': {error}", exc_info=True)
+        return jsonify({"error": f"Internal server error: {str(error)}"}), 500
 
+@app.route("/api/admin/stats")
+@role_required(["admin"])
+def get_admin_stats(moderator_info):
+    # in-process counters (per worker) for sizing caches and pools
+    return jsonify({name: provider() for name, provider in STATS_PROVIDERS.items()}), 200
+
+@app.route("/api/admin/profiles")
+@role_required(["admin"])
+def list_request_profiles(moderator_info):
+    # this worker's profiled and slow requests, newest first
+    return jsonify({"reports": request_profiler.list_reports(), "stats": request_profiler.stats()}), 200
+
+@app.route("/api/admin/profiles/<report_id>")
+@role_required(["admin"])
+def get_request_profile(moderator_info, report_id):
+    report = request_profiler.get_report(report_id)
+    if report is None:
+        # reports live in the worker that served the request, and old ones are dropped
+        return jsonify({"error": "Profile report not found"}), 404
+    return jsonify(report), 200
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # Prometheus scrape target, every worker's samples when running under gunicorn
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
 
 @app.route("/test/test-mongo")
 def test_mongo_connection():
@@ -561,24 +3649,150 @@ def test_mongo_connection():
         app.logger.error(f"MongoDB connection test failed: {e}", exc_info=True) # exc_info for debug
         return jsonify({"error": f"MongoDB connection test failed: {str(e)}"}), 500
 
+class StaticManifest:
+    """Snapshot of the frontend build directory taken once at startup.
+
+    Maps every url path to its file, size, content hash based ETag, MIME type and any
+    precompressed siblings, so serving an asset is a dict lookup rather than a round of
+    stat/abspath calls. Paths that aren't in the manifest simply don't exist, which also
+    makes the directory traversal check unnecessary.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        self.total_bytes = 0
+        self.scan()
+
+    def scan(self):
+        assets = {}
+        if os.path.isdir(self.root):
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    # compressed siblings are attached to their source file, not served on their own
+                    if filename.endswith(tuple(suffix for _, suffix in STATIC_ENCODINGS)):
+                        continue
+                    file_path = os.path.join(directory, filename)
+                    url_path = os.path.relpath(file_path, self.root).replace(os.sep, "/")
+                    assets[url_path] = self.describe(url_path, file_path)
+        self.assets = assets
+        self.total_bytes = sum(asset["size"] for asset in assets.values())
+        return self
+
+    @staticmethod
+    def describe(url_path, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as asset_file:
+            for chunk in iter(lambda: asset_file.read(65536), b""):
+                digest.update(chunk)
+        etag = digest.hexdigest()[:32]
+        mimetype, _ = mimetypes.guess_type(url_path)
+        variants = {}
+        for encoding, suffix in STATIC_ENCODINGS:
+            if os.path.isfile(file_path + suffix):
+                # the encoded body is different bytes, so it needs its own validator
+                variants[encoding] = {"path": file_path + suffix, "size": os.path.getsize(file_path + suffix), "etag": f"{etag}-{encoding}"}
+        return {
+            "path": file_path,
+            "size": os.path.getsize(file_path),
+            "etag": etag,
+            "mimetype": mimetype or "application/octet-stream",
+            "immutable": "/immutable/" in f"/{url_path}",
+            "variants": variants,
+        }
+
+    def get(self, url_path):
+        return self.assets.get(url_path)
+
+    def stats(self):
+        return {
+            "assets": len(self.assets),
+            "bytes": self.total_bytes,
+            "immutable": sum(1 for asset in self.assets.values() if asset["immutable"]),
+            "precompressed": sum(1 for asset in self.assets.values() if asset["variants"]),
+        }
+
+
+static_manifest = StaticManifest(BUILD_DIR)
+
+
+def precompress_assets(root):
+    """Writes .gz (and .br when brotli is installed) next to every compressible asset under root."""
+    written = 0
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(STATIC_COMPRESSIBLE_TYPES):
+                continue
+            file_path = os.path.join(directory, filename)
+            with open(file_path, "rb") as asset_file:
+                body = asset_file.read()
+            if len(body) < STATIC_COMPRESS_MIN_BYTES:
+                continue
+            # mtime=0 keeps the .gz byte-identical between builds
+            encoded = {".gz": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                encoded[".br"] = brotli.compress(body, quality=11)
+            for suffix, compressed in encoded.items():
+                # no point sending a "compressed" body that isn't smaller
+                if len(compressed) >= len(body):
+                    continue
+                with open(file_path + suffix, "wb") as compressed_file:
+                    compressed_file.write(compressed)
+                written += 1
+    return written
+
+@app.cli.command("precompress-assets")
+@click.argument("build_dir", default=BUILD_DIR, type=click.Path(exists=True, file_okay=False))
+def precompress_assets_command(build_dir):
+    """Write precompressed .gz/.br siblings for the frontend build (run at image build time)."""
+    written = precompress_assets(build_dir)
+    print(f"Wrote {written} precompressed files{'' if brotli is not None else ' (brotli not installed, gzip only)'}.")
+
+
+def negotiate_static_variant(asset):
+    # picks the best precompressed body the client accepts, honouring q-values
+    if not asset["variants"]:
+        return None, None
+    encoding = request.accept_encodings.best_match([encoding for encoding, _ in STATIC_ENCODINGS if encoding in asset["variants"]])
+    if encoding is None:
+        return None, None
+    return encoding, asset["variants"][encoding]
+
+
+def static_cache_control(response, asset):
+    if asset["immutable"]:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # index.html and unhashed files (fonts, images) revalidate against the ETag every time
+        response.cache_control.no_cache = True
+    if asset["variants"]:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
 # serve frontend HTML (svelte)
 @app.route("/")
 @app.route("/<path:path>")
 def serve_frontend(path=""):
-    # serves static files from the 'static_folder' (BUILD_DIR/static for svelte typically)
-    # or the index.html from BUILD_DIR for the root path or unknown paths.
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        # prevent directory traversal
-        safe_path = os.path.join(app.static_folder, path)
-        if os.path.abspath(safe_path).startswith(os.path.abspath(app.static_folder)):
-            return send_from_directory(app.static_folder, path), 200
-        else:
-            # path is outside the static folder, deny access
-            app.logger.warning(f"Attempted directory traversal: {path}")
-            return "Not Found", 403 # changed to 403: forbidden
-    else:
-        # for acceptable paths, serve the entry point (index.html)
-        return send_from_directory(BUILD_DIR, 'index.html'), 200
+    # serves files found in the build manifest, anything else gets the spa entry point (index.html)
+    asset = static_manifest.get(path) if path else None
+    if asset is None:
+        asset = static_manifest.get("index.html")
+        if asset is None:
+            return "Not Found", 404
+    encoding, variant = negotiate_static_variant(asset)
+    etag = variant["etag"] if variant else asset["etag"]
+    # revalidations are answered from the manifest without touching the file
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return static_cache_control(response, asset)
+    response = send_file(variant["path"] if variant else asset["path"], mimetype=asset["mimetype"], etag=etag, conditional=True)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return static_cache_control(response, asset)
 
 
 # actual python script execution starts here
@@ -586,10 +3800,11 @@ if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     print("Flask server starting...")
     print(f"Serving frontend from: {BUILD_DIR}")
-    print(f"Static folder set to: {app.static_folder}")
+    print(f"Static assets in manifest: {len(static_manifest.assets)}")
     print(f"Listening on http://localhost:{port}")
     # run the flask server on the host="0.0.0.0" which lets the server be seen externally
     # port is the determiner for where on the network it is accessible
     debug_mode = os.getenv('FLASK_ENV') != 'production'
+    ensure_indexes()
     # set threaded = true for multiple requests at once
     app.run(host="0.0.0.0", port=port, debug=debug_mode, threaded=True)
\ No newline at end of file
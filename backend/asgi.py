@@ -0,0 +1,448 @@
+"""
+ASGI entry point, what production serves (Dockerfile.prod, gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py asgi:application
+    uvicorn asgi:application --host 0.0.0.0 --port 8000   # locally
+
+/api/search, /api/comments, /api/me and the live comment streams run on the event loop with
+httpx (NYT) and Motor (MongoDB), so a slow upstream call or an idle SSE watcher holds a coroutine
+instead of an OS thread. Everything else is handed to the Flask app through a WSGI bridge.
+
+The request logic (cache keys, NYT params and parsing, comment documents, serialization,
+rate limit and retry policy) lives in app.py and is shared by both serving modes; this module
+only does the async I/O. The search cache, rate limiter and retry budget are the same objects
+the Flask routes use, so mixing both modes in one process still respects one NYT quota.
+"""
+import asyncio
+import contextlib
+import os
+import time
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DESCENDING
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags
+
+import app as core
+from app import NYTRateLimited, NYTSearchError, SingleFlightTimeout
+
+# set by init_async_mongo() on startup, None means the database is unavailable
+mongo_client = None
+comments_collection = None
+comment_counts_collection = None
+articles_collection = None
+
+
+def init_async_mongo():
+    global mongo_client, comments_collection, comment_counts_collection, articles_collection
+    try:
+        mongo_client = AsyncIOMotorClient(
+            os.getenv("MONGO_URI"), maxPoolSize=core.MONGO_MAX_POOL_SIZE, event_listeners=core.MONGO_EVENT_LISTENERS
+        )
+        async_db = mongo_client["CommentDB"]
+        comments_collection = async_db["comments"]
+        comment_counts_collection = async_db["comment_counts"]
+        articles_collection = async_db["articles"]
+    except Exception as error:
+        core.app.logger.error(f"Error creating async MongoDB client: {error}")
+
+
+class AsyncNYTClient:
+    # async twin of app.NYTClient, the limiter, retry budget and counters are the sync client's
+    def __init__(self):
+        policy = core.nyt_client
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(policy.timeout[1], connect=policy.timeout[0]),
+            limits=httpx.Limits(max_keepalive_connections=core.NYT_POOL_SIZE)
+        )
+
+    async def get(self, params):
+        policy = core.nyt_client
+        policy.retry_budget.record_request()
+        attempt = 0
+        while True:
+            wait = policy.limiter.reserve(policy.max_queue_wait)
+            if wait is None:
+                policy.rate_limited += 1
+                raise NYTRateLimited(policy.limiter.retry_after())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            policy.requests_sent += 1
+            started = time.perf_counter()
+            try:
+                response = await self.http.get(policy.base_url, params=params)
+            except httpx.TransportError as error:
+                core.observe_nyt_request("error", time.perf_counter() - started)
+                if not policy.can_retry(attempt):
+                    raise
+                core.app.logger.warning(f"NYT request failed ({error}), retrying (attempt {attempt + 1}).")
+                await asyncio.sleep(policy.backoff(attempt))
+                attempt += 1
+                continue
+
+            core.observe_nyt_request(response.status_code, time.perf_counter() - started)
+            delay = policy.retry_delay(response.status_code, response.headers.get("Retry-After"), attempt)
+            if delay is None:
+                return response
+            core.app.logger.warning(f"NYT responded {response.status_code}, retrying (attempt {attempt + 1}).")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+class AsyncSingleFlight:
+    # asyncio version of app.SingleFlight, one event loop per process so no locking is needed
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, coroutine_fn, timeout):
+        future = self._calls.get(key)
+        if future is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise SingleFlightTimeout(f"Timed out after {timeout}s waiting for in-flight call {key}")
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coroutine_fn()
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            # a cancelled leader (client went away) must still release its followers
+            future.set_exception(error if isinstance(error, Exception) else
+                                 NYTSearchError("Search was cancelled, please try again.", 503))
+            future.exception() # mark retrieved, followers are optional
+            raise
+        finally:
+            del self._calls[key]
+
+
+nyt_http = None
+search_flight = AsyncSingleFlight()
+background_tasks = set() # strong references to fire-and-forget refreshes
+
+
+async def search_nyt_async(cache_key):
+    api_key = core.get_key()
+    if not api_key:
+        raise NYTSearchError("Server error: NYT API key not set.", 500)
+
+    search_query = cache_key[0]
+    nyt_req = None
+    try:
+        nyt_req = await nyt_http.get(core.nyt_search_params(cache_key, api_key))
+        nyt_req.raise_for_status()
+        nyt_data = nyt_req.json()
+    except NYTRateLimited as limited:
+        core.app.logger.warning(f"NYT search for '{search_query}' rejected by client-side rate limit: {limited}")
+        raise NYTSearchError("Too many searches right now, please try again shortly.", 429, limited.retry_after)
+    except httpx.HTTPStatusError as http_err:
+        core.app.logger.error(core.nyt_http_error_message(http_err, nyt_req))
+        raise NYTSearchError("Failed to retrieve articles from NYT.", nyt_req.status_code)
+    except Exception as e:
+        core.app.logger.error(f"An unexpected error occurred while fetching NYT articles: {e}", exc_info=True)
+        raise NYTSearchError("An unexpected server error occurred. Please try again later.", 500)
+
+    return core.parse_nyt_search_response(nyt_data, search_query)
+
+
+async def store_articles_async(processed_articles):
+    if articles_collection is None or not processed_articles:
+        return
+    try:
+        await articles_collection.bulk_write(core.article_upserts(processed_articles), ordered=False)
+    except Exception as error:
+        core.app.logger.error(f"Failed to store {len(processed_articles)} articles: {error}")
+
+
+async def load_search_async(cache_key):
+    async def fetch_and_cache():
+        processed_articles = await search_nyt_async(cache_key)
+        await store_articles_async(processed_articles)
+        core.search_cache.set(cache_key, processed_articles)
+        return processed_articles
+    return await search_flight.do(cache_key, fetch_and_cache, core.SEARCH_FLIGHT_TIMEOUT)
+
+
+def refresh_search_in_background(cache_key):
+    if not core.search_cache.begin_refresh(cache_key):
+        return
+
+    async def refresh():
+        try:
+            await load_search_async(cache_key)
+        except (NYTSearchError, SingleFlightTimeout) as error:
+            core.app.logger.warning(f"Background refresh failed for search {cache_key}: {error}")
+        finally:
+            core.search_cache.end_refresh(cache_key)
+
+    task = asyncio.create_task(refresh())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+class FastJSONResponse(JSONResponse):
+    # orjson for the large list responses when it's installed, like app.FastJSONProvider
+    def render(self, content):
+        if core.orjson is None:
+            return super().render(content)
+        try:
+            return core.orjson.dumps(content)
+        except TypeError:
+            return super().render(content)
+
+
+async def session_user(request):
+    # a session store cache miss is a pymongo find_one, keep it off the event loop
+    cookie_value = request.cookies.get(core.app.config["SESSION_COOKIE_NAME"])
+    session_data = await asyncio.to_thread(core.load_session_cookie, cookie_value)
+    return session_data.get("user")
+
+
+async def compress_async_stream(encoding, chunks):
+    body = core.StreamedCompression(encoding)
+    try:
+        async for chunk in chunks:
+            compressed = body.feed(chunk) if chunk else b""
+            if compressed:
+                yield compressed
+        yield body.finish()
+    finally:
+        body.record()
+
+
+def compressed(endpoint):
+    # same policy as app.compress_response for the routes served here; routes that shouldn't be
+    # compressed (the SSE streams) opt out with native_route(..., compress=False)
+    async def compressing_endpoint(request):
+        response = await endpoint(request)
+        if response.status_code < 200 or response.status_code in (204, 304) or "content-encoding" in response.headers:
+            return response
+        response.headers.add_vary_header("Accept-Encoding")
+        encoding = core.choose_compression(request.headers.get("accept-encoding"))
+        if encoding is None:
+            return response
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = compress_async_stream(encoding, response.body_iterator)
+            del response.headers["content-length"]
+        elif len(response.body) < core.COMPRESS_MIN_BYTES:
+            core.compression_metrics.skipped(small=True)
+            return response
+        else:
+            # compressing a large page is CPU work, keep it off the event loop
+            body = await asyncio.to_thread(core.compress_body, encoding, response.body)
+            if body is None:
+                return response
+            response.body = body
+            response.headers["content-length"] = str(len(body))
+        response.headers["content-encoding"] = encoding
+        core.weaken_etag(response.headers)
+        return response
+    return compressing_endpoint
+
+
+def measured(route, endpoint):
+    # request metrics for the routes served here, Flask's own hooks cover the mounted app
+    async def measured_endpoint(request):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            core.observe_request(request.method, route, status, time.perf_counter() - started)
+    return measured_endpoint
+
+
+def native_route(path, endpoint, methods, compress=True):
+    return Route(path, measured(path, compressed(endpoint) if compress else endpoint), methods=methods)
+
+
+# ---------- ROUTES ----------
+
+async def fetch_nyt_articles(request):
+    cache_key = core.search_args_key(request.query_params)
+    cached_articles, cache_state = core.search_cache.get(cache_key)
+    if cache_state == "stale":
+        refresh_search_in_background(cache_key)
+    if cached_articles is not None:
+        return FastJSONResponse(cached_articles)
+
+    try:
+        processed_articles = await load_search_async(cache_key)
+    except SingleFlightTimeout:
+        core.app.logger.warning(f"Timed out waiting on in-flight NYT search {cache_key}")
+        return JSONResponse(core.SEARCH_TIMEOUT_ERROR, status_code=504)
+    except NYTSearchError as error:
+        return JSONResponse({"error": error.message}, status_code=error.status_code,
+                            headers=core.search_error_headers(error))
+    return FastJSONResponse(processed_articles)
+
+
+async def get_all_comments(request):
+    if comments_collection is None:
+        return JSONResponse({"error": "Database service not available"}, status_code=503)
+
+    raw_since = request.query_params.get("since")
+    since, error_message = core.parse_since(raw_since)
+    if error_message:
+        return JSONResponse({"error": error_message}, status_code=400)
+
+    try:
+        latest_docs = await (
+            comments_collection.find({}, {"lastModified": 1}).sort("lastModified", DESCENDING).limit(1).to_list(1)
+        )
+        comments_version = core.comments_version_tag(latest_docs, await comments_collection.estimated_document_count())
+        etag_header = {"ETag": f'"{comments_version}"'}
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(comments_version):
+            # same validator the 200 would carry, weak when it would have been compressed
+            not_modified = Response(status_code=304, headers=dict(etag_header, Vary="Accept-Encoding"))
+            if core.choose_compression(request.headers.get("accept-encoding")) is not None:
+                core.weaken_etag(not_modified.headers)
+            return not_modified
+
+        if since is not None:
+            changed_comments = await (
+                comments_collection.find(core.delta_query(since), core.COMMENT_FRONTEND_PROJECTION)
+                .sort(core.DELTA_SORT)
+                .limit(core.MAX_COMMENT_DELTA_SIZE + 1)
+                .to_list(core.MAX_COMMENT_DELTA_SIZE + 1)
+            )
+            payload = core.delta_payload(changed_comments, raw_since)
+        else:
+            all_db_comments = await (
+                comments_collection.find({}, core.COMMENT_FRONTEND_PROJECTION).sort("timestamp", DESCENDING).to_list(None)
+            )
+            payload = core.serialize_comment_list(all_db_comments)
+        return FastJSONResponse(payload, headers=etag_header)
+
+    except Exception as error:
+        core.app.logger.error(f"Error fetching comments: {error}", exc_info=True)
+        return JSONResponse({"error": f"Internal server error: {str(error)}"}, status_code=500)
+
+
+async def increment_comment_count_async(article_id, total=0, removed=0):
+    if comment_counts_collection is None:
+        return
+    try:
+        await comment_counts_collection.update_one(
+            {"_id": article_id}, {"$inc": {"total": total, "removed": removed}}, upsert=True
+        )
+    except Exception as error:
+        core.app.logger.error(f"Failed to update comment count for article '{article_id}': {error}")
+
+
+async def add_comment(request):
+    if comments_collection is None:
+        return JSONResponse({"error": "Database service not available"}, status_code=503)
+    try:
+        data = await request.json()
+        if not data or 'content' not in data or 'articleId' not in data:
+            return JSONResponse({"error": "Missing articleId or content in request"}, status_code=400)
+
+        comment_doc = core.new_comment_doc(data, await session_user(request))
+        parent_id = core.parent_object_id(comment_doc)
+        parent_doc = None
+        if parent_id is not None:
+            parent_doc = await comments_collection.find_one({"_id": parent_id}, {"path": 1, "depth": 1})
+        core.attach_parent(comment_doc, parent_doc)
+
+        result = await comments_collection.insert_one(comment_doc)
+        await increment_comment_count_async(comment_doc["articleId"], total=1)
+        # the Mongo fan-out publishes with pymongo, keep it off the event loop
+        await asyncio.to_thread(core.publish_comment_event, "comment.created", dict(comment_doc, _id=result.inserted_id))
+        return JSONResponse(core.created_comment_payload(comment_doc, result.inserted_id), status_code=201)
+
+    except Exception as error:
+        core.app.logger.error(f"Error adding comment: {error}", exc_info=True)
+        return JSONResponse({"error": f"Internal server error: {str(error)}"}, status_code=500)
+
+
+async def current_user_api(request):
+    return JSONResponse(core.user_status_payload(await session_user(request)))
+
+
+class AsyncCommentSubscription(core.CommentSubscription):
+    # the broker delivers from whichever thread published, hand events over to the event loop
+    def __init__(self, article_id, loop):
+        super().__init__(article_id)
+        self.loop = loop
+        self.async_events = asyncio.Queue(maxsize=core.SSE_QUEUE_SIZE)
+
+    def deliver(self, event):
+        if self.overflowed:
+            return False
+        self.loop.call_soon_threadsafe(self._put, event)
+        return True
+
+    def _put(self, event):
+        try:
+            self.async_events.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+async def stream_article_comments(request):
+    # same events, heartbeat and resume as the Flask endpoint, but an idle watcher costs no thread
+    article_id = request.path_params["article_id"]
+    loop = asyncio.get_running_loop()
+    core.comment_fanout.ensure_started()
+    subscription = core.comment_events.subscribe(AsyncCommentSubscription(article_id, loop))
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("lastEventId")
+
+    async def generate():
+        try:
+            # resume may read the Mongo event log
+            chunks, replayed_ids = await asyncio.to_thread(core.stream_start, article_id, last_event_id)
+            for chunk in chunks:
+                yield chunk
+            deadline = loop.time() + core.SSE_MAX_STREAM_SECONDS
+            while loop.time() < deadline:
+                try:
+                    event = await asyncio.wait_for(subscription.async_events.get(), core.SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = None
+                if subscription.overflowed:
+                    yield core.SSE_RESET
+                    return
+                if event is None:
+                    yield core.SSE_HEARTBEAT
+                elif not core.already_sent(event, replayed_ids):
+                    yield core.format_sse(event)
+        finally:
+            core.comment_events.unsubscribe(subscription)
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=core.SSE_HEADERS)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    global nyt_http
+    init_async_mongo()
+    nyt_http = AsyncNYTClient()
+    yield
+    await nyt_http.aclose()
+    if mongo_client is not None:
+        mongo_client.close()
+
+
+application = Starlette(
+    routes=[
+        native_route("/api/search", fetch_nyt_articles, ["GET"]),
+        native_route("/api/comments", get_all_comments, ["GET"]),
+        native_route("/api/comments", add_comment, ["POST"]),
+        native_route("/api/me", current_user_api, ["GET"]),
+        native_route("/api/articles/{article_id:path}/comments/stream", stream_article_comments, ["GET"], compress=False),
+        # every other route (auth, moderation, frontend files) stays on Flask
+        Mount("/", app=WSGIMiddleware(core.app)),
+    ],
+    lifespan=lifespan,
+)
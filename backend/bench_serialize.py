@@ -0,0 +1,122 @@
+"""
+Micro-benchmark for the comment list read path (GET /api/comments), no MongoDB needed:
+
+    python bench_serialize.py                       # 10k, 100k and 1M comments
+    python bench_serialize.py --sizes 10000 --no-memory
+
+"before" decodes full comment documents, serializes them with the original two-pass
+serializer and encodes with the stdlib encoder the way jsonify used to. "after" decodes only
+the COMMENT_FRONTEND_PROJECTION fields (what Mongo returns for the projected find), serializes
+in one pass and encodes through app.json (orjson when it's installed). Both start from raw BSON
+batches, so pymongo's decoding is part of the measurement like it is in the real request.
+
+Reports comments per second and bytes allocated per comment (tracemalloc peak, measured in a
+separate run since tracing slows everything down). 1M comments needs a few GB of memory.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import bson
+from bson import ObjectId
+
+import app
+
+BATCH_SIZE = 1000 # documents per BSON batch, roughly one cursor batch
+
+
+def make_comment(i):
+    # what add_comment stores (new_comment_doc + attach_parent), moderated the way the moderation
+    # endpoints do it: every 3rd comment is a root, every 20th removed, every 10th otherwise approved
+    data = {"articleId": f"nyt://article/{i % 500}", "content": "A reasonably typical comment about the article, a sentence or two long. " * 2}
+    parent_doc = None
+    if i % 3:
+        parent_doc = {"_id": ObjectId(), "path": "", "depth": 0}
+        data["parentId"] = str(parent_doc["_id"])
+    comment = app.new_comment_doc(data, {"username": f"reader{i % 5000}"})
+    app.attach_parent(comment, parent_doc)
+    comment["_id"] = ObjectId()
+    if i % 20 == 0:
+        comment.update(app.moderation_update_fields("delete_full", None, "moderator", comment["timestamp"] + 500)[0])
+    elif i % 10 == 0:
+        comment.update(app.moderation_update_fields("approve", None, "moderator", comment["timestamp"] + 500)[0])
+    return comment
+
+
+def make_batches(count, projection=None):
+    batches = []
+    for start in range(0, count, BATCH_SIZE):
+        docs = [make_comment(i) for i in range(start, min(start + BATCH_SIZE, count))]
+        if projection:
+            docs = [{key: value for key, value in doc.items() if key == "_id" or key in projection} for doc in docs]
+        batches.append(b"".join(bson.encode(doc) for doc in docs))
+    return batches
+
+
+def legacy_serialize_comment(comment_doc):
+    # serialize_comment_for_frontend before the fast path
+    if not comment_doc:
+        return None
+    return {
+        "id": str(comment_doc["_id"]),
+        "articleId": comment_doc.get("articleId", ""),
+        "author": comment_doc.get("author", "Anonymous"),
+        "content": comment_doc.get("content", ""),
+        "removed": comment_doc.get("removed", False),
+        "removedBy": comment_doc.get("removedBy", ""),
+        "timestamp": comment_doc.get("timestamp"),
+        "lastModified": comment_doc.get("lastModified", comment_doc.get("timestamp")),
+        "parentId": str(comment_doc["parentId"]) if comment_doc.get("parentId") else None
+    }
+
+
+def before(batches):
+    docs = [doc for batch in batches for doc in bson.decode_all(batch)]
+    serialized = [legacy_serialize_comment(comment) for comment in docs]
+    serialized = [c for c in serialized if c and c.get("articleId")]
+    # what jsonify did with the default provider
+    return json.dumps(serialized, sort_keys=True, separators=(",", ":")).encode()
+
+
+def after(batches):
+    docs = [doc for batch in batches for doc in bson.decode_all(batch)]
+    return app.app.json.response(app.serialize_comment_list(docs)).get_data()
+
+
+def measure(pipeline, batches, count, trace_memory):
+    started = time.perf_counter()
+    body = pipeline(batches)
+    elapsed = time.perf_counter() - started
+    result = {"perSecond": count / elapsed, "bytes": len(body), "allocatedPerComment": None}
+    del body
+    if trace_memory:
+        tracemalloc.start()
+        pipeline(batches)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["allocatedPerComment"] = peak / count
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) tracemalloc runs")
+    args = parser.parse_args()
+
+    print(f"JSON encoder: {'orjson' if app.orjson else 'stdlib json'}")
+    print(f"{'comments':>10} {'path':>7} {'comments/s':>12} {'alloc B/comment':>16} {'response bytes':>15}")
+    with app.app.app_context():
+        for count in args.sizes:
+            full_batches = make_batches(count)
+            projected_batches = make_batches(count, app.COMMENT_FRONTEND_PROJECTION)
+            for name, pipeline, batches in (("before", before, full_batches), ("after", after, projected_batches)):
+                result = measure(pipeline, batches, count, not args.no_memory)
+                allocated = f"{result['allocatedPerComment']:.0f}" if result["allocatedPerComment"] else "-"
+                print(f"{count:>10} {name:>7} {result['perSecond']:>12,.0f} {allocated:>16} {result['bytes']:>15,}")
+            del full_batches, projected_batches
+
+
+if __name__ == "__main__":
+    main()
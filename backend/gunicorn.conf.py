@@ -0,0 +1,73 @@
+# Production server config, used by Dockerfile.prod:
+#   gunicorn -c gunicorn.conf.py asgi:application
+# The ASGI app (asgi.py) serves search, comments and the live comment streams on Uvicorn workers'
+# event loops, so idle SSE watchers don't hold threads; every other route goes through its WSGI
+# bridge to Flask. `GUNICORN_WORKER_CLASS=gthread` with `app:app` serves Flask alone, where
+# SSE_MAX_FLASK_STREAMS caps the streams per worker.
+# Every setting can be overridden from the environment (see .env.prod).
+#
+# Reloading: `kill -HUP <master pid>` replaces the workers gracefully. With preload_app on the
+# code is loaded once in the master, so picking up new code needs `kill -USR2` (new master)
+# followed by `kill -WINCH`/`-QUIT` on the old one, or a container restart.
+import multiprocessing
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# one process per core (plus one) gets past the GIL, the event loop (and gthread's threads) cover
+# time spent waiting on NYT/Mongo
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+threads = int(os.getenv("GUNICORN_THREADS", 4)) # gthread only
+
+# recycle workers after a number of requests, jittered so they don't all restart at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# import the app once in the master so workers share its memory and the session secret
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+# prometheus_client multiprocess mode: each worker writes its samples to files in this directory
+# and /metrics merges them. Has to be set before the app (and prometheus_client) is imported.
+prometheus_multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-metrics")
+
+# every worker has its own NYT client, search cache and single flight; the NYT rate limit is kept in
+# one file in the same directory so NYT_RATE_PER_MINUTE holds for all workers together
+os.environ.setdefault("NYT_RATE_STATE_FILE", os.path.join(prometheus_multiproc_dir, "nyt_rate_limit.bin"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    # samples left over from a previous master would be merged into the new one's
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # indexes are created once by the master instead of by every worker
+    import app as app_module
+    app_module.ensure_indexes()
+    # drop the master's connections before forking, workers open their own
+    if app_module.client is not None:
+        app_module.client.close()
+
+
+def post_fork(server, worker):
+    # sockets and monitor threads don't survive fork, give every worker its own client and pool
+    import app as app_module
+    app_module.init_mongo()
+    server.log.info(f"Worker {worker.pid} initialized its MongoDB client.")
+
+
+def child_exit(server, worker):
+    # drops the dead worker's live gauge files, its counters and histograms stay in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -10,6 +10,26 @@ from app import app
 import pytest
 from flask import session
 
+@pytest.fixture(autouse=True)
+def no_mongo(monkeypatch):
+    # tests plug in their own fake collections, anything they don't replace is disabled
+    import app as app_module
+    monkeypatch.setattr(app_module, "comments_collection", None)
+    monkeypatch.setattr(app_module, "comment_counts_collection", None)
+    monkeypatch.setattr(app_module, "articles_collection", None)
+    monkeypatch.setattr(app_module, "sessions_collection", None)
+    # live comment events stay in-process during tests
+    monkeypatch.setattr(app_module, "comment_fanout", app_module.LocalFanout())
+    monkeypatch.setattr(app_module, "comment_events", app_module.CommentEventBroker())
+    # sessions stay in-process during tests
+    monkeypatch.setattr(app_module.app.session_interface, "store", app_module.MemorySessionStore(100, 60))
+    # fresh search cache per test so cached results don't leak between tests
+    monkeypatch.setattr(app_module, "search_cache", app_module.SearchCache(8, 60, 60))
+    monkeypatch.setattr(app_module, "nyt_client", app_module.NYTClient(app_module.BASE_NYT_URL, backoff_base=0))
+    monkeypatch.setattr(app_module, "search_flight", app_module.SingleFlight())
+    # prefetching is switched on by the tests that exercise it
+    monkeypatch.setattr(app_module, "search_prefetcher", app_module.SearchPrefetcher(False, 1, 1, 0))
+
 @pytest.fixture
 def client():
     # Test: finding client (diff-level: easy)
@@ -160,3 +180,1407 @@ def test_logout(client):
     assert response.status_code in (302, 303)
     # the logout should redirect to '/' to the home page
     assert response.headers['Location'].endswith('/')
+
+# ----- PAGINATED COMMENT TESTS -----
+
+class FakeCursor:
+    # stands in for a pymongo cursor, records the chained calls
+    def __init__(self, docs):
+        self.docs = docs
+        self.sort_spec = None
+        self.limit_value = None
+    def sort(self, spec, direction=None):
+        self.sort_spec = spec
+        return self
+    def limit(self, value):
+        self.limit_value = value
+        return self
+    def __iter__(self):
+        docs = self.docs[:self.limit_value] if self.limit_value else self.docs
+        return iter(docs)
+
+def test_article_comments_page(client):
+    from bson import ObjectId
+    docs = [
+        {"_id": ObjectId(), "articleId": "nyt1", "author": "a", "content": str(i), "timestamp": 100.0 - i}
+        for i in range(3)
+    ]
+
+    class TestCollection:
+        def find(self, query, projection=None):
+            self.query = query
+            self.cursor = FakeCursor(docs)
+            return self.cursor
+
+    import app
+    fake = TestCollection()
+    app.comments_collection = fake
+
+    response = client.get('/api/articles/nyt1/comments?limit=2')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [c["content"] for c in body["comments"]] == ["0", "1"]
+    assert body["nextCursor"] == f"{99.0!r}_{docs[1]['_id']}"
+    assert fake.query == {"articleId": "nyt1"}
+    assert fake.cursor.limit_value == 3
+
+    response = client.get(f'/api/articles/nyt1/comments?cursor={body["nextCursor"]}')
+    assert response.status_code == 200
+    assert fake.query["$or"][0] == {"timestamp": {"$lt": 99.0}}
+
+def test_article_comments_bad_cursor(client):
+    import app
+    app.comments_collection = object()
+    response = client.get('/api/articles/nyt1/comments?cursor=garbage')
+    assert response.status_code == 400
+
+# ----- DELTA SYNC TESTS -----
+
+class DeltaTestCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+    def find(self, query=None, projection=None):
+        self.queries.append(query)
+        if query:
+            # delta keyset, in (lastModified, _id) order
+            docs = sorted(self.docs, key=lambda d: (d["lastModified"], d["_id"]))
+            return FakeCursor([d for d in docs if matches_delta(d, query)])
+        if projection:
+            return FakeCursor(sorted(self.docs, key=lambda d: -d["lastModified"]))
+        return FakeCursor(self.docs)
+    def estimated_document_count(self):
+        return len(self.docs)
+
+def matches_delta(doc, query):
+    if "$or" in query:
+        return any(matches_delta(doc, clause) for clause in query["$or"])
+    return all(
+        doc[key] > condition["$gt"] if isinstance(condition, dict) else doc[key] == condition
+        for key, condition in query.items()
+    )
+
+def test_comments_delta_since(client):
+    from bson import ObjectId
+    import app
+    app.comments_collection = DeltaTestCollection([
+        {"_id": ObjectId(), "articleId": "nyt1", "content": "old", "timestamp": 10.0, "lastModified": 10.0},
+        {"_id": ObjectId(), "articleId": "nyt1", "content": "moderated", "timestamp": 11.0, "lastModified": 30.0},
+    ])
+
+    response = client.get('/api/comments?since=20')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [c["content"] for c in body["comments"]] == ["moderated"]
+    assert body["highWaterMark"] == f"30.0_{body['comments'][0]['id']}"
+    assert body["hasMore"] is False
+
+    response = client.get('/api/comments?since=yesterday')
+    assert response.status_code == 400
+
+def test_comments_delta_pages_through_equal_last_modified(client, monkeypatch):
+    from bson import ObjectId
+    import app
+    monkeypatch.setattr(app, "MAX_COMMENT_DELTA_SIZE", 2)
+    # one bulk moderation: every comment got the same lastModified
+    app.comments_collection = DeltaTestCollection([
+        {"_id": ObjectId(), "articleId": "nyt1", "content": str(i), "timestamp": 10.0, "lastModified": 30.0}
+        for i in range(3)
+    ])
+    first = client.get('/api/comments?since=20').get_json()
+    assert len(first["comments"]) == 2 and first["hasMore"] is True
+    second = client.get(f'/api/comments?since={first["highWaterMark"]}').get_json()
+    assert [c["content"] for c in second["comments"]] == ["2"]
+    assert second["hasMore"] is False
+
+def test_comments_etag_not_modified(client):
+    from bson import ObjectId
+    import app
+    fake = DeltaTestCollection([
+        {"_id": ObjectId(), "articleId": "nyt1", "content": "hi", "timestamp": 10.0, "lastModified": 10.0},
+    ])
+    app.comments_collection = fake
+
+    response = client.get('/api/comments')
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    fake.queries.clear()
+    response = client.get('/api/comments', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    # only the version lookup ran, no comment documents were fetched
+    assert fake.queries == [{}]
+
+# ----- COMMENT COUNT TESTS -----
+
+class CountsTestCollection:
+    def __init__(self, counters=None):
+        self.counters = counters or {}
+        self.updates = []
+    def update_one(self, query, update, upsert=False):
+        self.updates.append((query, update, upsert))
+    def find(self, query):
+        return [{"_id": i, **self.counters[i]} for i in query["_id"]["$in"] if i in self.counters]
+
+def test_comment_counts_batch(client):
+    import app
+    app.comment_counts_collection = CountsTestCollection({"nyt1": {"total": 4, "removed": 1}})
+
+    response = client.post('/api/comments/counts', json={"articleIds": ["nyt1", "nyt2"]})
+    assert response.status_code == 200
+    assert response.get_json()["counts"] == {
+        "nyt1": {"total": 4, "removed": 1},
+        "nyt2": {"total": 0, "removed": 0},
+    }
+
+    response = client.post('/api/comments/counts', json={"articleIds": "nyt1"})
+    assert response.status_code == 400
+
+def test_add_comment_increments_count(client):
+    class TestCollection:
+        def insert_one(self, doc):
+            class Result:
+                inserted_id = "fakeID"
+            return Result()
+
+    import app
+    counters = CountsTestCollection()
+    app.comments_collection = TestCollection()
+    app.comment_counts_collection = counters
+
+    response = client.post('/api/comments', json={"articleId": "nyt1", "content": "hi"})
+    assert response.status_code == 201
+    assert counters.updates == [({"_id": "nyt1"}, {"$inc": {"total": 1, "removed": 0}}, True)]
+
+def test_moderate_comment_counts_first_removal_only(client):
+    from bson import ObjectId
+    comment_id = ObjectId()
+
+    class TestCollection:
+        def __init__(self):
+            self.removed = False
+        def find_one_and_update(self, query, update, projection=None, return_document=None):
+            previous = {"_id": comment_id, "articleId": "nyt1", "removed": self.removed}
+            self.removed = True
+            return previous
+        def find_one(self, query):
+            return {"_id": comment_id, "articleId": "nyt1", "removed": True, "content": "gone"}
+
+    import app
+    counters = CountsTestCollection()
+    app.comments_collection = TestCollection()
+    app.comment_counts_collection = counters
+
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+
+    for _ in range(2):
+        response = client.put(f'/api/comments/{comment_id}/moderate', json={"action": "delete_full"})
+        assert response.status_code == 200
+    assert counters.updates == [({"_id": "nyt1"}, {"$inc": {"total": 0, "removed": 1}}, True)]
+
+def test_moderate_comment_single_round_trip(client):
+    from bson import ObjectId
+    from pymongo import ReturnDocument
+    comment_id = ObjectId()
+
+    class TestCollection:
+        def find_one_and_update(self, query, update, projection=None, return_document=None):
+            assert return_document == ReturnDocument.BEFORE
+            return {"_id": comment_id, "articleId": "nyt1", "author": "a", "content": "spam", "removed": False}
+
+    import app
+    app.comments_collection = TestCollection() # no find_one: a second round trip would fail
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+
+    response = client.put(f'/api/comments/{comment_id}/moderate', json={"action": "redact_partial", "new_content": "\u2588\u2588"})
+    assert response.status_code == 200
+    assert response.get_json()["content"] == "\u2588\u2588"
+    assert response.get_json()["removedBy"] == "moderator"
+    assert response.get_json()["author"] == "a"
+
+def test_bulk_moderation(client, monkeypatch):
+    from bson import ObjectId
+    from pymongo import UpdateMany, UpdateOne
+    first_id, second_id, missing_id = ObjectId(), ObjectId(), ObjectId()
+    docs = [
+        {"_id": first_id, "articleId": "nyt1", "author": "a", "removed": False, "timestamp": 1.0, "parentId": None},
+        {"_id": second_id, "articleId": "nyt2", "author": "spammer", "removed": True, "timestamp": 2.0, "parentId": None},
+        {"_id": ObjectId(), "articleId": "nyt2", "author": "spammer", "removed": False, "timestamp": 3.0,
+         "parentId": str(second_id)},
+    ]
+
+    class TestCollection:
+        def find(self, query, projection):
+            self.query = query
+            self.projection = projection
+            return [dict(d) for d in docs]
+        def bulk_write(self, requests, ordered=True):
+            self.requests = requests
+            self.ordered = ordered
+            class Result:
+                matched_count = 3
+                modified_count = 3
+            return Result()
+
+    class RecordingFanout:
+        def __init__(self):
+            self.batches = []
+        def publish(self, events):
+            self.batches.append(events)
+
+    import app
+    fake = TestCollection()
+    counters = CountsTestCollection()
+    fanout = RecordingFanout()
+    app.comments_collection = fake
+    app.comment_counts_collection = counters
+    monkeypatch.setattr(app, "comment_fanout", fanout)
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+
+    response = client.post('/api/comments/moderate/bulk', json={"operations": [
+        {"id": str(first_id), "action": "delete_full"},
+        {"author": "spammer", "articleId": "nyt2", "action": "delete_full"},
+        {"id": str(missing_id), "action": "delete_full"},
+        {"id": str(first_id), "action": "shout"},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [r["status"] for r in body["results"]] == ["ok", "ok", "not_found", "invalid"]
+    assert body["results"][1]["matched"] == 2
+    # one bulk write for the three valid operations, invalid ones are never sent
+    assert [type(r) for r in fake.requests] == [UpdateOne, UpdateMany, UpdateOne]
+    assert fake.ordered is False
+    # the already removed comment isn't counted again
+    assert sorted(u[0]["_id"] for u in counters.updates) == ["nyt1", "nyt2"]
+    assert all(u[1]["$inc"]["removed"] == 1 for u in counters.updates)
+    # moderation events are published as one batch and carry the full frontend comment
+    assert fake.projection == app.COMMENT_FRONTEND_PROJECTION
+    [events] = fanout.batches
+    assert [event["comment"]["timestamp"] for event in events] == [1.0, 2.0, 3.0]
+    assert events[2]["comment"]["parentId"] == str(second_id)
+    assert all(event["comment"]["removed"] for event in events)
+
+def test_moderation_queue_keyset_page(client):
+    from bson import ObjectId
+    docs = [{"_id": ObjectId(), "articleId": "nyt1", "content": str(i), "removed": True,
+             "removedBy": "moderator", "moderationTimestamp": 100.0 - i} for i in range(3)]
+
+    class TestCollection:
+        def find(self, query):
+            self.query = query
+            self.cursor = FakeCursor(docs)
+            return self.cursor
+
+    import app
+    fake = TestCollection()
+    app.comments_collection = fake
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+
+    response = client.get('/api/moderation/queue?status=moderator&limit=2')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [c["content"] for c in body["comments"]] == ["0", "1"]
+    assert body["comments"][0]["moderationTimestamp"] == 100.0
+    assert body["nextCursor"] == f"99.0_{docs[1]['_id']}"
+    # the partial index filter is part of the query so Mongo can use it
+    assert fake.query == {"removed": True, "removedBy": "moderator"}
+    assert fake.cursor.sort_spec == [("moderationTimestamp", -1), ("_id", -1)]
+
+    response = client.get(f'/api/moderation/queue?status=pending&cursor={body["nextCursor"]}')
+    assert response.status_code == 200
+    assert fake.query["needsReview"] is True
+    assert fake.query["$or"][0] == {"timestamp": {"$lt": 99.0}}
+
+    assert client.get('/api/moderation/queue?status=everything').status_code == 400
+
+def test_approve_leaves_removed_count(client):
+    from bson import ObjectId
+    comment_id = ObjectId()
+
+    class TestCollection:
+        def find_one_and_update(self, query, update, projection=None, return_document=None):
+            self.update = update
+            return {"_id": comment_id, "articleId": "nyt1", "content": "fine", "removed": False, "needsReview": True}
+
+    import app
+    fake = TestCollection()
+    counters = CountsTestCollection()
+    app.comments_collection = fake
+    app.comment_counts_collection = counters
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+
+    response = client.put(f'/api/comments/{comment_id}/moderate', json={"action": "approve"})
+    assert response.status_code == 200
+    assert response.get_json()["removed"] is False
+    assert fake.update["$set"]["needsReview"] is False
+    assert counters.updates == []
+
+# ----- REPLY THREAD TESTS -----
+
+def test_reply_gets_materialized_path(client):
+    from bson import ObjectId
+    parent_id = ObjectId()
+
+    class TestCollection:
+        def find_one(self, query, projection=None):
+            assert query == {"_id": parent_id}
+            return {"_id": parent_id, "path": "root1/", "depth": 1}
+        def insert_one(self, doc):
+            self.inserted = doc
+            class Result:
+                inserted_id = ObjectId()
+            return Result()
+
+    import app
+    fake = TestCollection()
+    app.comments_collection = fake
+
+    response = client.post('/api/comments', json={"articleId": "nyt1", "content": "reply", "parentId": str(parent_id)})
+    assert response.status_code == 201
+    assert fake.inserted["path"] == f"root1/{parent_id}/"
+    assert fake.inserted["depth"] == 2
+
+def matches_thread(doc, query):
+    # the top-level keyset page and the subtree range query of thread_response
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches_thread(doc, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            bounds = {"$gte": doc[key].__ge__, "$gt": doc[key].__gt__, "$lte": doc[key].__le__,
+                      "$lt": doc[key].__lt__}
+            if not all(bounds[op](value) for op, value in condition.items()):
+                return False
+        elif doc[key] != condition:
+            return False
+    return True
+
+class ThreadTestCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+    def find(self, query, projection=None):
+        self.queries.append((query, projection))
+        matched = [d for d in self.docs if matches_thread(d, query)]
+        if "path" in str(query.get("$or")):
+            return FakeCursor(sorted(matched, key=lambda d: d["path"]))
+        return FakeCursor(sorted(matched, key=lambda d: (d["timestamp"], d["_id"]), reverse=True))
+
+def test_article_thread_nested(client):
+    from bson import ObjectId
+    root, reply_a, reply_b, nested = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+    docs = [
+        {"_id": root, "articleId": "nyt1", "content": "root", "timestamp": 1.0, "path": "", "depth": 0, "parentId": None},
+        {"_id": reply_a, "articleId": "nyt1", "content": "a", "timestamp": 2.0, "path": f"{root}/", "depth": 1, "parentId": str(root)},
+        {"_id": reply_b, "articleId": "nyt1", "content": "b", "timestamp": 3.0, "path": f"{root}/", "depth": 1, "parentId": str(root)},
+        {"_id": nested, "articleId": "nyt1", "content": "n", "timestamp": 4.0, "path": f"{root}/{reply_a}/", "depth": 2, "parentId": str(reply_a)},
+    ]
+
+    import app
+    fake = ThreadTestCollection(docs)
+    app.comments_collection = fake
+
+    response = client.get('/api/articles/nyt1/thread?depth=2&limit=1')
+    assert response.status_code == 200
+    body = response.get_json()
+    # roots are paged first, then one range query loads only their subtrees
+    (top_query, projection), (reply_query, _) = fake.queries
+    assert top_query == {"articleId": "nyt1", "depth": 0}
+    assert projection == app.COMMENT_THREAD_PROJECTION
+    assert reply_query == {
+        "articleId": "nyt1",
+        "$or": [{"path": {"$gte": f"{root}/", "$lt": f"{root}0"}}],
+        "depth": {"$gt": 0, "$lte": 2},
+    }
+    [root_node] = body["comments"]
+    assert root_node["content"] == "root"
+    # newest reply first, the second one is behind the "load more replies" cursor
+    assert [r["content"] for r in root_node["replies"]] == ["b"]
+    assert root_node["moreReplies"] is True
+    assert root_node["repliesCursor"] == f"{3.0!r}_{reply_b}"
+    assert root_node["replies"][0]["replies"] == []
+
+def test_article_thread_pages_roots_with_their_replies(client):
+    from bson import ObjectId
+    old_root, new_root, old_reply, new_reply, other = (ObjectId() for _ in range(5))
+    docs = [
+        {"_id": old_root, "articleId": "nyt1", "content": "old", "timestamp": 1.0, "path": "", "depth": 0, "parentId": None},
+        {"_id": new_root, "articleId": "nyt1", "content": "new", "timestamp": 5.0, "path": "", "depth": 0, "parentId": None},
+        {"_id": old_reply, "articleId": "nyt1", "content": "old reply", "timestamp": 2.0, "path": f"{old_root}/", "depth": 1, "parentId": str(old_root)},
+        {"_id": new_reply, "articleId": "nyt1", "content": "new reply", "timestamp": 6.0, "path": f"{new_root}/", "depth": 1, "parentId": str(new_root)},
+        {"_id": other, "articleId": "nyt2", "content": "elsewhere", "timestamp": 9.0, "path": "", "depth": 0, "parentId": None},
+    ]
+
+    import app
+    fake = ThreadTestCollection(docs)
+    app.comments_collection = fake
+
+    first = client.get('/api/articles/nyt1/thread?limit=1').get_json()
+    [newest] = first["comments"]
+    # the newest root comes with its replies, the older subtree is not read for this page
+    assert newest["content"] == "new"
+    assert [r["content"] for r in newest["replies"]] == ["new reply"]
+    assert newest["moreReplies"] is False
+    assert first["nextCursor"] == f"{5.0!r}_{new_root}"
+    assert fake.queries[1][0]["$or"] == [{"path": app.comment_subtree_range(docs[1])}]
+
+    second = client.get(f'/api/articles/nyt1/thread?limit=1&cursor={first["nextCursor"]}').get_json()
+    [older] = second["comments"]
+    assert older["content"] == "old"
+    assert [r["content"] for r in older["replies"]] == ["old reply"]
+    assert second["nextCursor"] is None
+
+def test_comment_subtree_range():
+    from app import comment_subtree_range
+    assert comment_subtree_range({"_id": "abc", "path": "root/"}) == {"$gte": "root/abc/", "$lt": "root/abc0"}
+
+# ----- SEARCH CACHE TESTS -----
+
+NYT_DOC = {
+    "_id": "nyt://article/1",
+    "pub_date": "2025-05-01T12:00:05+0000",
+    "headline": {"main": "Davis Wins"},
+    "byline": {"original": "By Aggie Reporter"},
+    "abstract": "Summary",
+    "web_url": "https://www.nytimes.com/davis",
+    "multimedia": {"default": {"url": "https://img/1.jpg"}},
+}
+
+class FakeNYTResponse:
+    def __init__(self, payload, status_code=200, headers=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = str(payload)
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+    def json(self):
+        return self.payload
+
+def test_search_cache_hit(client, monkeypatch):
+    import app
+    calls = []
+    def fake_get(url, params=None, **kwargs):
+        calls.append(params)
+        return FakeNYTResponse({"response": {"docs": [NYT_DOC]}})
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    monkeypatch.setattr(app.nyt_client.session, "get", fake_get)
+
+    first = client.get('/api/search?query=davis')
+    second = client.get('/api/search?query=%20davis%20')
+    assert first.status_code == second.status_code == 200
+    assert second.json[0]["articleUrl"] == "https://www.nytimes.com/davis"
+    # normalized query shares the cache entry, only one upstream call
+    assert len(calls) == 1
+    assert app.search_cache.stats()["hits"] == 1
+
+def test_search_errors_not_cached(client, monkeypatch):
+    import app
+    calls = []
+    def fake_get(url, params=None, **kwargs):
+        calls.append(params)
+        return FakeNYTResponse({"fault": {"faultstring": "Invalid filter query"}}, status_code=400)
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    monkeypatch.setattr(app.nyt_client.session, "get", fake_get)
+
+    for _ in range(2):
+        response = client.get('/api/search?query=davis')
+        assert response.status_code == 400
+    assert len(calls) == 2
+
+def test_search_cache_lru_and_stale():
+    from app import SearchCache
+    cache = SearchCache(max_entries=2, ttl=0, stale_ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") == (None, None)
+    assert cache.get("c") == (3, "stale")
+    assert cache.begin_refresh("c") is True
+    assert cache.begin_refresh("c") is False
+    cache.end_refresh("c")
+    assert cache.stats()["evictions"] == 1
+
+# ----- NYT CLIENT TESTS -----
+
+def test_nyt_client_retries_transient_errors(monkeypatch):
+    from app import NYTClient, BASE_NYT_URL
+    nyt = NYTClient(BASE_NYT_URL, backoff_base=0)
+    statuses = [503, 429, 200]
+    monkeypatch.setattr(nyt.session, "get", lambda url, params=None, timeout=None: FakeNYTResponse({}, statuses.pop(0)))
+
+    assert nyt.get({"q": "davis"}).status_code == 200
+    assert nyt.stats()["retries"] == 2
+
+def test_nyt_client_long_retry_after_not_retried(monkeypatch):
+    from app import NYTClient, BASE_NYT_URL
+    nyt = NYTClient(BASE_NYT_URL, backoff_base=0, max_queue_wait=1)
+    monkeypatch.setattr(nyt.session, "get",
+                        lambda url, params=None, timeout=None: FakeNYTResponse({}, 429, {"Retry-After": "30"}))
+
+    assert nyt.get({"q": "davis"}).status_code == 429
+    assert nyt.stats()["retries"] == 0
+    # the whole client now backs off instead of burning more quota
+    assert nyt.limiter.retry_after() > 25
+
+def test_search_fails_fast_when_rate_limited(client, monkeypatch):
+    import app
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    app.nyt_client.limiter = app.TokenBucket(rate_per_minute=1, burst=0)
+
+    response = client.get('/api/search?query=davis')
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+def test_shared_token_bucket_spans_workers(tmp_path):
+    import app
+    path = str(tmp_path / "nyt_rate_limit.bin")
+    # two workers with their own bucket objects over the same file: one quota between them
+    worker_a = app.SharedTokenBucket(rate_per_minute=1, burst=2, path=path)
+    worker_b = app.SharedTokenBucket(rate_per_minute=1, burst=2, path=path)
+    assert worker_a.reserve(max_wait=0) == 0
+    assert worker_b.reserve(max_wait=0) == 0
+    assert worker_a.reserve(max_wait=0) is None
+    # a Retry-After seen by one worker holds the other one back too
+    worker_b.block_for(30)
+    assert worker_a.retry_after() > 25
+
+# ----- SINGLE-FLIGHT TESTS -----
+
+def test_concurrent_identical_searches_share_one_call(monkeypatch):
+    import threading
+    import app
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    release = threading.Event()
+    calls = []
+    def slow_get(url, params=None, timeout=None):
+        calls.append(params)
+        release.wait(5)
+        return FakeNYTResponse({"response": {"docs": [NYT_DOC]}})
+    monkeypatch.setattr(app.nyt_client.session, "get", slow_get)
+
+    statuses = []
+    def search():
+        with app.app.test_client() as thread_client:
+            statuses.append(thread_client.get('/api/search?query=davis').status_code)
+
+    threads = [threading.Thread(target=search) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # wait until the leader is upstream and the rest are queued behind it
+    for _ in range(100):
+        if app.search_flight.stats()["shared"] == 4:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 5
+    assert len(calls) == 1
+
+def test_single_flight_follower_timeout():
+    import threading
+    from app import SingleFlight, SingleFlightTimeout
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    leader = threading.Thread(target=lambda: flight.do("key", leader_fn, 1))
+    leader.start()
+    started.wait(5)
+    with pytest.raises(SingleFlightTimeout):
+        flight.do("key", lambda: "never called", 0.01)
+    release.set()
+    leader.join()
+    assert flight.stats() == {"inFlight": 0, "leaders": 1, "shared": 1, "timeouts": 1}
+
+# ----- PREFETCH TESTS -----
+
+def test_next_page_prefetched(client, monkeypatch):
+    import app
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    calls = []
+    def fake_get(url, params=None, timeout=None):
+        calls.append(params["page"])
+        return FakeNYTResponse({"response": {"docs": [NYT_DOC] * app.NYT_PAGE_SIZE}})
+    monkeypatch.setattr(app.nyt_client.session, "get", fake_get)
+    prefetcher = app.SearchPrefetcher(True, workers=1, max_pending=2, min_tokens=1)
+    monkeypatch.setattr(app, "search_prefetcher", prefetcher)
+    submitted = []
+    original_maybe_prefetch = prefetcher.maybe_prefetch
+    monkeypatch.setattr(prefetcher, "maybe_prefetch", lambda key, count: submitted.append(original_maybe_prefetch(key, count)))
+
+    assert client.get('/api/search?query=davis&page=0').status_code == 200
+    submitted[0].result(timeout=5)
+    assert calls == [0, 1]
+
+    assert client.get('/api/search?query=davis&page=1').status_code == 200
+    submitted[1].result(timeout=5)
+    # page 1 came from the prefetch, page 2 was prefetched in turn
+    assert calls == [0, 1, 2]
+    stats = prefetcher.stats()
+    assert stats["hits"] == 1 and stats["completed"] == 2
+
+def test_prefetch_dropped_when_budget_low(monkeypatch):
+    import app
+    prefetcher = app.SearchPrefetcher(True, workers=1, max_pending=2, min_tokens=100)
+    assert prefetcher.maybe_prefetch(("davis", None, None, None, 0), app.NYT_PAGE_SIZE) is None
+    assert prefetcher.stats()["droppedBudget"] == 1
+
+def test_no_prefetch_after_short_page(monkeypatch):
+    import app
+    prefetcher = app.SearchPrefetcher(True, workers=1, max_pending=2, min_tokens=0)
+    # fewer than a full page of results: this was the last page
+    assert prefetcher.maybe_prefetch(("davis", None, None, None, 0), app.NYT_PAGE_SIZE - 1) is None
+    assert prefetcher.stats()["scheduled"] == 0
+
+# ----- ARTICLE STORE TESTS -----
+
+class ArticlesTestCollection:
+    def __init__(self, articles=None):
+        self.articles = articles or {}
+        self.bulk_ops = []
+    def bulk_write(self, ops, ordered=True):
+        self.bulk_ops.extend(ops)
+    def find_one(self, query, projection=None):
+        return self.articles.get(query["id"])
+    def find(self, query, projection=None):
+        return [self.articles[i] for i in query["id"]["$in"] if i in self.articles]
+
+def test_search_stores_articles(client, monkeypatch):
+    import app
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    monkeypatch.setattr(app.nyt_client.session, "get",
+                        lambda url, params=None, timeout=None: FakeNYTResponse({"response": {"docs": [NYT_DOC]}}))
+    store = ArticlesTestCollection()
+    app.articles_collection = store
+
+    assert client.get('/api/search?query=davis').status_code == 200
+    [upsert] = store.bulk_ops
+    assert upsert._filter == {"id": "nyt://article/1"}
+    stored = upsert._doc["$set"]
+    assert stored["headline"] == "Davis Wins"
+    assert stored["publishedAt"].year == 2025
+    assert upsert._upsert is True
+
+def test_get_stored_articles(client):
+    import app
+    article = {"id": "nyt://article/1", "headline": "Davis Wins"}
+    app.articles_collection = ArticlesTestCollection({"nyt://article/1": article})
+
+    response = client.get('/api/articles/nyt://article/1')
+    assert response.status_code == 200
+    assert response.get_json() == article
+    assert client.get('/api/articles/nyt://article/2').status_code == 404
+
+    response = client.post('/api/articles/batch', json={"ids": ["nyt://article/1", "nyt://article/2"]})
+    assert response.status_code == 200
+    assert response.get_json() == {"articles": {"nyt://article/1": article}, "missing": ["nyt://article/2"]}
+
+# ----- EXPORT TESTS -----
+
+class ExportTestCursor(FakeCursor):
+    def batch_size(self, size):
+        self.batch = size
+        return self
+    def close(self):
+        self.closed = True
+
+def test_export_comments_ndjson(client):
+    import json
+    from bson import ObjectId
+    import app
+    docs = [{"_id": ObjectId(), "articleId": "nyt1", "content": str(i), "removed": True} for i in range(3)]
+
+    class TestCollection:
+        def find(self, query, projection):
+            self.query = query
+            self.cursor = ExportTestCursor([dict(d) for d in docs])
+            return self.cursor
+
+    fake = TestCollection()
+    app.comments_collection = fake
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'admin', 'userID': '123'}
+
+    response = client.get('/api/comments/export?articleId=nyt1&removed=true&since=5')
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line["content"] for line in lines] == ["0", "1", "2"]
+    assert lines[0]["id"] == str(docs[0]["_id"])
+    assert fake.query == {"articleId": "nyt1", "timestamp": {"$gte": 5.0}, "removed": True}
+    assert fake.cursor.batch == app.EXPORT_BATCH_SIZE
+    assert fake.cursor.closed
+
+    response = client.get('/api/comments/export?format=json')
+    assert [c["content"] for c in json.loads(response.get_data(as_text=True))] == ["0", "1", "2"]
+
+def test_export_requires_moderator(client):
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'someone', 'userID': '789'}
+    assert client.get('/api/comments/export').status_code == 403
+
+# ----- PRE-FORK SERVING TESTS -----
+
+def test_init_mongo_gives_process_its_own_client():
+    import app
+    parent_client = app.client
+    app.init_mongo()
+    # a fresh, not yet connected client replaces the one inherited from the master
+    assert app.client is not parent_client
+    assert app.comments_collection.database.client is app.client
+
+# ----- SERVER-SIDE SESSION TESTS -----
+
+def test_session_cookie_holds_only_session_id(client):
+    import app
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'testUserName', 'raw_claims': {'sub': 'x' * 2000}}
+    session_id = client.get_cookie(app.app.config["SESSION_COOKIE_NAME"]).value
+    assert len(session_id) < 64
+    assert app.app.session_interface.store.get(session_id)['user']['username'] == 'testUserName'
+    assert client.get('/api/me').get_json()['username'] == 'testUserName'
+
+    client.get('/api/logout')
+    assert app.app.session_interface.store.get(session_id) is None
+    assert client.get('/api/me').get_json() == {"loggedIn": False}
+
+def test_mongo_session_store_caches_reads(monkeypatch):
+    import app
+
+    class SessionsTestCollection:
+        def __init__(self):
+            self.docs = {}
+            self.reads = 0
+        def replace_one(self, query, doc, upsert=False):
+            self.docs[query["_id"]] = doc
+        def find_one(self, query, projection):
+            self.reads += 1
+            doc = self.docs.get(query["_id"])
+            return doc if doc and doc["expiresAt"] > query["expiresAt"]["$gt"] else None
+        def delete_one(self, query):
+            self.docs.pop(query["_id"], None)
+
+    fake = SessionsTestCollection()
+    monkeypatch.setattr(app, "sessions_collection", fake)
+    writer = app.MongoSessionStore(ttl=60, cache_size=10, cache_ttl=60)
+    writer.save("sid", {"user": {"username": "u"}})
+
+    # another worker: first lookup reads Mongo, the rest come from its cache
+    reader = app.MongoSessionStore(ttl=60, cache_size=10, cache_ttl=60)
+    for _ in range(3):
+        assert reader.get("sid") == {"user": {"username": "u"}}
+    assert fake.reads == 1
+
+    writer.delete("sid")
+    assert writer.get("sid") is None
+    assert app.MongoSessionStore(ttl=60, cache_size=10, cache_ttl=60).get("sid") is None
+
+    # unknown ids (stale cookies) are remembered too, only the first lookup reads Mongo
+    fake.reads = 0
+    for _ in range(3):
+        assert reader.get("expired") is None
+    assert fake.reads == 1
+
+def test_stale_session_cookie_is_cleared(client):
+    import app
+    cookie_name = app.app.config["SESSION_COOKIE_NAME"]
+    client.set_cookie(cookie_name, "expired-session-id")
+    response = client.get('/api/me')
+    assert response.get_json() == {"loggedIn": False}
+    assert any(header.startswith(f"{cookie_name}=;") for header in response.headers.getlist("Set-Cookie"))
+    assert client.get_cookie(cookie_name) is None
+
+# ----- ROLE TESTS -----
+
+def test_role_map_from_env(monkeypatch):
+    import app
+    monkeypatch.setenv("ROLE_MAP", '{"usernames": {"alice": "moderator"}, "ids": {"900": "admin"}}')
+    monkeypatch.setattr(app, "ROLE_MAP", app.load_role_map())
+    assert app.resolve_role("1", "alice") == "moderator"
+    assert app.resolve_role("900", "alice") == "admin"
+    # defaults are kept
+    assert app.resolve_role("123", "someone") == "admin"
+    assert app.resolve_role("1", "someone") == "user"
+
+def test_role_required_uses_role_stored_at_login(client):
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'someone', 'userID': '789', 'role': 'moderator'}
+    assert client.get('/api/me').get_json()['role'] == 'moderator'
+    assert client.get('/api/comments/export').status_code != 403
+    assert client.get('/api/admin/stats').status_code == 403
+
+# ----- OIDC CACHING TESTS -----
+
+def test_jwks_cache_reuses_keys_and_throttles_forced_refresh(monkeypatch):
+    import app
+    fetches = []
+    def fake_get(url, timeout=None):
+        fetches.append(url)
+        return FakeNYTResponse({"keys": [{"kid": f"k{len(fetches)}", "kty": "RSA"}]})
+    monkeypatch.setattr(app.requests, "get", fake_get)
+
+    cache = app.JWKSCache("http://dex/keys", ttl=60, min_refresh_interval=30)
+    assert cache.fetch_jwk_set() == {"keys": [{"kid": "k1", "kty": "RSA"}]}
+    cache.fetch_jwk_set()
+    # unknown kid right after a refresh: served from cache instead of calling Dex again
+    cache.fetch_jwk_set(force=True)
+    assert len(fetches) == 1
+
+    cache._fetched_at -= 31
+    assert cache.fetch_jwk_set(force=True)["keys"][0]["kid"] == "k2"
+    stats = cache.stats()
+    assert (stats["hits"], stats["refreshes"], stats["forcedRefreshes"], stats["throttledRefreshes"]) == (1, 2, 1, 1)
+
+def test_authorize_parses_id_token_once(client, monkeypatch):
+    import app
+    parse_calls = []
+
+    class MockOAuthClient:
+        def authorize_access_token(self):
+            # authlib already verified the token and attached the claims
+            return {"id_token": "x", "userinfo": {"sub": "789", "email": "blah@fakeemail.com", "name": "testUserName"}}
+        def parse_id_token(self, token, nonce=None):
+            parse_calls.append(token)
+
+    class MockOAuth:
+        pass
+    setattr(MockOAuth, "test_client", MockOAuthClient())
+    monkeypatch.setattr(app, "oauth", MockOAuth())
+    monkeypatch.setattr(app, "REGISTERED_OIDC_CLIENT_NAME", "test_client")
+    monkeypatch.setattr(app, "users_collection", None)
+    monkeypatch.setattr(app, "login_metrics", app.LoginMetrics())
+
+    with client.session_transaction() as pre_login_session:
+        pre_login_session['nonce'] = 'n'
+    pre_login_id = client.get_cookie(app.app.config["SESSION_COOKIE_NAME"]).value
+
+    response = client.get('/api/authorize')
+    assert response.status_code == 302
+    assert parse_calls == []
+    assert client.get('/api/me').get_json()["username"] == "testUserName"
+    assert app.login_metrics.stats()["logins"] == 1
+    # the login gets a new session id, the one handed out before it is gone
+    assert client.get_cookie(app.app.config["SESSION_COOKIE_NAME"]).value != pre_login_id
+    assert app.app.session_interface.store.get(pre_login_id) is None
+
+# ----- BULK INGEST TESTS -----
+
+class IngestTestCollection:
+    def __init__(self, existing=None):
+        self.existing = existing or []
+        self.inserted = []
+        self.finds = 0
+        self.bulk_writes = []
+    def find(self, query, projection):
+        self.finds += 1
+        return [dict(d) for d in self.existing]
+    def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        self.inserted.extend(docs)
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_writes.append(requests)
+
+def test_ingest_resolves_parents_within_batch(client):
+    import json
+    from bson import ObjectId
+    import app
+    existing_id = ObjectId()
+    comments = IngestTestCollection([{"_id": existing_id, "importId": "old1", "path": "", "depth": 0}])
+    counters = IngestTestCollection()
+    app.comments_collection = comments
+    app.comment_counts_collection = counters
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'admin', 'userID': '123'}
+
+    body = "\n".join([
+        json.dumps({"id": "p1", "articleId": "nyt1", "content": "parent", "author": "a", "timestamp": 5}),
+        json.dumps({"id": "c1", "articleId": "nyt1", "content": "child", "parentId": "p1", "removed": True, "removedBy": "mod"}),
+        json.dumps({"id": "c2", "articleId": "nyt2", "content": "reply to old", "parentId": "old1"}),
+        "{not json",
+        json.dumps({"articleId": "nyt1"}),
+        json.dumps({"id": "old1", "articleId": "nyt1", "content": "again"}),
+        json.dumps({"articleId": "nyt1", "content": "orphan", "parentId": "nope"}),
+    ])
+    response = client.post('/api/comments/ingest?batchSize=100', data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report["inserted"] == 3
+    assert [e["line"] for e in report["errors"]] == [4, 5, 6, 7]
+    # one read and one insert for the whole batch
+    assert comments.finds == 1
+    parent, child, reply = comments.inserted
+    assert parent["timestamp"] == 5.0 and parent["author"] == "a" and parent["path"] == ""
+    assert child["parentId"] == str(parent["_id"]) and child["path"] == f"{parent['_id']}/" and child["depth"] == 1
+    assert reply["parentId"] == str(existing_id)
+    counts = {r._filter["_id"]: r._doc["$inc"] for r in counters.bulk_writes[0]}
+    assert counts == {"nyt1": {"total": 2, "removed": 1}, "nyt2": {"total": 1, "removed": 0}}
+
+def test_ingested_removed_comments_page_through_the_queue(client):
+    import json, time
+    import app
+    comments = IngestTestCollection()
+    app.comments_collection = comments
+    ingest = app.CommentIngest()
+    started = time.time()
+    ingest.add_lines([
+        json.dumps({"articleId": "nyt1", "content": "old", "timestamp": 5, "removed": True, "moderationTimestamp": 7}),
+        json.dumps({"articleId": "nyt1", "content": "older", "timestamp": 4, "removed": True}),
+    ])
+    first, second = comments.inserted
+    assert first["moderationTimestamp"] == 7.0 and second["moderationTimestamp"] >= started
+    # delta sync sees the import even though the comments themselves are historical
+    assert first["lastModified"] >= started and first["timestamp"] == 5.0
+
+    class QueueCollection:
+        def find(self, query):
+            return FakeCursor(sorted(comments.inserted, key=lambda d: d["moderationTimestamp"], reverse=True))
+    app.comments_collection = QueueCollection()
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+    response = client.get('/api/moderation/queue?status=removed&limit=1')
+    assert response.status_code == 200
+    assert response.get_json()["nextCursor"] == app.encode_comment_cursor(second, "moderationTimestamp")
+
+def test_ingest_forgets_comments_that_failed_to_insert(client):
+    import json
+    from pymongo.errors import BulkWriteError
+    import app
+
+    class FailingCollection(IngestTestCollection):
+        deleted = None
+        def insert_many(self, docs, ordered=True):
+            super().insert_many(docs, ordered)
+            # the parent hits a duplicate importId, everything else goes in
+            raise BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "E11000 duplicate key"}]})
+        def delete_many(self, query):
+            self.deleted = query
+    comments = FailingCollection()
+    app.comments_collection = comments
+    app.comment_counts_collection = None
+    ingest = app.CommentIngest()
+    ingest.add_lines([
+        json.dumps({"id": "p1", "articleId": "nyt1", "content": "parent"}),
+        json.dumps({"id": "c1", "articleId": "nyt1", "content": "reply", "parentId": "p1"}),
+        json.dumps({"id": "c2", "articleId": "nyt1", "content": "reply to reply", "parentId": "c1"}),
+        json.dumps({"id": "s1", "articleId": "nyt1", "content": "kept", "removed": "false"}),
+        json.dumps({"id": "s1", "articleId": "nyt1", "content": "same id again"}),
+        json.dumps({"id": "s2", "articleId": "nyt1", "content": "bad flag", "removed": "no"}),
+    ])
+    report = ingest.report()
+    assert report["inserted"] == 1
+    assert [e["line"] for e in report["errors"]] == [5, 6, 1, 2, 3]
+    # the replies were written before the parent failed, they are taken out again
+    assert comments.deleted == {"_id": {"$in": [comments.inserted[1]["_id"], comments.inserted[2]["_id"]]}}
+    kept = comments.inserted[3]
+    assert kept["content"] == "kept" and kept["removed"] is False
+    # only the comment that made it in can be a parent later
+    assert set(ingest._known) == {"s1", str(kept["_id"])}
+
+def test_ingest_requires_admin(client):
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+    assert client.post('/api/comments/ingest', data="").status_code == 403
+
+# ----- COMMENT SEARCH TESTS -----
+
+def test_comment_search_uses_text_index(client):
+    from bson import ObjectId
+    docs = [{"_id": ObjectId(), "articleId": "nyt1", "author": "troll", "content": "You are all IDIOTS here",
+             "timestamp": 10.0 - i, "score": 1.5} for i in range(3)]
+
+    class SearchCursor(FakeCursor):
+        def skip(self, value):
+            self.skip_value = value
+            return self
+
+    class TestCollection:
+        def find(self, query, projection):
+            self.query = query
+            self.projection = projection
+            self.cursor = SearchCursor(docs)
+            return self.cursor
+
+    import app
+    fake = TestCollection()
+    app.comments_collection = fake
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'moderator', 'userID': '456'}
+
+    response = client.get('/api/comments/search?q=idiot%20-nice&articleId=nyt1&since=5&limit=2&page=1')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert fake.query == {"$text": {"$search": "idiot -nice"}, "articleId": "nyt1", "timestamp": {"$gte": 5.0}}
+    assert fake.projection == {"score": {"$meta": "textScore"}}
+    assert fake.cursor.sort_spec[0] == ("score", {"$meta": "textScore"})
+    assert (fake.cursor.skip_value, fake.cursor.limit_value) == (2, 3)
+    assert body["nextPage"] == 2
+    snippet = body["comments"][0]["snippet"]
+    assert [snippet["text"][start:end] for start, end in snippet["highlights"]] == ["IDIOTS"]
+
+    assert client.get('/api/comments/search?q=').status_code == 400
+    assert client.get('/api/comments/search?q=x&limit=100&page=10').status_code == 400
+
+def test_highlight_snippet_windows_long_content():
+    import app
+    text = "a" * 300 + " the word appears here " + "b" * 300
+    snippet = app.highlight_snippet(text, app.comment_search_terms('"word appears"'))
+    assert len(snippet["text"]) == app.COMMENT_SNIPPET_LENGTH
+    assert snippet["truncatedStart"] and snippet["truncatedEnd"]
+    start, end = snippet["highlights"][0]
+    assert snippet["text"][start:end] == "word appears"
+
+# ----- LIVE COMMENT STREAM TESTS -----
+
+def test_comment_stream_delivers_new_comments(client, monkeypatch):
+    import json
+    from bson import ObjectId
+    import app
+    monkeypatch.setattr(app, "SSE_HEARTBEAT_INTERVAL", 0.01)
+    monkeypatch.setattr(app, "SSE_MAX_STREAM_SECONDS", 5)
+
+    class TestCollection:
+        def insert_one(self, doc):
+            class Result:
+                inserted_id = ObjectId()
+            return Result()
+
+    app.comments_collection = TestCollection()
+    response = client.get('/api/articles/nyt://article/1/comments/stream', buffered=False)
+    assert response.mimetype == "text/event-stream"
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b"retry:")
+
+    client.post('/api/comments', json={"articleId": "nyt://article/1", "content": "live!"})
+    client.post('/api/comments', json={"articleId": "nyt2", "content": "other article"})
+    chunk = next(chunk for chunk in chunks if not chunk.startswith(b":"))
+    event_id, event_type, data = chunk.decode().strip().split("\n")
+    assert event_type == "event: comment.created"
+    assert json.loads(data[len("data: "):])["content"] == "live!"
+    response.close()
+    assert app.comment_events.stats()["watchers"] == 0
+
+def test_comment_stream_resumes_after_last_event_id(client, monkeypatch):
+    from bson import ObjectId
+    import app
+    monkeypatch.setattr(app, "SSE_MAX_STREAM_SECONDS", 0)
+    for content in ("first", "second"):
+        app.publish_comment_event("comment.created", {"_id": ObjectId(), "articleId": "nyt1", "content": content})
+    first_id = app.comment_events.recent_events("nyt1", 0)[0][0]["id"]
+
+    body = client.get('/api/articles/nyt1/comments/stream', headers={"Last-Event-ID": first_id}).get_data(as_text=True)
+    assert "second" in body and "first" not in body
+    assert "event: reset" not in body
+
+def test_flask_comment_streams_are_capped_per_worker(client, monkeypatch):
+    import threading
+    import app
+    monkeypatch.setattr(app, "flask_stream_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(app, "SSE_HEARTBEAT_INTERVAL", 0.01)
+
+    first = client.get('/api/articles/nyt1/comments/stream', buffered=False)
+    assert first.status_code == 200
+    # the worker's only stream slot is taken, the next watcher is told to come back later
+    rejected = client.get('/api/articles/nyt1/comments/stream')
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "3"
+
+    first.close()
+    second = client.get('/api/articles/nyt1/comments/stream', buffered=False)
+    assert second.status_code == 200
+    second.close()
+
+def test_flask_comment_stream_closed_before_it_starts(monkeypatch):
+    import threading
+    import app
+    monkeypatch.setattr(app, "flask_stream_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(app, "comment_events", app.CommentEventBroker())
+    with app.app.test_request_context('/api/articles/nyt1/comments/stream'):
+        response = app.stream_article_comments("nyt1")
+    assert app.comment_events.stats()["watchers"] == 1
+    # the server gave up on the response before iterating it, the generator's finally never runs
+    response.close()
+    assert app.comment_events.stats()["watchers"] == 0
+    assert app.flask_stream_slots.acquire(blocking=False)
+
+def test_slow_watcher_is_reset():
+    from bson import ObjectId
+    import app
+    broker = app.CommentEventBroker()
+    subscription = broker.subscribe(app.CommentSubscription("nyt1", max_pending=1))
+    for _ in range(2):
+        broker.dispatch({"id": str(ObjectId()), "type": "comment.created", "articleId": "nyt1", "comment": {}})
+    assert subscription.overflowed
+    assert broker.stats() == {"articlesWatched": 0, "watchers": 0, "published": 2, "delivered": 1, "overflowed": 1}
+
+class EventLogTestCollection:
+    # capped comment_events log, natural order is the order documents were inserted in
+    def __init__(self):
+        self.log = []
+        self.watch_calls = []
+        self.change_stream = []
+    def insert_many(self, docs):
+        self.log.extend(dict(doc) for doc in docs)
+    def find_one(self, query, projection=None, sort=None):
+        docs = self.log if sort[0][1] == 1 else self.log[::-1]
+        return docs[0] if docs else None
+    def find(self, query, projection=None, cursor_type=None):
+        matched = [doc for doc in self.log if doc["seq"] > query["seq"]["$gt"]
+                   and query.get("articleId", doc["articleId"]) == doc["articleId"]]
+        if cursor_type is None:
+            return FakeCursor(sorted(matched, key=lambda doc: doc["seq"]))
+        class TailableCursor(list):
+            # returns what there is, then dies
+            alive = True
+            def __iter__(self):
+                self.alive = False
+                return list.__iter__(self)
+        return TailableCursor(matched)
+    def watch(self, pipeline, resume_after=None):
+        self.watch_calls.append(resume_after)
+        class Stream(list):
+            def __enter__(self):
+                return self
+            def __exit__(self, *exc):
+                return False
+        return Stream(self.change_stream)
+
+class SequencesTestCollection:
+    def __init__(self):
+        self.seq = 0
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self.seq += update["$inc"]["seq"]
+        return {"_id": query["_id"], "seq": self.seq}
+
+def test_event_log_orders_events_by_sequence(monkeypatch):
+    import app
+    events, sequences = EventLogTestCollection(), SequencesTestCollection()
+    monkeypatch.setattr(app, "events_collection", events)
+    monkeypatch.setattr(app, "sequences_collection", sequences)
+    dispatched = []
+    monkeypatch.setattr(app.comment_events, "dispatch", dispatched.append)
+    worker_a, worker_b = app.MongoEventLogFanout(False), app.MongoEventLogFanout(False)
+
+    def event(content):
+        return {"type": "comment.created", "articleId": "nyt1", "comment": {"content": content}}
+
+    worker_a.publish([event("one"), event("two")])
+    follower = app.MongoEventLogFanout(False)
+    follower._follow_once()
+    assert dispatched == [] # events from before the follower started aren't dispatched
+
+    # worker A takes seq 3, worker B takes seq 4 and inserts first, the follower's cursor dies in between
+    sequences.seq = 3
+    worker_b.publish([event("four")])
+    follower._follow_once()
+    events.insert_many([dict(event("three"), seq=3)])
+    follower._follow_once()
+    follower._follow_once()
+    # the out of order insert is still dispatched, and nothing twice
+    assert [e["comment"]["content"] for e in dispatched] == ["four", "three"]
+    assert [e["id"] for e in dispatched] == ["4", "3"]
+
+    # Last-Event-ID resume reads by sequence number
+    replayed, complete = worker_a.replay("nyt1", 1)
+    assert [e["comment"]["content"] for e in replayed] == ["two", "three", "four"]
+    assert complete
+
+def test_event_log_follower_resumes_change_stream(monkeypatch):
+    import app
+    events = EventLogTestCollection()
+    events.change_stream = [{"_id": {"_data": "token"}, "fullDocument": {"seq": 1, "articleId": "nyt1"}}]
+    monkeypatch.setattr(app, "events_collection", events)
+    dispatched = []
+    monkeypatch.setattr(app.comment_events, "dispatch", dispatched.append)
+
+    # reconnects with the resume token of the last change, a redelivered event isn't dispatched again
+    fanout = app.MongoEventLogFanout(use_change_stream=True)
+    fanout._follow_once()
+    fanout._follow_once()
+    assert events.watch_calls == [None, {"_data": "token"}]
+    assert [event["id"] for event in dispatched] == ["1"]
+
+def test_static_manifest_caching_and_precompressed_variants(client, monkeypatch, tmp_path):
+    import app
+    (tmp_path / "index.html").write_text("<html>" + "spa " * 400 + "</html>")
+    (tmp_path / "_app" / "immutable").mkdir(parents=True)
+    (tmp_path / "_app" / "immutable" / "entry.3f2a.js").write_text("console.log('hi');" * 200)
+    assert app.precompress_assets(str(tmp_path)) >= 2
+    monkeypatch.setattr(app, "static_manifest", app.StaticManifest(str(tmp_path)))
+
+    response = client.get('/_app/immutable/entry.3f2a.js', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "Accept-Encoding" in response.headers["Vary"]
+    plain = client.get('/_app/immutable/entry.3f2a.js', headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.get_data(as_text=True).startswith("console.log")
+
+    revalidated = client.get('/_app/immutable/entry.3f2a.js', headers={"If-None-Match": plain.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+def test_static_manifest_falls_back_to_index(client, monkeypatch, tmp_path):
+    import app
+    (tmp_path / "index.html").write_text("<html>spa</html>")
+    monkeypatch.setattr(app, "static_manifest", app.StaticManifest(str(tmp_path)))
+    for path in ('/moderation/queue', '/../app.py', '/index.html'):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.get_data(as_text=True) == "<html>spa</html>"
+        assert response.headers["Cache-Control"] == "no-cache"
+
+def test_api_responses_are_compressed_when_large(client):
+    import gzip, json
+    from bson import ObjectId
+    import app
+    app.comments_collection = DeltaTestCollection([
+        {"_id": ObjectId(), "articleId": "nyt1", "content": "a long comment " * 20, "timestamp": float(i), "lastModified": float(i)}
+        for i in range(50)
+    ])
+    response = client.get('/api/comments', headers={"Accept-Encoding": "br;q=0, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(json.loads(gzip.decompress(response.data))) == 50
+    assert int(response.headers["Content-Length"]) == len(response.data)
+
+    app.comments_collection = DeltaTestCollection([])
+    small = client.get('/api/comments', headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+    stats = app.compression_metrics.stats()
+    assert stats["encodings"]["gzip"]["bytesSaved"] > 0 and stats["skippedSmall"] >= 1
+
+def test_compress_stream_flushes_in_blocks(monkeypatch):
+    import zlib
+    import app
+    monkeypatch.setattr(app, "COMPRESS_STREAM_FLUSH_BYTES", 20)
+    monkeypatch.setattr(app, "COMPRESS_STREAM_FLUSH_SECONDS", 60)
+    decoder = zlib.decompressobj(31)
+    chunks = app.compress_stream("gzip", iter(['{"n": 1}\n', '{"n": 2}\n', '{"n": 3}\n']))
+    # lines are buffered until a block's worth of input, then flushed together (after the gzip header)
+    assert [decoder.decompress(chunk) for chunk in chunks] == [b"", b'{"n": 1}\n{"n": 2}\n{"n": 3}\n', b""]
+
+def test_compress_stream_flushes_slow_streams(monkeypatch):
+    import zlib
+    import app
+    monkeypatch.setattr(app, "COMPRESS_STREAM_FLUSH_SECONDS", 0)
+    decoder = zlib.decompressobj(31)
+    chunks = app.compress_stream("gzip", iter(["data: one\n\n", "data: two\n\n"]))
+    # past the time bound each chunk is readable as soon as it is sent
+    assert decoder.decompress(next(chunks)) == b"data: one\n\n"
+    assert decoder.decompress(next(chunks)) == b"data: two\n\n"
+    assert decoder.decompress(b"".join(chunks)) == b""
+
+def test_json_provider_matches_default_encoding():
+    from datetime import datetime, timezone
+    import json
+    import app
+    with app.app.app_context():
+        # datetimes keep Flask's HTTP date format, ints orjson can't encode fall back to the stdlib
+        body = json.loads(app.jsonify({"when": datetime(2025, 5, 1, tzinfo=timezone.utc), "big": 2 ** 70}).get_data())
+    assert body == {"when": "Thu, 01 May 2025 00:00:00 GMT", "big": 2 ** 70}
+
+def test_metrics_endpoint_reports_routes_and_nyt(client, monkeypatch):
+    import app
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    monkeypatch.setattr(app.nyt_client.session, "get",
+                        lambda url, params=None, **kwargs: FakeNYTResponse({"response": {"docs": [NYT_DOC]}}))
+    assert client.get('/api/search?query=metrics').status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    # labelled by route template and status, not by raw path
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/search",status="200"}' in body
+    assert 'nyt_request_duration_seconds_count{status="200"}' in body
+
+def test_mongo_listeners_record_commands_and_checkouts():
+    from types import SimpleNamespace
+    from prometheus_client import REGISTRY
+    import app
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+    commands_before = sample("mongodb_command_duration_seconds_count", {"command": "find", "outcome": "ok"})
+    checkouts_before = sample("mongodb_pool_checkout_wait_seconds_count", {"outcome": "ok"})
+
+    command_listener, pool_listener = app.MONGO_EVENT_LISTENERS
+    command_listener.succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+    pool_listener.connection_check_out_started(None)
+    pool_listener.connection_checked_out(None)
+    # a checkout without a matching start (listener added mid-checkout) isn't counted
+    pool_listener.connection_checked_out(None)
+
+    assert sample("mongodb_command_duration_seconds_count", {"command": "find", "outcome": "ok"}) == commands_before + 1
+    assert sample("mongodb_pool_checkout_wait_seconds_count", {"outcome": "ok"}) == checkouts_before + 1
+
+# ----- PROFILING TESTS -----
+
+def test_admin_can_profile_a_request(client, monkeypatch):
+    from types import SimpleNamespace
+    from bson import ObjectId
+    import app
+    monkeypatch.setattr(app, "request_profiler", app.RequestProfiler(buffer_size=2, sample_rate=0, slow_seconds=0))
+    app.comments_collection = DeltaTestCollection([
+        {"_id": ObjectId(), "articleId": "nyt1", "content": "hi", "timestamp": 10.0, "lastModified": 10.0},
+    ])
+    # X-Profile is ignored for anyone but an admin
+    assert "X-Profile-Id" not in client.get('/api/comments', headers={"X-Profile": "1"}).headers
+
+    with client.session_transaction() as test_session:
+        test_session['user'] = {'username': 'admin', 'userID': '123', 'role': 'admin'}
+    response = client.get('/api/comments', headers={"X-Profile": "1"})
+    report_id = response.headers["X-Profile-Id"]
+
+    listed = client.get('/api/admin/profiles').get_json()
+    assert [report["id"] for report in listed["reports"]] == [report_id]
+    assert "callTree" not in listed["reports"][0]
+    report = client.get(f'/api/admin/profiles/{report_id}').get_json()
+    assert report["path"] == "/api/comments" and report["trigger"] == "header"
+    assert any("get_all_comments" in entry["function"] for entry in report["topFunctions"])
+    assert report["callTree"]
+
+    # Mongo commands run by the request are attributed to its trace
+    trace = app.request_profiler.start("GET", "/api/comments", "header")
+    app.MONGO_EVENT_LISTENERS[0].succeeded(SimpleNamespace(command_name="find", duration_micros=2000))
+    mongo = app.request_profiler.finish(trace, 200)["mongo"]
+    assert mongo["operations"] == 1 and mongo["byCommand"]["find"]["count"] == 1
+
+def test_slow_request_stack_is_sampled():
+    import threading, time
+    import app
+    profiler = app.RequestProfiler(buffer_size=5, sample_rate=0, slow_seconds=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def stuck_in_here():
+        trace = profiler.start("GET", "/api/slow", None)
+        started.set()
+        release.wait(5)
+        profiler.finish(trace, 200)
+
+    worker = threading.Thread(target=stuck_in_here)
+    worker.start()
+    started.wait(5)
+    time.sleep(0.1)
+    profiler.sample_slow_requests()
+    report = profiler.list_reports()[0]
+    assert report["running"] is True and report["kind"] == "slow"
+    assert any("stuck_in_here" in frame for frame in profiler.get_report(report["id"])["stack"])
+
+    release.set()
+    worker.join()
+    report = profiler.get_report(report["id"])
+    assert report["running"] is False and report["durationSeconds"] >= 0.05
+    assert profiler.stats()["slow"] == 1
@@ -0,0 +1,333 @@
+# Runs the test_app.py scenarios for the routes served by both modes (/api/search,
+# /api/comments, /api/me) against the Flask app and the ASGI app (asgi.py), with the same
+# fake collections and NYT responses, and checks they answer the same way.
+
+import gzip
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+import httpx
+from bson import ObjectId
+from starlette.testclient import TestClient
+
+import app as core
+import asgi
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+    def sort(self, key, direction=None):
+        if isinstance(key, list):
+            # ascending compound sort, only used by the delta keyset
+            self.docs = sorted(self.docs, key=lambda d: tuple(d.get(field) for field, _ in key))
+            return self
+        self.docs = sorted(self.docs, key=lambda d: d.get(key) or 0, reverse=direction == -1)
+        return self
+    def limit(self, value):
+        self.docs = self.docs[:value]
+        return self
+    def __iter__(self):
+        return iter(self.docs)
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeComments:
+    # just enough of a collection for the shared comment routes
+    def __init__(self, docs=None):
+        self.docs = docs or []
+    def find(self, query=None, projection=None):
+        query = query or {}
+        docs = self.docs
+        if "lastModified" in query:
+            docs = [d for d in docs if d["lastModified"] > query["lastModified"]["$gt"]]
+        elif "$or" in query:
+            newer, tied = query["$or"]
+            docs = [d for d in docs if d["lastModified"] > newer["lastModified"]["$gt"]
+                    or (d["lastModified"] == tied["lastModified"] and d["_id"] > tied["_id"]["$gt"])]
+        return FakeCursor(list(docs))
+    def find_one(self, query, projection=None):
+        return next((d for d in self.docs if d["_id"] == query["_id"]), None)
+    def insert_one(self, doc):
+        doc["_id"] = ObjectId()
+        self.docs.append(doc)
+        class Result:
+            inserted_id = doc["_id"]
+        return Result()
+    def estimated_document_count(self):
+        return len(self.docs)
+
+
+class AsyncFakeComments:
+    # Motor flavour of the same fake, backed by the same documents
+    def __init__(self, sync_fake):
+        self.sync_fake = sync_fake
+    def find(self, query=None, projection=None):
+        return self.sync_fake.find(query, projection)
+    async def find_one(self, query, projection=None):
+        return self.sync_fake.find_one(query, projection)
+    async def insert_one(self, doc):
+        return self.sync_fake.insert_one(doc)
+    async def estimated_document_count(self):
+        return self.sync_fake.estimated_document_count()
+
+
+class ParityResponse:
+    def __init__(self, status_code, body, headers, text=""):
+        self.status_code = status_code
+        self.json = body
+        self.headers = headers
+        self.text = text
+
+
+class FlaskMode:
+    def __init__(self, monkeypatch, comments, nyt_handler):
+        monkeypatch.setattr(core, "comments_collection", comments)
+        monkeypatch.setattr(core.nyt_client.session, "get",
+                            lambda url, params=None, timeout=None: nyt_handler(params))
+        self.client = core.app.test_client()
+    def request(self, method, path, cookie=None, **kwargs):
+        if cookie:
+            self.client.set_cookie(core.app.config["SESSION_COOKIE_NAME"], cookie)
+        response = self.client.open(path, method=method, **kwargs)
+        data = response.get_data()
+        # decode like httpx does in ASGI mode
+        if response.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        text = data.decode()
+        try:
+            body = json.loads(text)
+        except ValueError:
+            body = None
+        return ParityResponse(response.status_code, body, response.headers, text)
+
+
+class AsgiMode:
+    def __init__(self, monkeypatch, comments, nyt_handler):
+        self.client = TestClient(asgi.application)
+        self.client.__enter__() # runs the lifespan (async Mongo + httpx clients)
+        monkeypatch.setattr(asgi, "comments_collection", AsyncFakeComments(comments))
+        monkeypatch.setattr(asgi, "comment_counts_collection", None)
+        monkeypatch.setattr(asgi, "articles_collection", None)
+        def transport(request):
+            params = dict(request.url.params)
+            params["page"] = int(params["page"])
+            fake = nyt_handler(params)
+            return httpx.Response(fake.status_code, json=fake.payload)
+        asgi.nyt_http.http = httpx.AsyncClient(transport=httpx.MockTransport(transport))
+    def request(self, method, path, cookie=None, headers=None, json=None):
+        self.client.cookies.clear()
+        if cookie:
+            self.client.cookies.set(core.app.config["SESSION_COOKIE_NAME"], cookie)
+        response = self.client.request(method, path, headers=headers, json=json)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return ParityResponse(response.status_code, body, response.headers, response.text)
+    def close(self):
+        self.client.__exit__(None, None, None)
+
+
+class FakeNYT:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = {}
+        self.text = str(payload)
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+    def json(self):
+        return self.payload
+
+
+NYT_DOC = {
+    "_id": "nyt://article/1",
+    "pub_date": "2025-05-01T12:00:05+0000",
+    "headline": {"main": "Davis Wins"},
+    "byline": {"original": "By Aggie Reporter"},
+    "abstract": "Summary",
+    "web_url": "https://www.nytimes.com/davis",
+    "multimedia": {"default": {"url": "https://img/1.jpg"}},
+}
+
+
+@pytest.fixture
+def comments():
+    return FakeComments([
+        {"_id": ObjectId(), "articleId": "nyt1", "author": "a", "content": "old", "timestamp": 10.0, "lastModified": 10.0},
+        {"_id": ObjectId(), "articleId": "nyt1", "author": "b", "content": "edited", "timestamp": 11.0, "lastModified": 30.0},
+    ])
+
+
+@pytest.fixture
+def nyt_calls():
+    return []
+
+
+@pytest.fixture(params=["wsgi", "asgi"])
+def server(request, monkeypatch, comments, nyt_calls):
+    monkeypatch.setenv("NYT_API_KEY", "test-key")
+    monkeypatch.setattr(core, "comment_counts_collection", None)
+    monkeypatch.setattr(core, "articles_collection", None)
+    monkeypatch.setattr(core.app.session_interface, "store", core.MemorySessionStore(100, 60))
+    monkeypatch.setattr(core, "comment_fanout", core.LocalFanout())
+    monkeypatch.setattr(core, "comment_events", core.CommentEventBroker())
+    monkeypatch.setattr(core, "search_cache", core.SearchCache(8, 60, 60))
+    monkeypatch.setattr(core, "nyt_client", core.NYTClient(core.BASE_NYT_URL, backoff_base=0))
+    monkeypatch.setattr(core, "search_prefetcher", core.SearchPrefetcher(False, 1, 1, 0))
+
+    def nyt_handler(params):
+        nyt_calls.append(params)
+        if params.get("q") == "limes":
+            return FakeNYT({"fault": {"faultstring": "Invalid query"}}, status_code=400)
+        return FakeNYT({"response": {"docs": [NYT_DOC]}})
+
+    mode = FlaskMode(monkeypatch, comments, nyt_handler) if request.param == "wsgi" \
+        else AsgiMode(monkeypatch, comments, nyt_handler)
+    yield mode
+    if request.param == "asgi":
+        mode.close()
+
+
+def session_cookie(user):
+    session_id = f"test-session-{user['username']}"
+    core.app.session_interface.store.save(session_id, {"user": user})
+    return session_id
+
+
+def test_add_comment(server, comments):
+    response = server.request("POST", "/api/comments",
+                              json={"articleId": "123", "author": "TEMP - Anon", "content": "I love puppies!"})
+    assert response.status_code == 201
+    assert response.json["articleId"] == "123"
+    assert response.json["author"] == "TEMP - Anon"
+    assert response.json["content"] == "I love puppies!"
+    assert response.json["removed"] is False
+    assert comments.docs[-1]["path"] == "" and comments.docs[-1]["depth"] == 0
+
+
+def test_add_reply_logged_in(server, comments):
+    parent = comments.docs[0]
+    response = server.request("POST", "/api/comments", cookie=session_cookie({"username": "testUserName"}),
+                              json={"articleId": "nyt1", "content": "reply", "parentId": str(parent["_id"])})
+    assert response.status_code == 201
+    assert response.json["author"] == "testUserName"
+    assert response.json["parentId"] == str(parent["_id"])
+    assert comments.docs[-1]["path"] == f"{parent['_id']}/"
+
+
+def test_add_comment_missing_fields(server):
+    response = server.request("POST", "/api/comments", json={"content": "no article"})
+    assert response.status_code == 400
+
+
+def test_get_comments_and_etag(server):
+    response = server.request("GET", "/api/comments")
+    assert response.status_code == 200
+    assert [c["content"] for c in response.json] == ["edited", "old"]
+
+    response = server.request("GET", "/api/comments", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_get_comments_since(server):
+    response = server.request("GET", "/api/comments?since=20")
+    assert response.status_code == 200
+    assert [c["content"] for c in response.json["comments"]] == ["edited"]
+    assert response.json["highWaterMark"] == f"30.0_{response.json['comments'][0]['id']}"
+    # the cursor resumes after the last comment sent
+    assert server.request("GET", f"/api/comments?since={response.json['highWaterMark']}").json["comments"] == []
+
+    assert server.request("GET", "/api/comments?since=yesterday").status_code == 400
+
+
+def test_me(server):
+    assert server.request("GET", "/api/me").json == {"loggedIn": False}
+
+    response = server.request("GET", "/api/me", cookie=session_cookie({"username": "moderator", "userID": "456"}))
+    assert response.status_code == 200
+    assert response.json["loggedIn"] is True
+    assert response.json["role"] == "moderator"
+
+
+def test_search(server, nyt_calls):
+    for _ in range(2):
+        response = server.request("GET", "/api/search?query=davis")
+        assert response.status_code == 200
+        assert response.json[0]["articleUrl"].startswith("https://www.nytimes.com/")
+    # second request is served from the shared cache
+    assert len(nyt_calls) == 1
+
+
+def test_bad_search(server):
+    response = server.request("GET", "/api/search?query=limes")
+    assert response.status_code == 400
+    assert response.json == {"error": "Failed to retrieve articles from NYT."}
+
+
+def test_flask_fallback_route(server):
+    # non-shared routes fall through to Flask in ASGI mode
+    response = server.request("GET", "/api/test_articles")
+    assert response.status_code == 200
+    assert response.json[0]["id"] == "nyt1"
+
+
+def test_comment_stream_resume(server, monkeypatch):
+    monkeypatch.setattr(core, "SSE_MAX_STREAM_SECONDS", 0)
+    for content in ("first", "second"):
+        core.publish_comment_event("comment.created", {"_id": ObjectId(), "articleId": "nyt://article/1", "content": content})
+    first_id = core.comment_events.recent_events("nyt://article/1", 0)[0][0]["id"]
+
+    response = server.request("GET", "/api/articles/nyt://article/1/comments/stream", headers={"Last-Event-ID": first_id})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    assert response.text.startswith("retry: ")
+    assert "event: comment.created" in response.text
+    assert "second" in response.text and "first" not in response.text
+
+
+def test_comments_compressed(server, monkeypatch):
+    monkeypatch.setattr(core, "COMPRESS_MIN_BYTES", 0)
+    response = server.request("GET", "/api/comments", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert [c["content"] for c in response.json] == ["edited", "old"]
+    # the encoded body gets a weak ETag, which still revalidates
+    assert response.headers["ETag"].startswith('W/"')
+    revalidated = server.request("GET", "/api/comments", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    # the 304 names the same validator the compressed 200 did
+    assert revalidated.headers["ETag"] == response.headers["ETag"]
+    identity = server.request("GET", "/api/comments", headers={"Accept-Encoding": "identity", "If-None-Match": response.headers["ETag"]})
+    assert identity.status_code == 304 and not identity.headers["ETag"].startswith("W/")
+
+
+def test_asgi_session_lookup_off_event_loop(monkeypatch, comments):
+    import asyncio
+    on_event_loop = []
+    load_session_cookie = core.load_session_cookie
+    def recording_load(cookie_value):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return load_session_cookie(cookie_value)
+    monkeypatch.setattr(core.app.session_interface, "store", core.MemorySessionStore(100, 60))
+    monkeypatch.setattr(core, "load_session_cookie", recording_load)
+
+    mode = AsgiMode(monkeypatch, comments, lambda params: FakeNYT({"response": {"docs": []}}))
+    try:
+        response = mode.request("GET", "/api/me", cookie=session_cookie({"username": "a", "userID": "1"}))
+    finally:
+        mode.close()
+    assert response.json["loggedIn"] is True
+    # the store may hit Mongo, the lookup runs in a worker thread
+    assert on_event_loop == [False]